@@ -0,0 +1,190 @@
+import time
+import logging
+import threading
+from datetime import datetime
+
+from metrics import get_metrics
+
+MB = 1024 * 1024
+REFRESH_EVERY = 5  # secondi fra due controlli della fascia oraria attiva
+GLOBAL = "global"
+
+
+def parse_time(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class Window:
+    """Fascia oraria con un proprio limite, es. {"start": "08:00", "end": "18:00", "limit_mb_s": 2}.
+
+    `max_file_mb` rimanda i file piu' grandi a fuori fascia; `days` (0 =
+    lunedi') limita la fascia ad alcuni giorni. Una fascia con inizio dopo
+    la fine attraversa la mezzanotte.
+    """
+
+    def __init__(self, spec):
+        self.start = parse_time(spec["start"])
+        self.end = parse_time(spec["end"])
+        self.limit = spec.get("limit_mb_s")
+        self.max_file_mb = spec.get("max_file_mb")
+        self.days = set(spec["days"]) if spec.get("days") is not None else None
+        self.label = f"{spec['start']}-{spec['end']}"
+
+    def contains(self, now):
+        minute = now.hour * 60 + now.minute
+        if self.start <= self.end:
+            inside = self.start <= minute < self.end
+            day = now.weekday()
+        else:
+            inside = minute >= self.start or minute < self.end
+            # Dopo la mezzanotte la fascia appartiene al giorno in cui e' iniziata
+            day = now.weekday() if minute >= self.start else (now.weekday() - 1) % 7
+        return inside and (self.days is None or day in self.days)
+
+
+class TokenBucket:
+    """Token bucket condiviso da piu' thread; `rate` in byte/s, None = illimitato.
+
+    Chi consuma oltre i token disponibili li prende "a debito" e dorme il
+    tempo necessario a ripagarlo, quindi trasferimenti concorrenti si
+    spartiscono il limite senza superarlo.
+    """
+
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.capacity = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate) if rate else None
+            # Raffica massima: un secondo di traffico
+            self.capacity = self.rate or 0
+            self.tokens = min(self.tokens, self.capacity)
+
+    def consume(self, amount):
+        """Preleva `amount` byte; ritorna i secondi di attesa imposti."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class BandwidthLimiter:
+    """Limite di banda di un profilo (o globale), con fasce orarie.
+
+    `consume` viene chiamato da SftpClient per ogni blocco trasferito; il
+    bucket e' condiviso da tutti i canali del profilo e, tramite `parent`,
+    dal limite globale del processo.
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.bucket = TokenBucket()
+        self.default_limit = None
+        self.windows = []
+        self.max_file_size = None
+        self.log_callback = None
+        self.waited = 0.0  # secondi di attesa imposti dal limite, totale dall'avvio
+        self._active = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, limit_mb_s=None, windows=None, log_callback=None):
+        self.default_limit = limit_mb_s
+        self.windows = [Window(spec) for spec in (windows or [])]
+        self.log_callback = log_callback
+        self._checked = 0.0
+        self.refresh()
+
+    @property
+    def limited(self):
+        return bool(self.default_limit or self.windows or (self.parent is not None and self.parent.limited))
+
+    def current(self, now=None):
+        """Ritorna (limite in MB/s o None, dimensione massima dei file in byte o None, descrizione)."""
+        now = now or datetime.now()
+        for window in self.windows:
+            if window.contains(now):
+                max_file = window.max_file_mb * MB if window.max_file_mb is not None else None
+                return window.limit, max_file, f"window {window.label}"
+        return self.default_limit, None, "default"
+
+    def refresh(self):
+        with self._lock:
+            self._checked = time.monotonic()
+            limit, self.max_file_size, label = self.current()
+            active = (limit, self.max_file_size, label)
+            if active == self._active:
+                return
+            self._active = active
+        self.bucket.set_rate(limit * MB if limit else None)
+        get_metrics().set("bandwidth_limit_bytes_per_second", int(limit * MB) if limit else 0, scope=self.name)
+        if limit or self.max_file_size is not None:
+            described = f"{limit} MB/s" if limit else "unlimited"
+            if self.max_file_size is not None:
+                described += f", files up to {self.max_file_size / MB:g} MB"
+            self._log(f"Bandwidth limit for {self.name}: {described} ({label})")
+
+    def consume(self, amount):
+        if time.monotonic() - self._checked > REFRESH_EVERY:
+            self.refresh()
+        waited = self.bucket.consume(amount)
+        if waited:
+            self.waited += waited
+            get_metrics().inc("bandwidth_wait_seconds_total", waited, scope=self.name)
+        if self.parent is not None:
+            self.parent.consume(amount)
+
+    def allows(self, size):
+        """False se la fascia attiva, del profilo o globale, rimanda i file di questa dimensione."""
+        if time.monotonic() - self._checked > REFRESH_EVERY:
+            self.refresh()
+        if self.max_file_size is not None and size > self.max_file_size:
+            return False
+        return self.parent is None or self.parent.allows(size)
+
+    def _log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name=GLOBAL):
+    """Ritorna il limitatore condiviso dal processo per il profilo `name` (GLOBAL per quello globale)."""
+    with _limiters_lock:
+        if GLOBAL not in _limiters:
+            _limiters[GLOBAL] = BandwidthLimiter(GLOBAL)
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = BandwidthLimiter(name, parent=_limiters[GLOBAL])
+        return limiter
+
+
+def limiter_for(settings, profile, log_callback=None):
+    """Limitatore del profilo configurato da "bandwidth_limit" (MB/s) e "bandwidth_windows"; None se senza limiti."""
+    limiter = get_limiter(profile)
+    limiter.configure(settings.get("bandwidth_limit"), settings.get("bandwidth_windows"), log_callback)
+    return limiter if limiter.limited else None
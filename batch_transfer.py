@@ -0,0 +1,244 @@
+"""Invio dei file piccoli raggruppati in archivi tar, un solo trasferimento per archivio.
+
+Migliaia di file da pochi KB costano soprattutto andata e ritorno con il
+server (open, write, close, rename per ognuno). Con "batch_small_files" i
+file fino a "batch_max_file_kb" vengono raccolti in archivi tar costruiti al
+volo e scritti direttamente sul file remoto, senza file temporanei:
+
+    .ftpbatch-20240501-101500-4242-0001.tar.gz
+
+Con "batch_unpack": "remote" l'archivio viene estratto sul server con tar
+via SSH (se l'account puo' eseguire comandi) e poi cancellato; altrimenti
+resta nella cartella remota e viene estratto dal lato che lo scarica con
+"batch_small_files" attivo. In entrambi i casi il registro riporta ogni
+file dell'archivio, non l'archivio.
+"""
+import os
+import time
+import shlex
+import shutil
+import logging
+import tarfile
+import posixpath
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # facoltativo: senza, gli archivi "zstd" vengono compressi con gzip
+    zstandard = None
+
+from sftp_client import PART_SUFFIX
+from metrics import get_metrics
+from tree_walker import local_path, remote_path
+
+ARCHIVE_PREFIX = ".ftpbatch-"
+MAX_FILE_KB = 64  # default di "batch_max_file_kb"
+MAX_BATCH_MB = 32  # default di "batch_max_mb"
+MAX_BATCH_FILES = 5000  # default di "batch_max_files"
+UNPACK_TIMEOUT = 300  # secondi concessi a tar sul server
+
+# compressione: (estensione, modo di tarfile, comando che estrae {archive} sul server)
+COMPRESSIONS = {
+    "none": (".tar", "w|", "tar -xf {archive}"),
+    "gzip": (".tar.gz", "w|gz", "tar -xzf {archive}"),
+    "zstd": (".tar.zst", "w|", "zstd -dc {archive} | tar -xf -"),
+}
+UNPACK_MODES = ("remote", "none")
+
+_no_remote_unpack = set()  # host:porta dove l'estrazione remota e' fallita
+_no_remote_unpack_lock = threading.Lock()
+
+
+def is_archive(name):
+    base = posixpath.basename(name)
+    return base.startswith(ARCHIVE_PREFIX) and any(base.endswith(extension) for extension, _, _ in COMPRESSIONS.values())
+
+
+class BatchResult:
+    def __init__(self, archive):
+        self.archive = archive  # percorso remoto
+        self.members = []  # job (name, source, destination, size) finiti nell'archivio
+        self.ok = False
+        self.error = None
+        self.size = 0  # byte inviati
+        self.duration = 0.0
+        self.unpacked = False
+
+
+class BatchUploader:
+    """Divide i job di upload fra file grandi e lotti di file piccoli, e carica i lotti come archivi."""
+
+    def __init__(self, sftp_client, remote_dir, max_file_kb=MAX_FILE_KB, max_batch_mb=MAX_BATCH_MB,
+                 max_files=MAX_BATCH_FILES, compression="gzip", unpack="remote", log_callback=None):
+        self.log_callback = log_callback
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown batch compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+        if unpack not in UNPACK_MODES:
+            raise ValueError(f"unknown batch unpack mode {unpack!r}, expected one of {', '.join(UNPACK_MODES)}")
+        if compression == "zstd" and zstandard is None:
+            self.log("zstandard is not installed, batch archives are compressed with gzip")
+            compression = "gzip"
+        self.sftp_client = sftp_client
+        self.remote_dir = remote_dir
+        self.max_file = max_file_kb * 1024
+        self.max_batch = max_batch_mb * 1024 * 1024
+        self.max_files = max_files
+        self.compression = compression
+        self.unpack = unpack
+        # Con "transfer_transforms" anche gli archivi vengono compressi/cifrati e prendono le loro estensioni
+        self.transforms = sftp_client.transforms
+        if self.transforms is not None and unpack == "remote":
+            self.log("Batch archives go through transfer_transforms, they are unpacked by the receiving side")
+            self.unpack = "none"
+
+    @classmethod
+    def from_settings(cls, settings, sftp_client, remote_dir, log_callback=None):
+        """None se "batch_small_files" non e' attivo."""
+        if not settings.get("batch_small_files"):
+            return None
+        return cls(
+            sftp_client, remote_dir,
+            max_file_kb=settings.get("batch_max_file_kb") or MAX_FILE_KB,
+            max_batch_mb=settings.get("batch_max_mb") or MAX_BATCH_MB,
+            max_files=settings.get("batch_max_files") or MAX_BATCH_FILES,
+            compression=settings.get("batch_compression") or "gzip",
+            unpack=settings.get("batch_unpack") or "remote",
+            log_callback=log_callback,
+        )
+
+    def split(self, jobs):
+        """Ritorna (job da trasferire uno per uno, lotti di job), mantenendo l'ordine della coda."""
+        single = []
+        batches = []
+        current = []
+        current_size = 0
+        for job in jobs:
+            size = job[3]
+            if size > self.max_file:
+                single.append(job)
+                continue
+            if current and (current_size + size > self.max_batch or len(current) >= self.max_files):
+                batches.append(current)
+                current = []
+                current_size = 0
+            current.append(job)
+            current_size += size
+        if current:
+            batches.append(current)
+        # Un lotto di un solo file non fa risparmiare nulla
+        single.extend(batch[0] for batch in batches if len(batch) == 1)
+        return single, [batch for batch in batches if len(batch) > 1]
+
+    def run(self, batches):
+        """Carica i lotti uno dopo l'altro e produce un BatchResult per ognuno."""
+        stamp = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        extension = COMPRESSIONS[self.compression][0]
+        if self.transforms is not None:
+            extension += self.transforms.suffix
+        for number, batch in enumerate(batches, 1):
+            result = BatchResult(remote_path(self.remote_dir, f"{ARCHIVE_PREFIX}{stamp}-{number:04d}{extension}"))
+            start = time.monotonic()
+            try:
+                result.size = self.sftp_client.upload_stream(
+                    result.archive, lambda file: self._produce(file, batch, result.members))
+                result.ok = True
+            except Exception as e:
+                result.error = e
+            result.duration = time.monotonic() - start
+            get_metrics().record_transfer("to_remote", posixpath.basename(result.archive), result.size,
+                                          result.duration, result.error)
+            if result.ok:
+                get_metrics().inc("batch_files_total", len(result.members), direction="to_remote")
+                if self.unpack == "remote":
+                    result.unpacked = self._unpack_remote(result.archive)
+            yield result
+
+    def _produce(self, file, batch, members):
+        if self.transforms is None:
+            self._write_archive(file, batch, members)
+            return
+        writer = self.transforms.encoding_writer(file.write)
+        self._write_archive(writer, batch, members)
+        writer.close()
+
+    def _write_archive(self, file, batch, members):
+        compressor = None
+        if self.compression == "zstd":
+            compressor = file = zstandard.ZstdCompressor().stream_writer(file, closefd=False)
+        with tarfile.open(fileobj=file, mode=COMPRESSIONS[self.compression][1], format=tarfile.PAX_FORMAT) as tar:
+            for job in batch:
+                try:
+                    with open(job[1], "rb") as source:
+                        info = tar.gettarinfo(arcname=job[0], fileobj=source)
+                        info.uid = info.gid = 0
+                        info.uname = info.gname = ""
+                        tar.addfile(info, source)
+                except FileNotFoundError:
+                    # Sparito dopo la scansione: viene ritentato al prossimo ciclo
+                    self.log(f"File {job[0]} disappeared before it could be archived")
+                    continue
+                members.append(job)
+        if compressor is not None:
+            compressor.close()
+
+    def _unpack_remote(self, archive):
+        host = f"{self.sftp_client.host}:{self.sftp_client.port}"
+        if host in _no_remote_unpack:
+            return False
+        directory, name = posixpath.split(archive)
+        command = " && ".join((
+            f"cd {shlex.quote(directory or '.')}",
+            COMPRESSIONS[self.compression][2].format(archive=shlex.quote(name)),
+            f"rm -f {shlex.quote(name)}",
+        ))
+        try:
+            status, error = self.sftp_client.exec_command(command, timeout=UNPACK_TIMEOUT)
+        except Exception as e:
+            status, error = None, str(e)
+        if status == 0:
+            return True
+        with _no_remote_unpack_lock:
+            _no_remote_unpack.add(host)
+        self.log(f"Remote unpack is not available on {host} ({error or f'exit status {status}'}), "
+                 f"batch archives are left in {directory or '.'} for the receiving side")
+        return False
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
+
+
+def unpack_archive(path, destination):
+    """Estrae l'archivio locale `path` in `destination` e ritorna i nomi dei file estratti.
+
+    Ogni file viene scritto su `.part` e poi rinominato, quindi chi legge la
+    cartella non vede mai un file a meta'. I nomi assoluti o con ".." fanno
+    fallire l'estrazione.
+    """
+    names = []
+    with open(path, "rb") as raw:
+        stream = raw
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to unpack {path}")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        with tarfile.open(fileobj=stream, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                parts = member.name.split("/")
+                if member.name.startswith("/") or ".." in parts:
+                    raise ValueError(f"unsafe member {member.name!r} in {path}")
+                target = local_path(destination, member.name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                temp = target + PART_SUFFIX
+                with tar.extractfile(member) as src, open(temp, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.utime(temp, (member.mtime, member.mtime))
+                os.replace(temp, target)
+                names.append(member.name)
+    get_metrics().inc("batch_files_total", len(names), direction="to_local")
+    return names
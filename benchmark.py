@@ -0,0 +1,180 @@
+"""Misura il throughput SFTP al variare dei parametri di tuning.
+
+Esempio, contro un server SFTP locale:
+
+    python benchmark.py --host 127.0.0.1 --username bench --password bench \\
+        --remote-dir /tmp --size-mb 256 \\
+        --window-size 2097152,16777216 --max-packet-size 32768,262144 \\
+        --ciphers aes128-ctr,aes128-gcm@openssh.com --compression off,on
+
+Ogni combinazione viene provata con upload e download dello stesso file;
+la tabella finale riporta i MB/s, il risultato migliore per primo. Il
+blocco "sftp_tuning" della riga migliore si puo' copiare nel profilo.
+
+Con `--local-server` il confronto gira contro il server SFTP in-process di
+`local_sftp_server.py`, senza bisogno di credenziali. Per misurare l'intero
+tool (listing, registro, ciclo di sync) usare `benchmark_suite.py`.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import tempfile
+
+from sftp_client import SftpClient, TUNING_DEFAULTS
+
+MB = 1024 * 1024
+
+
+def parse_list(value, cast=int):
+    """'a,b,c' -> [cast(a), cast(b), cast(c)]; 'default' diventa None."""
+    if value is None:
+        return [None]
+    items = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item or item == "default":
+            items.append(None)
+        else:
+            items.append(cast(item))
+    return items
+
+
+def parse_bool(value):
+    return value.lower() in ("1", "on", "true", "yes", "si")
+
+
+def make_payload(directory, size_mb):
+    """Crea un file di dati casuali (non comprimibili) della dimensione richiesta."""
+    path = os.path.join(directory, f"bench_{size_mb}mb.bin")
+    with open(path, "wb") as file:
+        for _ in range(size_mb):
+            file.write(os.urandom(MB))
+    return path
+
+
+def build_cases(args):
+    dimensions = {
+        "window_size": parse_list(args.window_size),
+        "max_packet_size": parse_list(args.max_packet_size),
+        "chunk_size": parse_list(args.chunk_size),
+        "prefetch_requests": parse_list(args.prefetch_requests),
+        "pipelined": parse_list(args.pipelined, parse_bool),
+        "ciphers": parse_list(args.ciphers, lambda cipher: [cipher]),
+        "compression": parse_list(args.compression, parse_bool),
+    }
+    keys = list(dimensions)
+    for values in itertools.product(*(dimensions[key] for key in keys)):
+        yield {key: value for key, value in zip(keys, values) if value is not None}
+
+
+def run_case(args, tuning, payload):
+    size = os.path.getsize(payload)
+    remote_path = args.remote_dir.rstrip("/") + "/" + os.path.basename(payload)
+    download_path = payload + ".download"
+    client = SftpClient(args.host, args.port, args.username, args.password, tuning=tuning)
+
+    start = time.monotonic()
+    client.connect()
+    connect_time = time.monotonic() - start
+    try:
+        upload_times, download_times = [], []
+        for _ in range(args.repeat):
+            start = time.monotonic()
+            client.upload_file(payload, remote_path)
+            upload_times.append(time.monotonic() - start)
+
+            start = time.monotonic()
+            client.download_file(remote_path, download_path)
+            download_times.append(time.monotonic() - start)
+        client.remove_file(remote_path)
+    finally:
+        client.close()
+        if os.path.exists(download_path):
+            os.remove(download_path)
+
+    return {
+        "tuning": tuning,
+        "connect_s": round(connect_time, 3),
+        "upload_mb_s": round(size / MB / min(upload_times), 2),
+        "download_mb_s": round(size / MB / min(download_times), 2),
+    }
+
+
+def sweep(args, log=print):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ftptransfert-bench-") as directory:
+        payload = make_payload(directory, args.size_mb)
+        cases = list(build_cases(args))
+        for index, tuning in enumerate(cases, 1):
+            log(f"[{index}/{len(cases)}] {json.dumps(tuning, sort_keys=True)}")
+            try:
+                results.append(run_case(args, tuning, payload))
+            except Exception as e:
+                log(f"    failed: {e}")
+                results.append({"tuning": tuning, "error": str(e)})
+    results.sort(key=lambda result: -(result.get("upload_mb_s", 0) + result.get("download_mb_s", 0)))
+    return results
+
+
+def format_table(results):
+    lines = [f"{'upload MB/s':>12} {'download MB/s':>14} {'connect s':>10}  tuning"]
+    for result in results:
+        tuning = json.dumps(result["tuning"], sort_keys=True)
+        if "error" in result:
+            lines.append(f"{'-':>12} {'-':>14} {'-':>10}  {tuning}  ({result['error']})")
+        else:
+            lines.append(f"{result['upload_mb_s']:>12} {result['download_mb_s']:>14} "
+                         f"{result['connect_s']:>10}  {tuning}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sweep SFTP tuning settings and report MB/s.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--username")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--remote-dir", default="/tmp")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=1, help="ripetizioni per caso, vale la migliore")
+    parser.add_argument("--window-size", help="es. 2097152,16777216")
+    parser.add_argument("--max-packet-size", help="es. 32768,262144")
+    parser.add_argument("--chunk-size", help=f"default {TUNING_DEFAULTS['chunk_size']}")
+    parser.add_argument("--prefetch-requests", help="es. 64,256")
+    parser.add_argument("--pipelined", help="on,off")
+    parser.add_argument("--ciphers", help="un cifrario per caso, es. aes128-ctr,chacha20-poly1305@openssh.com")
+    parser.add_argument("--compression", help="on,off")
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--local-server", action="store_true",
+                        help="usa un server SFTP in-process invece di --host/--username")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.local_server:
+        from local_sftp_server import LocalSftpServer
+
+        with tempfile.TemporaryDirectory(prefix="ftptransfert-server-") as root:
+            with LocalSftpServer(root) as server:
+                args.host, args.port = server.host, server.port
+                args.username, args.password = server.username, server.password
+                args.remote_dir = "/"
+                results = sweep(args)
+    elif not args.username:
+        parser.error("--username is required without --local-server")
+    else:
+        results = sweep(args)
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""Suite di benchmark riproducibile, senza GUI e senza server esterno.
+
+Avvia un server SFTP in-process (`local_sftp_server.py`), genera insiemi di
+file di forme diverse e misura:
+
+- upload e download di ogni file con `SftpClient`;
+- listing della cartella remota;
+- lookup nel registro dei trasferimenti (`TransferLedger`);
+- il ciclo completo di `SyncEngine` (primo ciclo e ciclo senza modifiche).
+
+    python benchmark_suite.py                              # tutte le forme, dimensioni piene
+    python benchmark_suite.py --shapes tiny,mixed --scale 0.01
+    python benchmark_suite.py --parallel 4 --label branch-x
+
+Ogni esecuzione viene aggiunta a `benchmark_results.jsonl` con la versione
+(git describe) e confrontata con l'ultima esecuzione di una versione diversa:
+le misure peggiorate oltre `--threshold` vengono segnalate.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from local_sftp_server import LocalSftpServer
+from sftp_client import SftpClient
+
+MB = 1024 * 1024
+RESULTS_FILE = "benchmark_results.jsonl"
+THRESHOLD = 0.10  # peggioramento relativo oltre il quale una misura e' una regressione
+
+# forma -> [(numero di file, dimensione in byte)]
+SHAPES = {
+    "tiny": [(100000, 1024)],
+    "large": [(3, 2048 * MB)],
+    "mixed": [(5000, 4 * 1024), (500, 256 * 1024), (20, 16 * MB), (2, 512 * MB)],
+}
+
+
+def scaled(shape, scale):
+    """Riduce (o aumenta) numero di file e dimensioni dei file grandi di `scale`."""
+    groups = []
+    for count, size in SHAPES[shape]:
+        if count > 10:
+            count = max(1, int(count * scale))
+        elif size >= MB:
+            size = max(MB, int(size * scale))
+        groups.append((count, size))
+    return groups
+
+
+def generate(directory, groups):
+    """Crea i file della forma richiesta; ritorna (numero di file, byte totali)."""
+    os.makedirs(directory, exist_ok=True)
+    # Un blocco casuale ripetuto: dati non comprimibili senza il costo di os.urandom su GB di dati
+    block = os.urandom(MB)
+    files = total = 0
+    for group, (count, size) in enumerate(groups):
+        for index in range(count):
+            with open(os.path.join(directory, f"g{group}_{index:06d}.bin"), "wb") as file:
+                remaining = size
+                while remaining > 0:
+                    written = file.write(block[:min(remaining, MB)])
+                    remaining -= written
+            files += 1
+            total += size
+    return files, total
+
+
+def measure(name, function, files=0, size=0):
+    start = time.monotonic()
+    function()
+    seconds = time.monotonic() - start
+    result = {"scenario": name, "seconds": round(seconds, 4), "files": files, "bytes": size}
+    if seconds > 0:
+        result["files_s"] = round(files / seconds, 1)
+        result["mb_s"] = round(size / MB / seconds, 2)
+    return result
+
+
+def run_shape(shape, args, server, workdir, log=print):
+    """Esegue tutti gli scenari su una forma e ritorna le misure."""
+    local_dir = os.path.join(workdir, shape, "local")
+    download_dir = os.path.join(workdir, shape, "download")
+    remote_dir = f"/{shape}"
+    sync_remote_dir = f"/{shape}-sync"
+    for directory in (download_dir, os.path.join(server.root, remote_dir[1:]),
+                      os.path.join(server.root, sync_remote_dir[1:])):
+        os.makedirs(directory, exist_ok=True)
+
+    log(f"[{shape}] generating files...")
+    files, size = generate(local_dir, scaled(shape, args.scale))
+    names = sorted(os.listdir(local_dir))
+    log(f"[{shape}] {files} file(s), {size / MB:.1f} MB")
+
+    results = []
+    client = SftpClient(server.host, server.port, server.username, server.password)
+    results.append(measure("connect", client.connect))
+    try:
+        results.append(measure("upload", lambda: [
+            client.upload_file(os.path.join(local_dir, name), f"{remote_dir}/{name}") for name in names
+        ], files, size))
+        results.append(measure("listing", lambda: client.list_files(remote_dir), files))
+        results.append(measure("download", lambda: [
+            client.download_file(f"{remote_dir}/{name}", os.path.join(download_dir, name)) for name in names
+        ], files, size))
+    finally:
+        client.close()
+    shutil.rmtree(download_dir, ignore_errors=True)
+
+    results.extend(run_ledger(shape, names, workdir))
+    results.extend(run_sync(shape, args, server, local_dir, sync_remote_dir, files, size))
+    for result in results:
+        result["shape"] = shape
+        log(f"[{shape}] {format_result(result)}")
+    return results
+
+
+def run_ledger(shape, names, workdir):
+    from transfer_ledger import TransferLedger
+
+    ledger = TransferLedger(os.path.join(workdir, f"{shape}-ledger.db"),
+                            legacy_path=os.path.join(workdir, "missing.json"))
+    try:
+        results = [measure("ledger_record", lambda: [ledger.record("bench", "to_remote", name) for name in names],
+                           len(names))]
+        results.append(measure("ledger_contains", lambda: [ledger.contains("bench", "to_remote", name)
+                                                           for name in names], len(names)))
+        results.append(measure("ledger_names", lambda: ledger.names("bench", "to_remote"), len(names)))
+    finally:
+        ledger.close()
+    return results
+
+
+def run_sync(shape, args, server, local_dir, remote_dir, files, size):
+    """Ciclo completo di SyncEngine: primo ciclo (tutti i file) e ciclo senza modifiche."""
+    from sync_engine import SyncEngine
+
+    settings = {
+        "profile_name": f"bench-{shape}",
+        "sftp_host": server.host,
+        "sftp_port": server.port,
+        "sftp_username": server.username,
+        "sftp_password": server.password,
+        "local_dir": local_dir,
+        "remote_dir": remote_dir,
+        "direction": "to_remote",
+        "parallel_transfers": args.parallel,
+    }
+    engine = SyncEngine(settings, log_callback=lambda message: None)
+    transferred = []
+    results = [measure("sync_first_cycle", lambda: transferred.extend(engine.run()), files, size)]
+    if len(transferred) != files:
+        results[-1]["error"] = f"{len(transferred)} of {files} file(s) transferred"
+    results.append(measure("sync_idle_cycle", engine.run, files))
+    return results
+
+
+def format_result(result):
+    text = f"{result['scenario']:<18} {result['seconds']:>10.3f} s"
+    if result.get("files"):
+        text += f" {result.get('files_s', 0):>12.1f} file/s"
+    if result.get("bytes"):
+        text += f" {result.get('mb_s', 0):>10.2f} MB/s"
+    if result.get("error"):
+        text += f"  ({result['error']})"
+    return text
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                runs.append(json.loads(line))
+            except ValueError:
+                continue
+    return runs
+
+
+def compare(run, previous_runs, threshold=THRESHOLD):
+    """Confronta con l'ultima esecuzione di un'altra versione; ritorna le righe di report e le regressioni."""
+    baseline = next((previous for previous in reversed(previous_runs)
+                     if previous.get("version") != run["version"] and previous.get("scale") == run["scale"]), None)
+    if baseline is None:
+        return ["No previous run of a different version with the same scale to compare against."], []
+    before = {(result["shape"], result["scenario"]): result for result in baseline["results"]}
+    lines = [f"Compared with {baseline['version']} ({baseline.get('label') or baseline['timestamp']}):"]
+    regressions = []
+    for result in run["results"]:
+        old = before.get((result["shape"], result["scenario"]))
+        if not old or not old.get("seconds") or not result.get("seconds"):
+            continue
+        change = result["seconds"] / old["seconds"] - 1
+        marker = ""
+        if change > threshold:
+            marker = "  REGRESSION"
+            regressions.append(result)
+        lines.append(f"  {result['shape']:<6} {result['scenario']:<18} {old['seconds']:>10.3f} s -> "
+                     f"{result['seconds']:>10.3f} s ({change:+.0%}){marker}")
+    return lines, regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless benchmark suite with an in-process SFTP server.")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"forme da eseguire ({', '.join(SHAPES)})")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="fattore su numero di file e dimensione dei file grandi, es. 0.01 per una prova rapida")
+    parser.add_argument("--parallel", type=int, default=1, help="parallel_transfers usato nel ciclo di sync")
+    parser.add_argument("--workdir", help="cartella di lavoro (default: temporanea, rimossa alla fine)")
+    parser.add_argument("--results", default=RESULTS_FILE, help="file JSON lines con lo storico dei risultati")
+    parser.add_argument("--label", help="etichetta libera salvata con i risultati")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="peggioramento tollerato (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="esce con codice 1 se ci sono regressioni")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    shapes = [shape.strip() for shape in args.shapes.split(",") if shape.strip()]
+    unknown = [shape for shape in shapes if shape not in SHAPES]
+    if unknown:
+        print(f"Unknown shape(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    results_path = os.path.abspath(args.results)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="ftptransfert-suite-")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    # Registro, snapshot e log di SyncEngine usano percorsi relativi: restano nella cartella di lavoro
+    os.chdir(workdir)
+    run = {
+        "version": version(),
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "parallel": args.parallel,
+        "results": [],
+    }
+    try:
+        remote_root = os.path.join(workdir, "remote")
+        os.makedirs(remote_root, exist_ok=True)
+        with LocalSftpServer(remote_root) as server:
+            for shape in shapes:
+                run["results"].extend(run_shape(shape, args, server, workdir))
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    lines, regressions = compare(run, load_runs(results_path), args.threshold)
+    print("\n".join(lines))
+    with open(results_path, "a") as file:
+        file.write(json.dumps(run) + "\n")
+    print(f"Results appended to {results_path}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
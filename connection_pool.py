@@ -0,0 +1,222 @@
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+from sftp_client import SftpClient, normalize_tuning
+from retry_policy import RetryPolicy, NETWORK, AUTH, classify, get_breaker
+
+KEEPALIVE_INTERVAL = 30  # secondi fra un keepalive SSH e il successivo
+IDLE_TIMEOUT = 300  # connessioni inutilizzate da piu' di 5 minuti vengono chiuse
+HEALTH_CHECK_AFTER = 60  # oltre questo tempo di inattivita' si verifica la connessione
+CONNECT_ATTEMPTS = 3  # tentativi di connessione per acquire, solo per errori di rete
+
+
+class PooledConnection:
+    """Una connessione SSH autenticata condivisa fra piu' cicli di sync."""
+
+    def __init__(self, client, password):
+        self.client = client
+        self.password = password
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        transport = self.client.transport
+        return transport is not None and transport.is_active() and transport.is_authenticated()
+
+    def is_healthy(self):
+        if not self.is_alive():
+            return False
+        if time.monotonic() - self.last_used < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            self.client.sftp.normalize(".")
+            return True
+        except Exception:
+            return False
+
+
+class ConnectionPool:
+    """Pool di connessioni SFTP condiviso dal processo, per host/porta/utente.
+
+    Ogni `acquire` apre un nuovo canale SFTP sul transport gia' autenticato,
+    quindi nessun handshake TCP/SSH viene ripetuto finche' la connessione e'
+    viva. Le connessioni cadute vengono ricreate al successivo `acquire` e
+    quelle inattive oltre `idle_timeout` vengono chiuse da un thread di pulizia.
+
+    Chi vuole piu' connessioni parallele verso lo stesso server (es.
+    "parallel_transports") le chiede con `slot` diversi: ogni slot e' una
+    connessione del pool, riusata fra un ciclo e l'altro come la prima.
+
+    Gli errori di rete durante la connessione vengono ritentati con backoff;
+    quelli di autenticazione no. Se un host continua a fallire il suo
+    circuit breaker sospende le connessioni e `acquire` solleva subito
+    HostUnavailable fino alla fine della pausa.
+    """
+
+    def __init__(self, keepalive_interval=KEEPALIVE_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._retired = []
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.connect_policy = RetryPolicy(max_attempts=CONNECT_ATTEMPTS, base_delay=2.0, max_delay=30.0,
+                                          retry_on=(NETWORK,))
+
+    def acquire(self, host, port, username, password, log_callback=None, tuning=None, slot=0):
+        # Profili con tuning di rete diverso non possono condividere il transport
+        key = (host, int(port), username, json.dumps(normalize_tuning(tuning), sort_keys=True), slot)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Il lock per chiave evita che un host lento blocchi gli altri durante l'handshake
+        with key_lock:
+            with self._lock:
+                pooled = self._connections.get(key)
+            if pooled is not None and (pooled.password != password or not pooled.is_healthy()):
+                self._log(log_callback, f"Pooled connection to {host}:{port} is stale, reconnecting")
+                self._retire(key, pooled)
+                pooled = None
+
+            if pooled is None:
+                breaker = get_breaker(host, int(port))
+                breaker.check(username)
+                try:
+                    client = self.connect_policy.call(
+                        lambda: self._connect(host, port, username, password, log_callback, tuning),
+                        log_callback, f"Connection to {host}:{port}",
+                    )
+                except Exception as e:
+                    pause = breaker.record_failure(e, username)
+                    if pause and classify(e) == AUTH:
+                        self._log(log_callback, f"Pausing connections as {username} to {host}:{port} "
+                                                f"for {pause:.0f} s, credentials were rejected")
+                    elif pause:
+                        self._log(log_callback, f"Pausing connections to {host}:{port} for {pause:.0f} s "
+                                                f"after {breaker.failures} failure(s)")
+                    raise
+                breaker.record_success(username)
+                pooled = PooledConnection(client, password)
+            else:
+                self._log(log_callback, f"Reusing pooled connection to {host}:{port}")
+
+            channel = pooled.client.open_channel()
+            channel.log_callback = log_callback
+            with self._lock:
+                self._connections[key] = pooled
+                pooled.in_use += 1
+                pooled.last_used = time.monotonic()
+                self._start_reaper()
+        return channel
+
+    def _connect(self, host, port, username, password, log_callback, tuning):
+        client = SftpClient(host, int(port), username, password, log_callback, tuning)
+        try:
+            client.connect()
+        except Exception:
+            # Un handshake fallito non deve lasciare aperto il socket
+            if client.transport is not None:
+                client.transport.close()
+            raise
+        client.transport.set_keepalive(self.keepalive_interval)
+        return client
+
+    def release(self, channel):
+        try:
+            channel.close()
+        except Exception:
+            pass
+        with self._lock:
+            for key, pooled in list(self._connections.items()):
+                if pooled.client.transport is channel.transport:
+                    pooled.in_use = max(0, pooled.in_use - 1)
+                    pooled.last_used = time.monotonic()
+                    if not pooled.is_alive() and pooled.in_use == 0:
+                        self._close(pooled)
+                        del self._connections[key]
+                    return
+            for pooled in list(self._retired):
+                if pooled.client.transport is channel.transport:
+                    pooled.in_use = max(0, pooled.in_use - 1)
+                    if pooled.in_use == 0:
+                        self._close(pooled)
+                        self._retired.remove(pooled)
+                    return
+
+    @contextmanager
+    def connection(self, host, port, username, password, log_callback=None, tuning=None):
+        channel = self.acquire(host, port, username, password, log_callback, tuning)
+        try:
+            yield channel
+        finally:
+            self.release(channel)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            for key, pooled in list(self._connections.items()):
+                if pooled.in_use:
+                    continue
+                if now - pooled.last_used > self.idle_timeout or not pooled.is_alive():
+                    self._close(pooled)
+                    del self._connections[key]
+
+    def close_all(self):
+        with self._lock:
+            for pooled in list(self._connections.values()) + self._retired:
+                self._close(pooled)
+            self._connections.clear()
+            self._retired = []
+
+    def _retire(self, key, pooled):
+        """Toglie una connessione dal pool; viene chiusa quando l'ultimo canale e' rilasciato."""
+        with self._lock:
+            if self._connections.get(key) is pooled:
+                del self._connections[key]
+            if pooled.in_use:
+                self._retired.append(pooled)
+            else:
+                self._close(pooled)
+
+    def _start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(target=self._reap_loop, name="sftp-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1, min(self.idle_timeout / 2, 30)))
+            self.evict_idle()
+            with self._lock:
+                if not self._connections:
+                    self._reaper = None
+                    return
+
+    def _close(self, pooled):
+        try:
+            pooled.client.close()
+        except Exception:
+            pass
+
+    def _log(self, log_callback, message):
+        if log_callback:
+            log_callback(message)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Ritorna il pool di connessioni condiviso dal processo."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close_all)
+        return _pool
@@ -0,0 +1,96 @@
+"""Esecuzione senza interfaccia grafica.
+
+Carica uno o piu' profili JSON (lo stesso formato scritto da "Salva
+Configurazione") e li esegue a intervalli regolari in un solo processo,
+senza importare PyQt5:
+
+    python daemon.py profilo.json                 # ogni "sync_interval" secondi
+    python daemon.py profilo.json --interval 300  # intervallo esplicito
+    python daemon.py profilo.json --once          # un solo ciclo, poi esce
+    python daemon.py profili/*.json --workers 4 --per-host 2
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+
+from scheduler import Scheduler, DEFAULT_INTERVAL, MAX_WORKERS, MAX_PER_HOST
+from metrics import get_metrics, STATS_FILE
+from bandwidth import get_limiter, GLOBAL
+import log_store
+
+LOG_FORMAT = '[%(asctime)s] %(message)s'
+
+
+def load_profile(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def load_profiles(paths, interval=None, jitter=None):
+    """Ritorna {nome: impostazioni}; il nome e' quello del file senza estensione."""
+    profiles = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in profiles:
+            raise ValueError(f"duplicate profile name {name!r} ({path})")
+        settings = load_profile(path)
+        if interval:
+            settings["sync_interval"] = interval
+        if jitter is not None:
+            settings.setdefault("schedule_jitter", jitter)
+        profiles[name] = settings
+    return profiles
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run ftptransfert profiles without the GUI.")
+    parser.add_argument("profiles", nargs="+", help="file JSON salvati da 'Salva Configurazione'")
+    parser.add_argument("--interval", type=int, help="secondi fra due cicli (default: sync_interval del profilo)")
+    parser.add_argument("--jitter", type=float,
+                        help="ritardo casuale massimo in secondi per i profili senza schedule_jitter")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="profili eseguiti in parallelo")
+    parser.add_argument("--per-host", type=int, default=MAX_PER_HOST, help="cicli paralleli per server SFTP")
+    parser.add_argument("--once", action="store_true", help="esegue ogni profilo una volta ed esce")
+    parser.add_argument("--log-file", default="log.txt")
+    parser.add_argument("--verbose", action="store_true", help="scrive il log anche su stderr")
+    parser.add_argument("--metrics-port", type=int,
+                        help="espone /metrics (Prometheus) e /stats.json su 127.0.0.1 a questa porta")
+    parser.add_argument("--stats-file", default=STATS_FILE, help="statistiche JSON riscritte a fine ciclo")
+    parser.add_argument("--bandwidth-limit", type=float,
+                        help="MB/s massimi per tutti i profili insieme (in aggiunta ai limiti dei profili)")
+    parser.add_argument("--bandwidth-windows",
+                        help="file JSON con le fasce orarie del limite globale, es. [{\"start\": \"08:00\", \"end\": \"18:00\", \"limit_mb_s\": 2}]")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    handlers = [logging.FileHandler(args.log_file)]
+    if args.verbose:
+        handlers.append(logging.StreamHandler())
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, handlers=handlers)
+    log_store.install()
+
+    scheduler = Scheduler(
+        load_profiles(args.profiles, args.interval, args.jitter),
+        max_workers=args.workers,
+        max_per_host=args.per_host,
+        default_interval=DEFAULT_INTERVAL,
+        stats_file=args.stats_file,
+    )
+    if args.metrics_port:
+        get_metrics().serve(args.metrics_port)
+    if args.bandwidth_limit or args.bandwidth_windows:
+        get_limiter(GLOBAL).configure(args.bandwidth_limit,
+                                      load_profile(args.bandwidth_windows) if args.bandwidth_windows else None)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    scheduler.run_forever(once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
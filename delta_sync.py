@@ -0,0 +1,153 @@
+"""Trasferimento delta stile rsync: di un file modificato viene inviato solo cio' che e' cambiato.
+
+Dopo ogni sincronizzazione di un file viene salvata la sua firma: per ogni
+blocco di BLOCK_SIZE byte un checksum debole "rolling" e uno forte. Alla
+modifica successiva il file nuovo viene confrontato con la firma della
+versione precedente, che e' ancora quella presente dall'altra parte:
+
+    signature_data = signature("db.sqlite")
+    ...
+    delta = match_blocks("db.sqlite", signature_data, old_size)
+    delta.literal_bytes  # byte da inviare davvero
+
+Come in rsync il checksum debole scorre di un byte alla volta, quindi
+anche i blocchi spostati (es. dopo un inserimento a inizio file) vengono
+riconosciuti.
+"""
+import os
+import mmap
+import struct
+import hashlib
+import itertools
+
+BLOCK_SIZE = 64 * 1024  # usato anche per i blocchi di check-file
+DELTA_MIN_SIZE = 1024 * 1024  # i file piu' piccoli vengono trasferiti interi
+MAX_ROLLING_BLOCKS = 4  # dopo tanti blocchi senza corrispondenze la ricerca procede a blocchi, non a byte
+
+_ENTRY = struct.Struct(">I16s")  # checksum debole, checksum forte
+
+
+def weak_checksum(data):
+    """Checksum debole di rsync: due somme a 16 bit aggiornabili in O(1) spostando la finestra."""
+    a = sum(data) & 0xFFFF
+    b = sum(itertools.accumulate(data)) & 0xFFFF
+    return (b << 16) | a
+
+
+def roll(weak, out_byte, in_byte, block_size):
+    """Sposta di un byte la finestra del checksum debole: esce `out_byte`, entra `in_byte`."""
+    a = ((weak & 0xFFFF) - out_byte + in_byte) & 0xFFFF
+    b = ((weak >> 16) - block_size * out_byte + a) & 0xFFFF
+    return (b << 16) | a
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def signature(path, block_size=BLOCK_SIZE):
+    """Firma del file: checksum debole e forte di ogni blocco, concatenati."""
+    parts = []
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            parts.append(_ENTRY.pack(weak_checksum(block), strong_checksum(block)))
+    return b"".join(parts)
+
+
+def parse_signature(data):
+    return [_ENTRY.unpack_from(data, offset) for offset in range(0, len(data), _ENTRY.size)]
+
+
+class Delta:
+    """Differenza fra la versione precedente di un file e quella nuova.
+
+    `ops` e' una lista di `(offset, length, old_offset)` che copre il file
+    nuovo: con `old_offset` None i byte sono nuovi e vanno inviati,
+    altrimenti sono gia' presenti nella versione precedente a `old_offset`.
+    """
+
+    def __init__(self, size, ops):
+        self.size = size
+        self.ops = ops
+
+    @property
+    def literal_bytes(self):
+        return sum(length for _, length, old_offset in self.ops if old_offset is None)
+
+    @property
+    def moved_bytes(self):
+        """Byte riusati ma a una posizione diversa da quella della versione precedente."""
+        return sum(length for offset, length, old_offset in self.ops if old_offset not in (None, offset))
+
+    def __repr__(self):
+        return f"<Delta {self.size} bytes, {self.literal_bytes} literal, {self.moved_bytes} moved>"
+
+
+def match_blocks(path, signature_data, old_size, block_size=BLOCK_SIZE):
+    """Confronta il file `path` con la firma della versione precedente (lunga `old_size` byte).
+
+    Dove i blocchi coincidono la ricerca salta di un blocco intero; dove non
+    coincidono scorre di un byte alla volta per MAX_ROLLING_BLOCKS blocchi,
+    poi prosegue a passi di un blocco finche' non trova di nuovo una
+    corrispondenza, cosi' un file riscritto per intero non costa un giro
+    Python per ogni byte.
+    """
+    entries = parse_signature(signature_data)
+    full_blocks = old_size // block_size
+    index = {}
+    for number, (weak, _) in enumerate(entries[:full_blocks]):
+        index.setdefault(weak, []).append(number)
+
+    size = os.path.getsize(path)
+    if size == 0:
+        return Delta(0, [])
+    ops = []
+
+    def add(offset, length, old_offset):
+        if ops:
+            last_offset, last_length, last_old = ops[-1]
+            if last_offset + last_length == offset and (
+                    (old_offset is None and last_old is None)
+                    or (old_offset is not None and last_old is not None and last_old + last_length == old_offset)):
+                ops[-1] = (last_offset, last_length + length, last_old)
+                return
+        ops.append((offset, length, old_offset))
+
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        literal_start = position = 0
+        weak = None
+        while position + block_size <= size:
+            if weak is None:
+                weak = weak_checksum(data[position:position + block_size])
+            found = None
+            candidates = index.get(weak)
+            if candidates:
+                strong = strong_checksum(data[position:position + block_size])
+                for number in candidates:
+                    if entries[number][1] == strong:
+                        found = number
+                        if number * block_size == position:
+                            break  # meglio il blocco rimasto al suo posto
+            if found is not None:
+                if literal_start < position:
+                    add(literal_start, position - literal_start, None)
+                add(position, block_size, found * block_size)
+                position += block_size
+                literal_start = position
+                weak = None
+            elif position - literal_start < MAX_ROLLING_BLOCKS * block_size and position + block_size < size:
+                weak = roll(weak, data[position], data[position + block_size], block_size)
+                position += 1
+            else:
+                position += block_size
+                weak = None
+
+        # Ultimo blocco corto: coincide solo se e' rimasto uguale alla fine del file
+        tail = size - position
+        if (0 < tail < block_size and literal_start == position and position == full_blocks * block_size
+                and old_size - position == tail and len(entries) > full_blocks
+                and entries[full_blocks][1] == strong_checksum(data[position:size])):
+            add(position, tail, position)
+        elif literal_start < size:
+            add(literal_start, size - literal_start, None)
+    return Delta(size, ops)
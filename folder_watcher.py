@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+DEBOUNCE = 2.0  # secondi di quiete dopo l'ultimo evento prima di avviare l'upload
+MAX_DELAY_FACTOR = 10  # con eventi continui, l'upload parte comunque dopo 10 x DEBOUNCE
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+def is_supported():
+    """True se il sistema offre inotify (solo Linux)."""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(_load_libc(), "inotify_init1")
+    except OSError:
+        return False
+
+
+class FolderWatcher:
+    """Segnala i file scritti o spostati in una cartella tramite inotify.
+
+    Gli eventi IN_CLOSE_WRITE e IN_MOVED_TO vengono raccolti e, dopo
+    `debounce` secondi senza nuovi eventi, passati a `callback` come lista
+    di nomi. Se la coda del kernel trabocca la callback riceve None: il
+    chiamante deve fare una scansione completa della cartella.
+    """
+
+    def __init__(self, directory, callback, debounce=DEBOUNCE, log_callback=None):
+        self.directory = directory
+        self.callback = callback
+        self.debounce = debounce
+        self.log_callback = log_callback
+        self._fd = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        libc = _load_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, os.strerror(err), self.directory)
+
+        self._fd = fd
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="folder-watcher", daemon=True)
+        self._thread.start()
+        self.log(f"Watching {self.directory} for new files")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self.log(f"Stopped watching {self.directory}")
+
+    def _run(self):
+        pending = set()
+        first_event = last_event = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            timeout = 0.5
+            if pending:
+                timeout = max(0.0, min(timeout, last_event + self.debounce - now))
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+
+            if readable:
+                try:
+                    data = os.read(self._fd, 65536)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    self.log(f"Folder watcher error: {e}")
+                    return
+                overflow = False
+                for mask, name in self._parse(data):
+                    if mask & IN_Q_OVERFLOW:
+                        overflow = True
+                    elif mask & IN_IGNORED:
+                        self.log(f"Watched directory {self.directory} is no longer available")
+                        self.callback(None)
+                        return
+                    elif name and not mask & IN_ISDIR:
+                        if not pending:
+                            first_event = time.monotonic()
+                        pending.add(name)
+                last_event = time.monotonic()
+                if overflow:
+                    self.log("Folder watcher queue overflow, requesting a full scan")
+                    pending.clear()
+                    self.callback(None)
+
+            now = time.monotonic()
+            if pending and (now - last_event >= self.debounce
+                            or now - first_event >= self.debounce * MAX_DELAY_FACTOR):
+                names = sorted(pending)
+                pending.clear()
+                self.callback(names)
+
+    @staticmethod
+    def _parse(data):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            yield mask, os.fsdecode(name)
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
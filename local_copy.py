@@ -0,0 +1,149 @@
+import os
+import time
+import errno
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from parallel_transfer import TransferResult
+from sftp_client import PART_SUFFIX
+from metrics import get_metrics
+from tree_walker import local_path
+
+COPY_CHUNK = 64 * 1024 * 1024  # byte richiesti al kernel per chiamata
+
+# Errori per cui copy_file_range/sendfile non sono usabili su questa coppia di file
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def same_device(src_dir, dest_dir):
+    try:
+        return os.stat(src_dir).st_dev == os.stat(dest_dir).st_dev
+    except OSError:
+        return False
+
+
+def _kernel_copy(function, src_fd, dst_fd, size):
+    """Copia con copy_file_range o sendfile; ritorna False se la chiamata non e' supportata.
+
+    Se l'origine si accorcia durante la copia solleva OSError, cosi' una
+    copia troncata non viene mai rinominata al posto della destinazione.
+    """
+    copied = 0
+    while copied < size:
+        try:
+            if function is os.sendfile:
+                count = os.sendfile(dst_fd, src_fd, copied, min(COPY_CHUNK, size - copied))
+            else:
+                count = function(src_fd, dst_fd, min(COPY_CHUNK, size - copied), copied, copied)
+        except OSError as e:
+            if copied == 0 and e.errno in _KERNEL_COPY_UNSUPPORTED:
+                return False
+            raise
+        if count == 0:
+            raise OSError(f"source file shrank during copy ({copied} of {size} bytes copied)")
+        copied += count
+    return True
+
+
+def copy_file(src, dest):
+    """Copia `src` in `dest` senza passare i dati in user space, quando possibile.
+
+    I dati vengono scritti in `dest.part` e rinominati solo alla fine, quindi
+    `dest` non e' mai visibile a meta'. Metadati come shutil.copy2.
+    """
+    temp = dest + PART_SUFFIX
+    try:
+        with open(src, "rb") as src_file, open(temp, "wb") as dst_file:
+            size = os.fstat(src_file.fileno()).st_size
+            src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+            done = False
+            for function in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+                if function is not None and _kernel_copy(function, src_fd, dst_fd, size):
+                    done = True
+                    break
+            if not done:
+                shutil.copyfileobj(src_file, dst_file, COPY_CHUNK)
+        shutil.copystat(src, temp)
+        os.replace(temp, dest)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+class LocalTransfer:
+    """Trasferimento locale su locale.
+
+    Con `move` e cartelle sullo stesso filesystem i file vengono solo
+    rinominati (nessun byte copiato; se una sottocartella e' montata
+    altrove il rename fallisce con EXDEV e si passa alla copia per il resto
+    del trasferimento); altrimenti vengono copiati con
+    `copy_file` e, con `move`, l'origine viene cancellata solo dopo che la
+    copia e' stata rinominata al suo posto. Con `workers > 1` i file vengono
+    copiati in parallelo, utile con molti file piccoli. I nomi possono essere
+    relativi a sottocartelle ("a/b/file"): le cartelle di destinazione
+    mancanti vengono create.
+    """
+
+    def __init__(self, src_dir, dest_dir, workers=1, move=False):
+        self.src_dir = src_dir
+        self.dest_dir = dest_dir
+        self.workers = max(1, int(workers))
+        self.move = move
+        self.rename = move and same_device(src_dir, dest_dir)
+        self._made_dirs = set()
+
+    def run(self, names):
+        """Trasferisce i file `names` e ritorna un TransferResult per file, appena pronto."""
+        if self.workers == 1:
+            for name in names:
+                yield self._transfer(name)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="local-copy") as executor:
+            pending = set()
+            for name in names:
+                pending.add(executor.submit(self._transfer, name))
+                if len(pending) >= self.workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def _transfer(self, name):
+        source = local_path(self.src_dir, name)
+        destination = local_path(self.dest_dir, name)
+        result = TransferResult(name, source, destination)
+        start = time.monotonic()
+        size = 0
+        try:
+            size = os.path.getsize(source)
+            if "/" in name:
+                self._make_parent(destination)
+            if self.rename:
+                try:
+                    os.replace(source, destination)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    # Una sottocartella su un altro filesystem: da qui in poi si copia
+                    self.rename = False
+            if not self.rename:
+                copy_file(source, destination)
+                if self.move:
+                    os.remove(source)
+            result.ok = True
+        except Exception as e:
+            result.error = e
+        result.duration = time.monotonic() - start
+        get_metrics().record_transfer("local_to_local", name, size, result.duration, result.error)
+        return result
+
+    def _make_parent(self, destination):
+        parent = os.path.dirname(destination)
+        if parent not in self._made_dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._made_dirs.add(parent)
@@ -0,0 +1,118 @@
+import os
+import stat
+import hashlib
+
+from tree_walker import LocalWalker
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path, algorithm="sha256"):
+    """Calcola l'hash del contenuto di un file leggendolo a blocchi."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ChangedFile:
+    """File creato o modificato rispetto alla scansione precedente."""
+
+    def __init__(self, name, path, fingerprint, created):
+        self.name = name
+        self.path = path
+        self.fingerprint = fingerprint
+        self.created = created
+
+    def __repr__(self):
+        return f"<ChangedFile {self.name} {'created' if self.created else 'modified'}>"
+
+
+class LocalScanner:
+    """Rileva i file nuovi o modificati di una cartella locale.
+
+    Per ogni file viene salvata un'impronta (dimensione, mtime_ns, inode e,
+    con `use_hash`, lo sha256 del contenuto) nello SnapshotStore. Una
+    scansione di una cartella invariata costa un solo passaggio di
+    `os.scandir` senza aperture di file; l'hash viene calcolato solo per i
+    file la cui impronta e' cambiata. Con `recursive` vengono scansionate
+    anche le sottocartelle, con i nomi relativi a `local_dir` ("a/b/file").
+    """
+
+    def __init__(self, store, profile, local_dir, use_hash=False, recursive=False, log_callback=None):
+        self.store = store
+        self.profile = profile
+        self.local_dir = local_dir
+        self.use_hash = use_hash
+        self.recursive = recursive
+        self.log_callback = log_callback
+        self.scope = "local:" + os.path.abspath(local_dir)
+        self.previous = store.load(profile, self.scope)
+        self.first_scan = not store.was_scanned(profile, self.scope)
+        self.seen = set()
+        self.updates = {}
+        self.complete = False
+
+    def scan(self):
+        """Ritorna, uno alla volta, i ChangedFile della cartella."""
+        if self.recursive:
+            yield from self._scan_tree()
+            return
+        with os.scandir(self.local_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+                changed_file = self._compare(entry.name, entry.path, (st.st_size, st.st_mtime_ns, entry.inode(), None))
+                if changed_file is not None:
+                    yield changed_file
+        self.complete = True
+
+    def _scan_tree(self):
+        walker = LocalWalker(self.local_dir, log_callback=self.log_callback)
+        for name, path, st in walker.walk():
+            changed_file = self._compare(name, path, (st.st_size, st.st_mtime_ns, st.st_ino, None))
+            if changed_file is not None:
+                yield changed_file
+        # Con una sottocartella illeggibile le sue voci non vengono considerate sparite
+        self.complete = walker.complete
+
+    def check(self, names):
+        """Come scan(), ma solo per i file indicati (es. quelli segnalati da inotify)."""
+        for name in names:
+            path = os.path.join(self.local_dir, *name.split("/"))
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            changed_file = self._compare(name, path, (st.st_size, st.st_mtime_ns, st.st_ino, None))
+            if changed_file is not None:
+                yield changed_file
+
+    def _compare(self, name, path, fingerprint):
+        self.seen.add(name)
+        previous = self.previous.get(name)
+        if previous is not None and tuple(previous[:3]) == fingerprint[:3]:
+            return None
+
+        if self.use_hash:
+            fingerprint = fingerprint[:3] + (file_digest(path),)
+            if previous is not None and previous[3] == fingerprint[3]:
+                # Cambiati solo i metadati (es. touch): aggiorna l'impronta senza ritrasferire
+                self.updates[name] = fingerprint
+                return None
+
+        return ChangedFile(name, path, fingerprint, previous is None)
+
+    def mark_done(self, changed_file):
+        self.updates[changed_file.name] = changed_file.fingerprint
+
+    def save(self):
+        """Salva le impronte; con una scansione interrotta non elimina i file non visti."""
+        removed = set(self.previous) - self.seen if self.complete else ()
+        self.store.write(self.profile, self.scope, self.updates, removed)
+        if self.complete:
+            self.store.mark_scanned(self.profile, self.scope)
@@ -0,0 +1,260 @@
+"""Server SFTP minimale in-process, basato su paramiko, per i benchmark.
+
+Serve una cartella locale su 127.0.0.1 con autenticazione a password, cosi'
+`SftpClient`, `SyncEngine` e `benchmark.py` possono essere misurati senza un
+server esterno:
+
+    with LocalSftpServer("/tmp/root") as server:
+        client = SftpClient(server.host, server.port, server.username, server.password)
+
+Oltre a check-file (md5/sha1) e posix-rename, gia' offerte da paramiko,
+supporta l'estensione copy-data di OpenSSH usata dagli upload delta.
+
+Non e' pensato per la produzione: nessun controllo dei permessi oltre a
+quelli del processo, chiave host generata a ogni avvio.
+"""
+import os
+import socket
+import logging
+import threading
+
+import paramiko
+from paramiko import SFTPServer, SFTPServerInterface, SFTPHandle, SFTPAttributes, ServerInterface
+from paramiko.sftp import SFTP_OK, SFTP_FAILURE, SFTP_BAD_MESSAGE, CMD_EXTENDED
+
+
+def _set_file_attr(path, attr):
+    """Come SFTPServer.set_file_attr, ma la dimensione viene cambiata con truncate.
+
+    paramiko riapre il file con "w+" per cambiarne la dimensione, svuotandolo,
+    e un aggiornamento sul posto (upload delta) perderebbe tutto il contenuto.
+    """
+    if attr._flags & attr.FLAG_SIZE:
+        os.truncate(path, attr.st_size)
+        flags = attr._flags
+        attr._flags &= ~attr.FLAG_SIZE
+        try:
+            SFTPServer.set_file_attr(path, attr)
+        finally:
+            attr._flags = flags
+    else:
+        SFTPServer.set_file_attr(path, attr)
+
+
+class _Server(ServerInterface):
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if username == self.username and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            self.writefile.flush()
+            _set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _SftpInterface(SFTPServerInterface):
+    """Mappa i percorsi SFTP (assoluti o relativi) dentro `root`."""
+
+    def __init__(self, server, root):
+        super().__init__(server)
+        self.root = root
+
+    def _realpath(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def list_folder(self, path):
+        realpath = self._realpath(path)
+        try:
+            entries = []
+            with os.scandir(realpath) as iterator:
+                for entry in iterator:
+                    attr = SFTPAttributes.from_stat(entry.stat(follow_symlinks=False))
+                    attr.filename = entry.name
+                    entries.append(attr)
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._realpath(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._realpath(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        realpath = self._realpath(path)
+        try:
+            mode = getattr(attr, "st_mode", None)
+            fd = os.open(realpath, flags | getattr(os, "O_BINARY", 0), mode or 0o666)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            fstr = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fstr = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fstr = "rb"
+        handle = _Handle(flags)
+        handle.filename = realpath
+        handle.readfile = handle.writefile = os.fdopen(fd, fstr)
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, self._realpath(path))
+
+    def rename(self, oldpath, newpath):
+        newpath = self._realpath(newpath)
+        if os.path.exists(newpath):
+            return SFTPServer.convert_errno(17)  # EEXIST, come da protocollo SFTP v3
+        return self._call(os.rename, self._realpath(oldpath), newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._realpath(oldpath), self._realpath(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._realpath(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._realpath(path))
+
+    def chattr(self, path, attr):
+        return self._call(_set_file_attr, self._realpath(path), attr)
+
+    @staticmethod
+    def _call(function, *args):
+        try:
+            function(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+
+class _SftpServer(SFTPServer):
+    """SFTPServer di paramiko con in piu' l'estensione copy-data."""
+
+    def _process(self, t, request_number, msg):
+        if t == CMD_EXTENDED:
+            position = msg.packet.tell()
+            if msg.get_text() == "copy-data":
+                self._copy_data(request_number, msg)
+                return
+            msg.packet.seek(position)
+        super()._process(t, request_number, msg)
+
+    def _copy_data(self, request_number, msg):
+        src = self.file_table.get(msg.get_binary())
+        src_offset = msg.get_int64()
+        length = msg.get_int64()
+        dst = self.file_table.get(msg.get_binary())
+        dst_offset = msg.get_int64()
+        if src is None or dst is None:
+            self._send_status(request_number, SFTP_BAD_MESSAGE, "Invalid handle")
+            return
+        remaining = length  # 0 = fino alla fine del file
+        while not length or remaining > 0:
+            data = src.read(src_offset, min(remaining, 65536) if length else 65536)
+            if not isinstance(data, bytes):
+                self._send_status(request_number, data)
+                return
+            if not data:
+                break
+            status = dst.write(dst_offset, data)
+            if status != SFTP_OK:
+                self._send_status(request_number, status)
+                return
+            src_offset += len(data)
+            dst_offset += len(data)
+            remaining -= len(data)
+        self._send_status(request_number, SFTP_FAILURE if length and remaining > 0 else SFTP_OK)
+
+
+class LocalSftpServer:
+    """Server SFTP su 127.0.0.1 (porta libera scelta dal sistema) che serve `root`."""
+
+    def __init__(self, root, username="bench", password="bench", host="127.0.0.1", port=0):
+        self.root = os.path.abspath(root)
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self._host_key = None
+        self._socket = None
+        self._thread = None
+        self._transports = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept_loop, name="local-sftp-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._socket is not None:
+            self._socket.close()
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            try:
+                transport = paramiko.Transport(connection)
+                transport.add_server_key(self._host_key)
+                transport.set_subsystem_handler("sftp", _SftpServer, _SftpInterface, self.root)
+                transport.start_server(server=_Server(self.username, self.password))
+            except Exception as e:
+                logging.info(f"Local SFTP server: connection failed: {e}")
+                connection.close()
+                continue
+            with self._lock:
+                self._transports = [t for t in self._transports if t.is_active()]
+                self._transports.append(transport)
@@ -0,0 +1,178 @@
+import os
+import json
+import glob
+import time
+import logging
+import logging.handlers
+from collections import deque
+from datetime import datetime, timedelta
+
+LOG_STORE_FILE = "log.jsonl"
+BACKUP_DAYS = 30  # giorni di log ruotati conservati
+REPORT_TIMES = ((7, 30), (15, 0))  # orari del report giornaliero delle ultime 24 ore
+TAIL_BLOCK = 64 * 1024
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "ts": record.created,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+def install(path=LOG_STORE_FILE, logger=None):
+    """Aggiunge al logger (default: root) un handler JSON lines ruotato a mezzanotte."""
+    logger = logger or logging.getLogger()
+    for handler in logger.handlers:
+        if getattr(handler, "log_store_path", None) == os.path.abspath(path):
+            return handler
+    handler = logging.handlers.TimedRotatingFileHandler(
+        path, when="midnight", backupCount=BACKUP_DAYS, encoding="utf-8"
+    )
+    handler.log_store_path = os.path.abspath(path)
+    handler.setFormatter(JsonLineFormatter())
+    logger.addHandler(handler)
+    return handler
+
+
+def next_report_time(now=None, times=REPORT_TIMES):
+    """Ritorna il prossimo orario di report successivo a `now`."""
+    now = now or datetime.now()
+    candidates = []
+    for hour, minute in times:
+        candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= now:
+            candidate += timedelta(days=1)
+        candidates.append(candidate)
+    return min(candidates)
+
+
+def format_record(record):
+    when = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+    return f"[{when}] {record['message']}"
+
+
+class LogStore:
+    """Lettura del log strutturato per intervalli di tempo.
+
+    Le righe di ogni file sono in ordine di tempo, quindi l'inizio di un
+    intervallo si trova con una ricerca binaria sugli offset del file invece
+    di leggerlo tutto; dei file ruotati vengono aperti solo quelli che
+    possono contenere righe dell'intervallo.
+    """
+
+    def __init__(self, path=LOG_STORE_FILE):
+        self.path = path
+
+    def files(self):
+        """File del log dal piu' vecchio al piu' recente, con la data di fine di ciascuno."""
+        rotated = []
+        for name in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = name[len(self.path) + 1:]
+            try:
+                day = datetime.strptime(suffix, "%Y-%m-%d")
+            except ValueError:
+                continue
+            # Il file con suffisso D contiene le righe del giorno D
+            rotated.append((day + timedelta(days=1), name))
+        rotated.sort()
+        files = [(end.timestamp(), name) for end, name in rotated]
+        if os.path.exists(self.path):
+            files.append((float("inf"), self.path))
+        return files
+
+    def read_since(self, start_ts, end_ts=None):
+        """Ritorna i record con start_ts <= ts (< end_ts se indicato), in ordine di tempo."""
+        for file_end, name in self.files():
+            if file_end < start_ts:
+                continue
+            with open(name, "rb") as file:
+                file.seek(self._find_offset(file, start_ts))
+                for line in file:
+                    record = self._parse(line)
+                    if record is None:
+                        continue
+                    if end_ts is not None and record["ts"] >= end_ts:
+                        return
+                    if record["ts"] >= start_ts:
+                        yield record
+
+    def last_hours(self, hours=24):
+        return self.read_since(time.time() - hours * 3600)
+
+    def tail(self, count=20):
+        """Ultimi `count` record, letti a blocchi dalla fine del file corrente."""
+        records = deque(maxlen=count)
+        for _, name in reversed(self.files()):
+            lines = self._tail_lines(name, count - len(records))
+            for line in reversed(lines):
+                record = self._parse(line)
+                if record is not None:
+                    records.appendleft(record)
+            if len(records) >= count:
+                break
+        return list(records)
+
+    def _find_offset(self, file, start_ts):
+        """Offset della prima riga con ts >= start_ts (ricerca binaria sugli offset)."""
+        file.seek(0, os.SEEK_END)
+        low, high = 0, file.tell()
+        while low < high:
+            middle = (low + high) // 2
+            file.seek(middle)
+            if middle:
+                file.readline()  # allinea all'inizio della riga successiva
+            line_start = file.tell()
+            record = None
+            while record is None:
+                line = file.readline()
+                if not line:
+                    break
+                record = self._parse(line)
+            if record is None or record["ts"] >= start_ts:
+                high = middle
+            else:
+                low = max(line_start, middle + 1)
+        file.seek(low)
+        if low:
+            file.readline()
+        return file.tell()
+
+    @staticmethod
+    def _tail_lines(name, count):
+        if count <= 0:
+            return []
+        with open(name, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            position = file.tell()
+            data = b""
+            while position > 0 and data.count(b"\n") <= count:
+                step = min(TAIL_BLOCK, position)
+                position -= step
+                file.seek(position)
+                data = file.read(step) + data
+        lines = data.splitlines()
+        if position > 0:
+            lines = lines[1:]  # prima riga probabilmente tagliata
+        return lines[-count:]
+
+    @staticmethod
+    def _parse(line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(record, dict) or "ts" not in record:
+            return None
+        return record
+
+
+def recent_logs(count=20, path=LOG_STORE_FILE):
+    """Ultime righe di log, formattate per le email."""
+    return "\n".join(format_record(record) for record in LogStore(path).tail(count))
+
+
+def logs_last_24_hours(path=LOG_STORE_FILE):
+    return "\n".join(format_record(record) for record in LogStore(path).last_hours(24))
@@ -12,28 +12,64 @@ import os
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QLineEdit, QLabel,
     QFileDialog, QMessageBox, QDialog, QFormLayout, QHBoxLayout,
-    QVBoxLayout, QGridLayout, QRadioButton, QComboBox, QCheckBox
+    QVBoxLayout, QGridLayout, QRadioButton, QComboBox, QCheckBox, QSpinBox
 )
-from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtCore import QTimer, Qt, QThread, QObject, pyqtSignal
 from datetime import datetime, timedelta
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import shutil
 
-from sftp_client import SftpClient
-
-TRANSFER_LOG_FILE = "transfer_log.json"
-
-def load_transfer_log():
-    if os.path.exists(TRANSFER_LOG_FILE):
-        with open(TRANSFER_LOG_FILE, "r") as file:
-            return json.load(file)
-    return {}
+from sync_engine import SyncEngine
+import folder_watcher
+from connection_pool import get_pool
+from notifications import get_notifier
+from metrics import get_metrics, STATS_FILE
+import log_store
+
+log_store.install()
+
+TIMER_INTERVALS = {
+    "1 minuto": 60000,
+    "5 minuti": 300000,
+    "10 minuti": 600000,
+    "30 minuti": 1800000,
+    "1 ora": 3600000,
+    "2 ore": 7200000,
+    "3 ore": 10800000,
+    "5 ore": 18000000,
+    "6 ore": 21600000,
+    "10 ore": 36000000,
+    "12 ore": 43200000,
+    "18 ore": 64800000,
+    "24 ore": 86400000
+}
+
+
+class SyncWorker(QObject):
+    """Esegue SyncEngine fuori dal thread della GUI e riporta l'avanzamento via segnali."""
+    progress = pyqtSignal(str, int, int)
+    deferred = pyqtSignal(list, float)  # file ancora in scrittura, secondi dopo i quali ricontrollarli
+    finished = pyqtSignal(list)
+
+    def __init__(self, settings, names=None):
+        super().__init__()
+        self.settings = settings
+        self.names = names
 
-def save_transfer_log(log):
-    with open(TRANSFER_LOG_FILE, "w") as file:
-        json.dump(log, file, indent=4)
+    def run(self):
+        files_transferred = []
+        try:
+            engine = SyncEngine(self.settings, log_callback=logging.info,
+                                progress_callback=self.progress.emit)
+            files_transferred = engine.run(self.names)
+            if engine.deferred:
+                self.deferred.emit(engine.deferred, engine.recheck_after)
+        except Exception as e:
+            logging.error(f'[CRASH PREVENUTO] {e}')
+        finally:
+            self.finished.emit(files_transferred)
 
 class EmailSettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -92,42 +128,29 @@ class EmailSettingsDialog(QDialog):
 
 class MainWindow(QWidget):
     open_windows = []  # Traccia le finestre attive
+    watched_files_ready = pyqtSignal(object)  # nomi dal FolderWatcher, None = scansione completa
+    cycle_counter = 0
 
     def safe_sync_files(self):
-        def safe_sync_files(self):
-            try:
-                process = multiprocessing.Process(target=self.sync_files)
-                process.start()
-                process.join()
-            except Exception as e:
-                logging.error(f'[CRASH PREVENUTO - SUBPROCESS] {e}')
-            finally:
-                gc.collect()
-                MainWindow.cycle_counter += 1
-                try:
-                    import psutil, os
-                    proc = psutil.Process(os.getpid())
-                    mem = proc.memory_info().rss / 1024 / 1024
-                    logging.info(f'[RAM] Uso memoria processo principale: {mem:.2f} MB')
-                except Exception:
-                    pass
-                gc.collect()
+        """Tick del timer: avvia il ciclo e registra la memoria usata dal processo."""
+        try:
+            self.sync_files()
+        except Exception as e:
+            logging.error(f'[CRASH PREVENUTO] {e}')
+        finally:
+            MainWindow.cycle_counter += 1
             try:
-                self.sync_files()
-            except Exception as e:
-                logging.error(f'[CRASH PREVENUTO] {e}')
-            finally:
-                gc.collect()
-                MainWindow.cycle_counter += 1
-                process = psutil.Process(os.getpid())
-                mem = process.memory_info().rss / 1024 / 1024
+                mem = psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+                get_metrics().set("process_resident_memory_mb", round(mem, 2))
                 logging.info(f'[RAM] Utilizzo memoria: {mem:.2f} MB')
-                if MainWindow.cycle_counter % 3 == 0:
-                    snapshot = tracemalloc.take_snapshot()
-                    top_stats = snapshot.statistics('lineno')
-                    logging.info('[TRACEMALLOC] Top 5 allocazioni:')
-                    for stat in top_stats[:5]:
-                        logging.info(str(stat))
+            except Exception:
+                pass
+            if MainWindow.cycle_counter % 3 == 0:
+                snapshot = tracemalloc.take_snapshot()
+                top_stats = snapshot.statistics('lineno')
+                logging.info('[TRACEMALLOC] Top 5 allocazioni:')
+                for stat in top_stats[:5]:
+                    logging.info(str(stat))
 
     def __init__(self):
         super().__init__()
@@ -135,9 +158,19 @@ class MainWindow(QWidget):
         self.setWindowTitle("FTP Bizpal")
         #self.setWindowIcon(QIcon('logo.jpeg'))
         self.email_settings = {}
-        self.existing_files = set()
+        self.sftp_tuning = {}  # finestra, pacchetti, prefetch, cifrari: solo da file di configurazione
+        self.config = {}  # ultima configurazione caricata, con le chiavi senza widget (limiti, ordine, batch, ...)
+        self.metrics_port = None  # porta dell'endpoint HTTP delle metriche: solo da file di configurazione
+        self.readiness_checks = ["stable", "writers"]  # usati con "Attendi i file completi"; "marker" solo da file
+        self._sync_thread = None
+        self._sync_worker = None
+        self._sync_pending = False
+        self._pending_names = set()
+        self._deferred_names = set()  # file ancora in scrittura, ricontrollati da recheck_timer
+        self._folder_watcher = None
         self.initUI()
         self.setupTimer()
+        self.watched_files_ready.connect(self.sync_watched_files)
 
 
 
@@ -161,10 +194,13 @@ class MainWindow(QWidget):
         self.to_remote_button.setChecked(True)
         self.to_local_button = QRadioButton("Remoto a Locale")
         self.to_local_local_button = QRadioButton("Locale su Locale")
+        # Bidirezionale: sincronizza modifiche e cancellazioni dei due lati, i file grandi in delta
+        self.mirror_button = QRadioButton("Mirror")
 
         self.direction_group.addWidget(self.to_remote_button)
         self.direction_group.addWidget(self.to_local_button)
         self.direction_group.addWidget(self.to_local_local_button)
+        self.direction_group.addWidget(self.mirror_button)
         grid.addLayout(self.direction_group, 0, 0, 1, 2)
 
         # SFTP configuration inputs
@@ -229,20 +265,15 @@ class MainWindow(QWidget):
 
         # Timer and log controls
         self.delete_after_transfer_checkbox = QCheckBox("Cancella il file una volta trasferito")
-        self.transfer_new_files_only_checkbox = QCheckBox("Trasferisci solo i file nuovi")
 
         self.timerLabel = QLabel("Timer Interval:")
         self.timerComboBox = QComboBox()
-        self.timerComboBox.addItems([
-            "1 minuto", "5 minuti", "10 minuti", "30 minuti", "1 ora", "2 ore",
-            "3 ore", "5 ore", "6 ore", "10 ore", "12 ore", "18 ore", "24 ore"
-        ])
+        self.timerComboBox.addItems(list(TIMER_INTERVALS))
         self.timerComboBox.currentIndexChanged.connect(self.update_timer_interval)
 
         grid.addWidget(self.timerLabel, 9, 1)
         grid.addWidget(self.timerComboBox, 9, 2)
         grid.addWidget(self.delete_after_transfer_checkbox, 10, 0)
-        grid.addWidget(self.transfer_new_files_only_checkbox, 10, 1)
 
         self.clearLogButton = QPushButton("Pulisci log")
         self.clearLogButton.clicked.connect(self.clear_logs)
@@ -250,98 +281,50 @@ class MainWindow(QWidget):
 
         grid.addWidget(self.clearLogButton, 10, 2)
 
-    def setupTimer(self):
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.sync_files)
-        self.timer.start(30000)  # Default to 30 seconds
+        self.parallelLabel = QLabel("Trasferimenti paralleli:")
+        self.parallelSpinBox = QSpinBox()
+        self.parallelSpinBox.setRange(1, 16)
+        self.parallelSpinBox.setValue(1)
 
+        grid.addWidget(self.parallelLabel, 11, 0)
+        grid.addWidget(self.parallelSpinBox, 11, 1)
 
+        self.watch_folder_checkbox = QCheckBox("Monitora la cartella")
+        if not folder_watcher.is_supported():
+            self.watch_folder_checkbox.setEnabled(False)
+            self.watch_folder_checkbox.setToolTip("Disponibile solo su Linux (inotify)")
+        self.watch_folder_checkbox.toggled.connect(self.update_folder_watch)
+        self.local_dir_line_edit.editingFinished.connect(self.update_folder_watch)
 
-    #metodo di racoglimento log ultime 24 ore
-    def get_recent_logs(self):
-        """Ritorna i log delle ultime 24 ore."""
-        recent_logs = []
-        now = datetime.now()
-        for log in logs:
-            if log.startswith("["):
-                try:
-                    log_time = datetime.strptime(log[1:9], "%H:%M:%S")
-                    if (now - log_time).total_seconds() <= 86400:  # Ultime 24 ore
-                        recent_logs.append(log)
-                except ValueError:
-                    continue
-        return recent_logs
+        grid.addWidget(self.watch_folder_checkbox, 11, 2)
 
+        self.resumable_checkbox = QCheckBox("Trasferimenti riprendibili")
+        grid.addWidget(self.resumable_checkbox, 12, 0)
 
+        # Hash calcolato durante il trasferimento e confrontato con la copia remota prima di cancellare
+        self.verify_checkbox = QCheckBox("Verifica integrità (sha256)")
+        grid.addWidget(self.verify_checkbox, 12, 1)
 
-    def sync_files(self):
-        self.append_log("Starting synchronization...")
-        QApplication.processEvents()
-
-        direction = "to_remote" if self.to_remote_button.isChecked() else "to_local"
-        transfer_log = load_transfer_log()
-
-        try:
-            sftp_client = SftpClient(
-                self.host_line_edit.text(),
-                int(self.port_line_edit.text()),
-                self.username_line_edit.text(),
-                self.password_line_edit.text(),
-                log_callback=self.append_log
-                #self.append_log
-            )
-            sftp_client.connect()
-
-            files_transferred = []
-
-            if direction == "to_local":
-                remote_files = sftp_client.list_files(self.remote_dir_line_edit.text())
-                for file_attr in remote_files:
-                    file_name = file_attr.filename
-                    if file_name in transfer_log.get("to_local", []):
-                        self.append_log(f"File already transferred: {file_name}")
-                        continue
-
-                    remote_file_path = os.path.join(self.remote_dir_line_edit.text(), file_name)
-                    local_file_path = os.path.join(self.local_dir_line_edit.text(), file_name)
-
-                    try:
-                        sftp_client.download_file(remote_file_path, local_file_path)
-                        transfer_log.setdefault("to_local", []).append(file_name)
-                        save_transfer_log(transfer_log)
-                        files_transferred.append(file_name)
-                        self.append_log(f"Downloaded file: {remote_file_path} to {local_file_path}")
-
-                        if self.delete_after_transfer_checkbox.isChecked():
-                            sftp_client.remove_file(remote_file_path)
-                            self.append_log(f"Deleted remote file: {remote_file_path}")
-                    except Exception as e:
-                        self.append_log(f"Failed to download file {remote_file_path}: {e}")
-
-            sftp_client.close()
-
-            if files_transferred:
-                self.append_log(f"Files transferred: {', '.join(files_transferred)}")
-            else:
-                self.append_log("No new files were transferred.")
+        # Sincronizza anche le sottocartelle (es. cliente/anno/mese), ricreandole a destinazione
+        self.recursive_checkbox = QCheckBox("Includi sottocartelle")
+        grid.addWidget(self.recursive_checkbox, 12, 2)
 
-        except Exception as e:
-            self.append_log(f"Error during synchronization: {e}")
+        # Non trasferisce i file che un altro programma sta ancora scrivendo
+        self.readiness_checkbox = QCheckBox("Attendi i file completi")
+        grid.addWidget(self.readiness_checkbox, 13, 0)
 
-        finally:
-            pass
+    def setupTimer(self):
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.safe_sync_files)
+        self.timer.start(30000)  # Default to 30 seconds
 
+        self.recheck_timer = QTimer(self)
+        self.recheck_timer.setSingleShot(True)
+        self.recheck_timer.timeout.connect(self.recheck_deferred_files)
 
 
-    # Resto delle funzioni
 
 
-        gc.collect()
-        # Cleanup oggetti
-        try:
-            del client, log, files, uploaded, downloaded
-        except Exception:
-            pass
     def open_new_window(self):  # Aggiunta la funzione per aprire una nuova finestra
         new_window = MainWindow()
         new_window.show()
@@ -354,184 +337,178 @@ class MainWindow(QWidget):
 
     def update_timer_interval(self):
         interval_text = self.timerComboBox.currentText()
-        intervals = {
-            "1 minuto": 60000,
-            "5 minuti": 300000,
-            "10 minuti": 600000,
-            "30 minuti": 1800000,
-            "1 ora": 3600000,
-            "2 ore": 7200000,
-            "3 ore": 10800000,
-            "5 ore": 18000000,
-            "6 ore": 21600000,
-            "10 ore": 36000000,
-            "12 ore": 43200000,
-            "18 ore": 64800000,
-            "24 ore": 86400000
-        }
-        self.timer.start(intervals[interval_text])
+        self.timer.start(TIMER_INTERVALS[interval_text])
         self.append_log(f"Timer interval set to {interval_text}")
 
+    def set_timer_interval(self, seconds):
+        """Imposta l'intervallo salvato nel profilo, selezionando la voce corrispondente se esiste."""
+        for interval_text, interval_ms in TIMER_INTERVALS.items():
+            if interval_ms == seconds * 1000:
+                self.timerComboBox.blockSignals(True)
+                self.timerComboBox.setCurrentText(interval_text)
+                self.timerComboBox.blockSignals(False)
+                break
+        self.timer.start(seconds * 1000)
+        self.append_log(f"Timer interval set to {seconds} s")
+
     def choose_local_directory(self):
         dir = QFileDialog.getExistingDirectory(self, "Choose Directory", "",
                                                QFileDialog.ShowDirsOnly | QFileDialog.DontResolveSymlinks)
         if dir:
             self.local_dir_line_edit.setText(dir)
             self.append_log(f"Local directory chosen: {dir}")
+            self.update_folder_watch()
 
-    def sync_files(self):
-        self.append_log("Starting synchronization...")
-        QApplication.processEvents()
-        direction = "to_remote" if self.to_remote_button.isChecked() else ("to_local" if self.to_local_button.isChecked() else "local_to_local")
-        transfer_log = load_transfer_log()
-
-        try:
-            if direction == "local_to_local":
-                self.local_to_local_transfer()
-            else:
-                sftp_client = SftpClient(
-                    self.host_line_edit.text(),
-                    int(self.port_line_edit.text()),
-                    self.username_line_edit.text(),
-                    self.password_line_edit.text(),
-                    self.append_log,
-                )
-                sftp_client.connect()
-
-                files_transferred = []
-
-                if direction == "to_remote":
-                    local_files = os.listdir(self.local_dir_line_edit.text())
-                    for file_name in local_files:
-                        if file_name in transfer_log.get("to_remote", []):
-                            self.append_log(f"File already transferred: {file_name}")
-                            continue
-
-                        local_file_path = os.path.join(self.local_dir_line_edit.text(), file_name)
-                        remote_file_path = os.path.join(self.remote_dir_line_edit.text(), file_name)
-
-                        try:
-                            sftp_client.upload_file(local_file_path, remote_file_path)
-                            transfer_log.setdefault("to_remote", []).append(file_name)
-                            save_transfer_log(transfer_log)
-                            files_transferred.append(file_name)
-                            self.append_log(f"Uploaded file: {local_file_path} to {remote_file_path}")
-
-                            if self.delete_after_transfer_checkbox.isChecked():
-                                os.remove(local_file_path)
-                                self.append_log(f"Deleted file {local_file_path} after upload.")
-                        except Exception as e:
-                            self.append_log(f"Failed to upload {file_name}: {e}")
-                elif direction == "to_local":
-                            remote_files = sftp_client.list_files(self.remote_dir_line_edit.text())
-                for file_attr in remote_files:
-                    file_name = file_attr.filename
-                    if file_name in transfer_log.get("to_local", []):
-                        self.append_log(f"File already transferred: {file_name}")
-                        continue
-
-                    remote_file_path = os.path.join(self.remote_dir_line_edit.text(), file_name)
-                    local_file_path = os.path.join(self.local_dir_line_edit.text(), file_name)
-
-                    try:
-                        sftp_client.download_file(remote_file_path, local_file_path)
-                        transfer_log.setdefault("to_local", []).append(file_name)
-                        save_transfer_log(transfer_log)
-                        files_transferred.append(file_name)
-                        self.append_log(f"Downloaded file: {remote_file_path} to {local_file_path}")
-
-                        if self.delete_after_transfer_checkbox.isChecked():
-                            sftp_client.remove_file(remote_file_path)
-                            self.append_log(f"Deleted remote file {remote_file_path} after download.")
-                    except Exception as e:
-                        self.append_log(f"Failed to download {file_name}: {e}")
-
-                sftp_client.close()
-                # Invia email con i file trasferiti
-                if files_transferred:
-                    self.send_email_with_logs(files_transferred, direction)
-                else:
-                    self.append_log("No new files were transferred.")
+    def update_folder_watch(self):
+        """Avvia o ferma il monitoraggio inotify della cartella locale.
 
-        except Exception as e:
-            self.append_log(f"Error during synchronization: {e}")
-        finally:
-            pass
+        Il timer resta attivo come scansione periodica di riconciliazione.
+        """
+        if self._folder_watcher is not None:
+            self._folder_watcher.stop()
+            self._folder_watcher = None
 
-        gc.collect()
-        # Cleanup oggetti
-        try:
-            del client, log, files, uploaded, downloaded
-        except Exception:
-            pass
-    def send_email_with_logs(self, files_transferred, direction):
-        if not self.email_settings:
-            QMessageBox.warning(self, "Email Settings", "Please configure your email settings first.")
+        local_dir = self.local_dir_line_edit.text()
+        if not self.watch_folder_checkbox.isChecked() or not os.path.isdir(local_dir):
             return
-        subject = "File Transfer Notification" if direction == "to_remote" else "File Download Notification"
-        body = f"The following files have been {'uploaded' if direction == 'to_remote' else 'downloaded'} successfully:\n\n" + "\n".join(files_transferred)
-
-        # Aggiungi log recenti alla email
-        recent_logs = self.get_recent_logs()
-        if recent_logs:
-            body += "\n\nRecent Logs:\n" + recent_logs
+        watcher = folder_watcher.FolderWatcher(local_dir, self.watched_files_ready.emit,
+                                               log_callback=logging.info)
+        try:
+            watcher.start()
+            self._folder_watcher = watcher
+        except OSError as e:
+            self.append_log(f"Unable to watch {local_dir}: {e}")
+
+    def closeEvent(self, event):
+        if self._folder_watcher is not None:
+            self._folder_watcher.stop()
+            self._folder_watcher = None
+        super().closeEvent(event)
+
+    def get_settings(self):
+        """Legge i widget nel thread della GUI e ritorna la configurazione corrente.
+
+        I valori dei widget vengono sovrapposti alla configurazione caricata,
+        quindi le chiavi impostabili solo da file sopravvivono a un salvataggio.
+        """
+        settings = dict(self.config)
+        settings.update({
+            "sftp_host": self.host_line_edit.text(),
+            "sftp_port": self.port_line_edit.text(),
+            "sftp_username": self.username_line_edit.text(),
+            "sftp_password": self.password_line_edit.text(),
+            "local_dir": self.local_dir_line_edit.text(),
+            "remote_dir": self.remote_dir_line_edit.text(),
+            "email_settings": self.email_settings,
+            "sftp_tuning": self.sftp_tuning,
+            "metrics_port": self.metrics_port,
+            "direction": "to_remote" if self.to_remote_button.isChecked() else ("to_local" if self.to_local_button.isChecked() else ("mirror" if self.mirror_button.isChecked() else "local_to_local")),
+            "delete_after_transfer": self.delete_after_transfer_checkbox.isChecked(),
+            "parallel_transfers": self.parallelSpinBox.value(),
+            "watch_folder": self.watch_folder_checkbox.isChecked(),
+            "resumable_transfers": self.resumable_checkbox.isChecked(),
+            "verify_transfers": self.verify_checkbox.isChecked(),
+            "recursive": self.recursive_checkbox.isChecked(),
+            "readiness_checks": self.readiness_checks if self.readiness_checkbox.isChecked() else [],
+            "sync_interval": self.timer.interval() // 1000
+        })
+        return settings
 
-        self._send_email(subject, body)
+    def sync_files(self):
+        """Avvia un ciclo di sync su un QThread; i tick sovrapposti vengono accorpati."""
+        self.start_sync(None)
 
-    def get_recent_logs(self):
-        """Estrai le ultime righe dei log (es. ultime 20 righe)"""
-        recent_logs = "\n".join(log_text.splitlines()[-20:])  # Ultime 20 righe
-        return recent_logs
+    def sync_watched_files(self, names):
+        self.start_sync(names)
 
-    def _send_email(self, subject, body):
-        if not self.email_settings:
-            self.append_log("Email not configured.")
+    def start_sync(self, names):
+        if self._sync_thread is not None:
+            if names is not None:
+                self._pending_names.update(names)
+                return
+            if not self._sync_pending:
+                self.append_log("Synchronization already running, next cycle queued.")
+            self._sync_pending = True
             return
 
-        # Converti il corpo in stringa se è una lista
-        if isinstance(body, list):
-            body = "\n".join(body)
+        if names is None:
+            # Una scansione completa copre anche i file segnalati dal watcher
+            self._sync_pending = False
+            self._pending_names.clear()
+        self._sync_thread = QThread(self)
+        self._sync_worker = SyncWorker(self.get_settings(), names)
+        self._sync_worker.moveToThread(self._sync_thread)
+        self._sync_thread.started.connect(self._sync_worker.run)
+        self._sync_worker.progress.connect(self.on_sync_progress)
+        self._sync_worker.deferred.connect(self.on_sync_deferred)
+        self._sync_worker.finished.connect(self.on_sync_finished)
+        self._sync_worker.finished.connect(self._sync_thread.quit)
+        self._sync_thread.finished.connect(self.on_sync_thread_finished)
+        self.sync_button.setEnabled(False)
+        self._sync_thread.start()
+
+    def on_sync_progress(self, file_name, index, total):
+        self.sync_button.setText(f"Sync {index}/{total}" if total else f"Sync {index}")
+
+    def on_sync_deferred(self, names, delay):
+        """Ricontrolla dopo `delay` secondi i file rimandati perche' ancora in scrittura."""
+        self._deferred_names.update(names)
+        if not self.recheck_timer.isActive():
+            self.recheck_timer.start(int(delay * 1000))
+
+    def recheck_deferred_files(self):
+        if self._deferred_names:
+            names = sorted(self._deferred_names)
+            self._deferred_names.clear()
+            self.start_sync(names)
+
+    def on_sync_finished(self, files_transferred):
+        if files_transferred:
+            self.append_log(f"Sync cycle finished, {len(files_transferred)} file(s) transferred.")
+        get_metrics().write_stats(STATS_FILE)
+
+    def on_sync_thread_finished(self):
+        self._sync_thread.deleteLater()
+        self._sync_thread = None
+        self._sync_worker = None
+        self.sync_button.setText("Sync Now")
+        self.sync_button.setEnabled(True)
+        gc.collect()
 
-        msg = MIMEMultipart()
-        msg['From'] = self.email_settings.get('username')
-        msg['To'] = self.email_settings.get('recipient')
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
+        # Un tick arrivato durante il ciclo precedente genera un solo ciclo aggiuntivo
+        if self._sync_pending:
+            self.sync_files()
+        elif self._pending_names:
+            names = sorted(self._pending_names)
+            self._pending_names.clear()
+            self.start_sync(names)
 
-        try:
-            server = smtplib.SMTP(self.email_settings.get('server'), int(self.email_settings.get('port')))
-            server.starttls()
-            server.login(self.email_settings.get('username'), self.email_settings.get('password'))
-            server.sendmail(msg['From'], msg['To'], msg.as_string())
-            server.quit()
-            self.append_log("Email sent successfully.")
-        except Exception as e:
-            self.append_log(f"Failed to send email: {e}")
+    def _send_email(self, subject, body):
+        # L'invio avviene nel thread della coda notifiche, mai nel thread della GUI
+        get_notifier().notify(self.email_settings, subject, body, self.append_log)
 
 
 
 
     # Aggiungi la configurazione per il report giornaliero
     def setup_daily_report(self):
-        """Imposta l'invio del report delle ultime 24 ore alle 7:30 e 15:00."""
+        """Imposta l'invio del report delle ultime 24 ore alle 7:30 e 15:00, ogni giorno."""
+        self.daily_report_timer = QTimer(self)
+        self.daily_report_timer.setSingleShot(True)
+        self.daily_report_timer.timeout.connect(self.on_daily_report_timer)
+        self.arm_daily_report()
+
+    def arm_daily_report(self):
+        # Ricalcolato a ogni scatto: un intervallo fisso di 24 ore deriverebbe col tempo
         now = datetime.now()
-        next_7_30 = now.replace(hour=7, minute=30, second=0, microsecond=0)
-        next_15_00 = now.replace(hour=15, minute=0, second=0, microsecond=0)
+        next_report = log_store.next_report_time(now)
+        self.daily_report_timer.start(max(1000, int((next_report - now).total_seconds() * 1000)))
 
-        if now >= next_7_30:
-            next_7_30 += timedelta(days=1)
-        if now >= next_15_00:
-            next_15_00 += timedelta(days=1)
-
-        # Timer per le 7:30
-        self.timer_7_30 = QTimer(self)
-        self.timer_7_30.timeout.connect(lambda: self.send_daily_log_report())
-        self.timer_7_30.start(int((next_7_30 - now).total_seconds() * 1000))  # Conversione a intero
-
-        # Timer per le 15:00
-        self.timer_15_00 = QTimer(self)
-        self.timer_15_00.timeout.connect(lambda: self.send_daily_log_report())
-        self.timer_15_00.start(int((next_15_00 - now).total_seconds() * 1000))  # Conversione a intero
+    def on_daily_report_timer(self):
+        try:
+            self.send_daily_log_report()
+        finally:
+            self.arm_daily_report()
 
     def send_daily_log_report(self):
         """Invia il report giornaliero delle ultime 24 ore."""
@@ -544,234 +521,17 @@ class MainWindow(QWidget):
         self._send_email(subject, body)
 
     def get_logs_last_24_hours(self):
-        """Recupera i log delle ultime 24 ore dalla finestra log."""
-        logs = log_text.splitlines()
-        last_24_hours_logs = []
-        now = datetime.now()
-
-        for log in reversed(logs):
-            try:
-                log_time_str = log[1:9]  # Formato [HH:MM:SS]
-                log_time = datetime.strptime(log_time_str, "%H:%M:%S").replace(
-                    year=now.year, month=now.month, day=now.day
-                )
-                if log_time < now - timedelta(days=1):
-                    break
-                last_24_hours_logs.append(log)
-            except ValueError:
-                continue
-
-        return "\n".join(reversed(last_24_hours_logs))
-
-    # Modifica nella funzione perform_sync per usare la funzione aggiornata
-    def perform_sync(self, direction):
-        sftp_client = SftpClient(
-            self.host_line_edit.text(),
-            int(self.port_line_edit.text()),
-            self.username_line_edit.text(),
-            self.password_line_edit.text(),
-            self.append_log
-        )
-        sftp_client.connect()
-
-        files_transferred = []
-
-        try:
-            if direction == "to_remote":
-                # Elenco dei file locali
-                local_files = os.listdir(self.local_dir_line_edit.text())
-                for file_name in local_files:
-                    if file_name.startswith('.') or not file_name.strip():
-                        self.append_log(f"Skipping hidden or invalid file: {file_name}")
-                        continue
-
-                    local_file_path = os.path.join(self.local_dir_line_edit.text(), file_name)
-                    remote_file_path = os.path.join(self.remote_dir_line_edit.text(), file_name)
-
-                    try:
-                        sftp_client.upload_file(local_file_path, remote_file_path)
-                        files_transferred.append(file_name)
-                        self.append_log(f"Uploaded file: {local_file_path} to {remote_file_path}")
-
-                        # Cancella il file locale dopo il trasferimento, se l'opzione è abilitata
-                        if self.delete_after_transfer_checkbox.isChecked():
-                            os.remove(local_file_path)
-                            self.append_log(f"Deleted file {local_file_path} after upload.")
-                    except Exception as e:
-                        self.append_log(f"Failed to upload file {local_file_path}: {e}")
-
-            else:  # Per "to_local"
-                remote_files = sftp_client.list_files(self.remote_dir_line_edit.text())
-                for remote_file in remote_files:
-                    remote_file_name = getattr(remote_file, 'filename', None)
-                    if not remote_file_name or remote_file_name.startswith('.'):
-                        self.append_log(f"Skipping invalid or hidden file: {remote_file}")
-                        continue
-
-                    remote_file_path = os.path.join(self.remote_dir_line_edit.text(), remote_file_name)
-                    local_path = os.path.join(self.local_dir_line_edit.text(), remote_file_name)
-
-                    try:
-                        sftp_client.download_file(remote_file_path, local_path)
-                        files_transferred.append(remote_file_name)
-                        self.append_log(f"Downloaded file: {remote_file_path} to {local_path}")
-
-                        # Cancella il file remoto dopo il trasferimento, se l'opzione è abilitata
-                        if self.delete_after_transfer_checkbox.isChecked():
-                            sftp_client.delete_file(remote_file_path)
-                            self.append_log(f"Deleted file {remote_file_path} after download.")
-                    except Exception as e:
-                        self.append_log(f"Failed to download file {remote_file_path}: {e}")
-
-            # Invio email alla fine del trasferimento
-            self.send_email_with_logs(files_transferred, direction)
-
-        except Exception as e:
-            self.append_log(f"Error during sync: {e}")
-
-        finally:
-            sftp_client.close()
-
-
-    def filter_files(files):
-        """Filtro per ignorare file nascosti."""
-        return [file for file in files if not file.startswith('.')]
-
-
-    def sync_only_new_files(self, direction):
-        self.append_log("Transferring only new files added to the local directory...")
-        src_dir = self.local_dir_line_edit.text()
-        current_files = {f for f in os.listdir(src_dir) if not f.startswith('.') and f.strip()}
-        new_files = current_files - self.existing_files
-
-        if new_files:
-            self.append_log(f"New files detected: {', '.join(new_files)}")
-            if direction == "to_remote":
-                self.perform_sync(direction)
-        else:
-            self.append_log("No new files found to transfer.")
-        self.existing_files = current_files
-
-
-        # Percorso per salvare i file già trasferiti
-        transferred_files_path = "transferred_files.json"
-
-        # Carica i file già trasferiti
-        if os.path.exists(transferred_files_path):
-            with open(transferred_files_path, 'r') as file:
-                transferred_files = set(json.load(file))
-        else:
-            transferred_files = set()
-
-        # Elenco dei file attualmente nella directory
-        current_files = set(os.listdir(src_dir))
-        new_files = current_files - transferred_files
-
-        files_transferred = []
-        try:
-            if new_files:
-                self.append_log(f"New files detected: {', '.join(new_files)}")
-                sftp_client = SftpClient(
-                    self.host_line_edit.text(), int(self.port_line_edit.text()),
-                    self.username_line_edit.text(), self.password_line_edit.text(),
-                    self.append_log
-                )
-                sftp_client.connect()
-
-                if direction == "to_remote":
-                    for file in new_files:
-                        local_path = os.path.join(src_dir, file)
-                        remote_path = os.path.join(self.remote_dir_line_edit.text(), file)
-                        sftp_client.upload_file(local_path, remote_path)
-                        files_transferred.append(file)
-                elif direction == "to_local":
-                    for file in new_files:
-                        remote_path = os.path.join(self.remote_dir_line_edit.text(), file)
-                        local_path = os.path.join(src_dir, file)
-                        sftp_client.download_file(remote_path, local_path)
-                        files_transferred.append(file)
-
-                sftp_client.close()
-                self.append_log(f"New files transferred: {', '.join(files_transferred)}")
-            else:
-                self.append_log("No new files found to transfer.")
-
-
-            # Invia una mail sempre
-            subject = "File Transfer Notification"
-            if files_transferred:
-                body = (
-                    f"The following new files have been {'uploaded' if direction == 'to_remote' else 'downloaded'}:\n"
-                    + "\n".join(files_transferred)
-                )
-            else:
-                body = "No new files were transferred during the sync process."
-
-            recent_logs = self.get_recent_logs()
-            body += "\n\nRecent Logs:\n" + "\n".join(recent_logs)
-
-            self._send_email(subject, body)
-        except Exception as e:
-            self.append_log(f"Error during transfer of new files: {e}")
-
-
-
-
-    def local_to_local_transfer(self):
-        try:
-            src_dir = self.local_dir_line_edit.text()
-            dest_dir = self.remote_dir_line_edit.text()
-
-            # Verifica che le directory di origine e destinazione siano valide
-            if not os.path.isdir(src_dir) or not os.path.isdir(dest_dir):
-                self.append_log("Errore: directory di origine o destinazione non valida.")
-                return
-
-            self.append_log(f"Transferring files from {src_dir} to {dest_dir}...")
-
-            files_transferred = []  # Lista per tenere traccia dei file trasferiti
-
-            for file in os.listdir(src_dir):
-                src_file = os.path.join(src_dir, file)
-                dest_file = os.path.join(dest_dir, file)
-
-                # Solo i file vengono trasferiti
-                if os.path.isfile(src_file):
-                    # Copia il file nella directory di destinazione
-                    shutil.copy2(src_file, dest_file)
-                    files_transferred.append(file)
-
-            self.append_log(f"Files transferred: {', '.join(files_transferred)}")
-
-            # Cancella i file dalla directory di origine solo se il trasferimento è completo
-            if self.delete_after_transfer_checkbox.isChecked():
-                for file in files_transferred:
-                    src_file = os.path.join(src_dir, file)
-                    os.remove(src_file)
-                    self.append_log(f"Deleted file {file} from {src_dir}")
-
-            self.append_log("Local to local transfer complete.")
-        except Exception as e:
-            self.append_log(f"Error during local to local transfer: {e}")
-
-            if self.delete_after_transfer_checkbox.isChecked():
-                for file in files_transferred:
-                    try:
-                        os.remove(os.path.join(self.local_dir_line_edit.text(), file))
-                        self.append_log(f"Deleted file: {file}")
-                    except Exception as e:
-                        self.append_log(f"Failed to delete file {file}: {e}")
-
-
+        """Recupera i log delle ultime 24 ore dal log strutturato (log.jsonl)."""
+        return log_store.logs_last_24_hours()
 
     def test_connection(self):
         try:
             self.append_log("Testing connection...")
-            sftp_client = SftpClient(self.host_line_edit.text(), int(self.port_line_edit.text()),
-                                     self.username_line_edit.text(), self.password_line_edit.text(),
-                                     self.append_log)
-            sftp_client.connect()
-            sftp_client.close()
+            # La connessione resta nel pool e viene riusata dal primo ciclo di sync
+            sftp_client = get_pool().acquire(self.host_line_edit.text(), int(self.port_line_edit.text()),
+                                             self.username_line_edit.text(), self.password_line_edit.text(),
+                                             self.append_log, self.sftp_tuning)
+            get_pool().release(sftp_client)
             QMessageBox.information(self, "Success", "Connection successful!")
             self.append_log("Connection successful")
         except Exception as e:
@@ -782,22 +542,7 @@ class MainWindow(QWidget):
         if not self.email_settings:
             self.append_log("Email settings are not configured. Please set them up.")
             return
-
-        msg = MIMEMultipart()
-        msg['From'] = self.email_settings.get("username")
-        msg['To'] = self.email_settings.get("recipient")
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        try:
-            server = smtplib.SMTP(self.email_settings.get("server"), int(self.email_settings.get("port")))
-            server.starttls()
-            server.login(self.email_settings.get("username"), self.email_settings.get("password"))
-            server.sendmail(msg['From'], msg['To'], msg.as_string())
-            server.quit()
-            self.append_log("Email sent successfully.")
-        except Exception as e:
-            self.append_log(f"Failed to send email: {e}")
+        get_notifier().notify(self.email_settings, subject, body, self.append_log)
 
 
     def clear_logs(self):
@@ -816,18 +561,7 @@ class MainWindow(QWidget):
     def save_configuration(self):
         path, _ = QFileDialog.getSaveFileName(self, "Save Configuration", "", "JSON Files (*.json)")
         if path:
-            config = {
-                "sftp_host": self.host_line_edit.text(),
-                "sftp_port": self.port_line_edit.text(),
-                "sftp_username": self.username_line_edit.text(),
-                "sftp_password": self.password_line_edit.text(),
-                "local_dir": self.local_dir_line_edit.text(),
-                "remote_dir": self.remote_dir_line_edit.text(),
-                "email_settings": self.email_settings,
-                "direction": "to_remote" if self.to_remote_button.isChecked() else ("to_local" if self.to_local_button.isChecked() else "local_to_local"),
-                "delete_after_transfer": self.delete_after_transfer_checkbox.isChecked(),
-                "transfer_new_files_only": self.transfer_new_files_only_checkbox.isChecked()
-            }
+            config = self.get_settings()
             with open(path, 'w') as file:
                 json.dump(config, file, indent=4)
             self.append_log("Configuration saved successfully to " + path)
@@ -837,6 +571,7 @@ class MainWindow(QWidget):
         if path:
             with open(path, 'r') as file:
                 config = json.load(file)
+            self.config = config
             self.host_line_edit.setText(config.get('sftp_host', ''))
             self.port_line_edit.setText(config.get('sftp_port', '22'))
             self.username_line_edit.setText(config.get('sftp_username', ''))
@@ -844,14 +579,33 @@ class MainWindow(QWidget):
             self.local_dir_line_edit.setText(config.get('local_dir', ''))
             self.remote_dir_line_edit.setText(config.get('remote_dir', ''))
             self.email_settings = config.get('email_settings', {})
+            self.sftp_tuning = config.get('sftp_tuning', {})
+            self.metrics_port = config.get('metrics_port')
+            if self.metrics_port:
+                try:
+                    get_metrics().serve(int(self.metrics_port))
+                except OSError as e:
+                    self.append_log(f"Unable to start the metrics endpoint on port {self.metrics_port}: {e}")
             if config.get('direction') == "to_remote":
                 self.to_remote_button.setChecked(True)
             elif config.get('direction') == "to_local":
                 self.to_local_button.setChecked(True)
+            elif config.get('direction') == "mirror":
+                self.mirror_button.setChecked(True)
             else:
                 self.to_local_local_button.setChecked(True)
             self.delete_after_transfer_checkbox.setChecked(config.get('delete_after_transfer', False))
-            self.transfer_new_files_only_checkbox.setChecked(config.get('transfer_new_files_only', False))
+            self.parallelSpinBox.setValue(int(config.get('parallel_transfers', 1)))
+            self.watch_folder_checkbox.setChecked(config.get('watch_folder', False) and folder_watcher.is_supported())
+            self.resumable_checkbox.setChecked(config.get('resumable_transfers', False))
+            self.verify_checkbox.setChecked(config.get('verify_transfers', False))
+            self.recursive_checkbox.setChecked(config.get('recursive', False))
+            self.readiness_checkbox.setChecked(bool(config.get('readiness_checks')))
+            if config.get('readiness_checks'):
+                self.readiness_checks = config['readiness_checks']
+            if config.get('sync_interval'):
+                self.set_timer_interval(int(config['sync_interval']))
+            self.update_folder_watch()
             self.append_log("Configuration loaded from " + path)
 
 tracemalloc.start()
@@ -863,19 +617,5 @@ if __name__ == "__main__":
 
 
 def _send_email(subject, body, email_settings):
-    """Invia un'email utilizzando le impostazioni fornite."""
-    msg = MIMEMultipart()
-    msg['From'] = email_settings['username']
-    msg['To'] = email_settings['recipient']
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    try:
-        server = smtplib.SMTP(email_settings['server'], int(email_settings['port']))
-        server.starttls()
-        server.login(email_settings['username'], email_settings['password'])
-        server.sendmail(msg['From'], msg['To'], msg.as_string())
-        server.quit()
-        print("[LOG] Email inviata correttamente.")
-    except Exception as e:
-        print(f"[ERRORE] Invio email fallito: {e}")
+    """Accoda un'email con le impostazioni fornite; l'invio avviene in background."""
+    get_notifier().notify(email_settings, subject, body)
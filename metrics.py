@@ -0,0 +1,222 @@
+"""Metriche di runtime dei trasferimenti.
+
+Contatori, valori istantanei e riepiloghi (numero, somma, massimo) con
+etichette, tenuti in memoria e condivisi dal processo tramite
+`get_metrics()`. Sono esposti in due modi:
+
+- un endpoint HTTP locale (`serve(port)`): `/metrics` in formato testo
+  Prometheus, `/stats.json` in JSON;
+- un file JSON (`write_stats(path)`) riscritto a fine ciclo, utile a chi
+  non puo' interrogare il processo.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS_FILE = "metrics.json"
+RECENT_TRANSFERS = 50  # ultimi file trasferiti riportati nelle statistiche JSON
+PREFIX = "ftptransfert_"
+
+HELP = {
+    "transfer_bytes_total": "Bytes transferred",
+    "transfer_files_total": "Files transferred",
+    "transfer_failures_total": "Failed file transfers by error type",
+    "transfer_seconds": "Duration of a single file transfer",
+    "transfer_last_mb_per_second": "Throughput of the last completed file transfer",
+    "transfer_queue_depth": "Transfers submitted and not yet completed",
+    "sftp_connect_seconds": "TCP and SSH handshake time",
+    "sftp_auth_seconds": "SSH authentication time",
+    "sftp_connect_failures_total": "Failed SFTP connections by error type",
+    "sftp_listing_seconds": "Time to list a remote directory",
+    "sftp_listing_entries": "Files returned by the last remote listing",
+    "sync_cycle_seconds": "Duration of a synchronization cycle",
+    "sync_cycles_total": "Synchronization cycles by result",
+    "process_resident_memory_mb": "Resident memory of the process",
+    "transfer_retries_total": "File transfers retried within a cycle",
+    "sftp_circuit_open": "1 while connections to the host are paused by the circuit breaker",
+    "bandwidth_limit_bytes_per_second": "Active bandwidth limit, 0 when unlimited",
+    "bandwidth_wait_seconds_total": "Time transfers spent waiting for the bandwidth limit",
+    "delta_saved_bytes_total": "Bytes not sent thanks to delta transfers in mirror mode",
+    "mirror_conflicts_total": "Files changed on both sides in mirror mode, by conflict policy",
+    "batch_files_total": "Small files transferred inside batch archives",
+}
+
+
+def _key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in key) + "}"
+
+
+class Metrics:
+    """Registro delle metriche, sicuro fra thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # nome -> {etichette: valore}
+        self._gauges = {}
+        self._summaries = {}  # nome -> {etichette: [count, sum, max]}
+        self._recent = deque(maxlen=RECENT_TRANSFERS)
+        self._started = time.time()
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            values = self._counters.setdefault(name, {})
+            key = _key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_key(labels)] = value
+
+    def add(self, name, value, **labels):
+        with self._lock:
+            values = self._gauges.setdefault(name, {})
+            key = _key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            summary = self._summaries.setdefault(name, {}).setdefault(_key(labels), [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Misura la durata del blocco, anche se termina con un'eccezione."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def record_transfer(self, direction, name, size, duration, error=None):
+        """Registra l'esito del trasferimento di un file."""
+        if error is not None:
+            self.inc("transfer_failures_total", direction=direction, error=type(error).__name__)
+            with self._lock:
+                self._recent.append({"time": time.time(), "direction": direction, "name": name,
+                                     "error": f"{type(error).__name__}: {error}"})
+            return
+        mb_per_second = size / 1048576 / duration if duration > 0 else 0.0
+        self.inc("transfer_files_total", direction=direction)
+        self.inc("transfer_bytes_total", size, direction=direction)
+        self.observe("transfer_seconds", duration, direction=direction)
+        self.set("transfer_last_mb_per_second", round(mb_per_second, 3), direction=direction)
+        with self._lock:
+            self._recent.append({"time": time.time(), "direction": direction, "name": name, "bytes": size,
+                                 "seconds": round(duration, 3), "mb_per_second": round(mb_per_second, 3)})
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": self._started,
+                "updated": time.time(),
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                             for name, values in self._counters.items()},
+                "gauges": {name: [{"labels": dict(key), "value": value} for key, value in values.items()]
+                           for name, values in self._gauges.items()},
+                "summaries": {name: [{"labels": dict(key), "count": count, "sum": round(total, 6),
+                                      "max": round(maximum, 6)}
+                                     for key, (count, total, maximum) in values.items()]
+                              for name, values in self._summaries.items()},
+                "recent_transfers": list(self._recent),
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, values in sorted(metrics.items()):
+                    lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    for key, value in values.items():
+                        lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+            for name, values in sorted(self._summaries.items()):
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} summary")
+                for key, (count, total, _) in values.items():
+                    labels = _format_labels(key)
+                    lines.append(f"{PREFIX}{name}_count{labels} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{labels} {total:.6f}")
+                # Il massimo non fa parte del tipo summary: esposto come gauge separato
+                lines.append(f"# TYPE {PREFIX}{name}_max gauge")
+                for key, (_, _, maximum) in values.items():
+                    lines.append(f"{PREFIX}{name}_max{_format_labels(key)} {maximum:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def write_stats(self, path=STATS_FILE):
+        """Scrive le statistiche JSON in modo atomico (file temporaneo + rename)."""
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "w") as file:
+                json.dump(self.snapshot(), file, indent=2)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.info(f"Unable to write metrics file {path}: {e}")
+
+    def serve(self, port, host="127.0.0.1"):
+        """Avvia (una sola volta) l'endpoint HTTP in un thread in background."""
+        with self._lock:
+            if self._server is not None:
+                return self._server
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    path = self.path.split("?", 1)[0]
+                    if path == "/metrics":
+                        body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+                    elif path in ("/stats.json", "/stats"):
+                        body, content_type = json.dumps(metrics.snapshot()), "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                    data = body.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, int(port)), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            logging.info(f"Metrics available on http://{host}:{self._server.server_port}/metrics")
+            return self._server
+
+    def stop(self):
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Ritorna il registro delle metriche condiviso dal processo."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            atexit.register(_metrics.stop)
+        return _metrics
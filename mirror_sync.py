@@ -0,0 +1,372 @@
+import os
+import time
+import posixpath
+from datetime import datetime
+
+from snapshot_store import RemoteSnapshot, get_snapshot_store
+from transfer_ledger import get_ledger
+from sftp_client import PART_SUFFIX
+from metrics import get_metrics
+from delta_sync import BLOCK_SIZE, DELTA_MIN_SIZE, signature, match_blocks
+from tree_walker import LocalWalker, RemoteWalker, SubtreeReport, get_remote_dirs, local_path, remote_path
+
+CONFLICT_POLICIES = ("newer", "local", "remote", "keep_both")
+DELETE_POLICIES = ("propagate", "restore")
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+KEEP_BOTH = "keep_both"
+DELETE_LOCAL = "delete_local"
+DELETE_REMOTE = "delete_remote"
+FORGET = "forget"
+ADOPT = "adopt"
+MTIME_TOLERANCE = 2  # secondi: file nuovi su entrambi i lati, stessa dimensione e mtime, sono gia' allineati
+
+
+def conflict_name(name, now=None):
+    """Nome della copia in conflitto: "a/report.xlsx" -> "a/report.conflict-20250101-120000.xlsx"."""
+    stem, ext = posixpath.splitext(name)
+    return f"{stem}.conflict-{(now or datetime.now()):%Y%m%d-%H%M%S}{ext}"
+
+
+class MirrorSync:
+    """Sincronizzazione bidirezionale fra `local_dir` e `remote_dir` (direzione "mirror").
+
+    Lo stato dei due lati all'ultima sincronizzazione resta nello
+    SnapshotStore; a ogni ciclo entrambi i lati vengono confrontati con
+    quello stato e:
+
+    - un file nuovo o cambiato da un solo lato viene copiato sull'altro;
+    - un file cancellato da un lato e invariato dall'altro viene cancellato
+      anche li' ("mirror_deletes": "propagate", default) oppure ricopiato
+      ("restore"); una modifica vince sempre su una cancellazione;
+    - un file cambiato da entrambi i lati e' un conflitto, risolto secondo
+      "mirror_conflicts": "newer" (default, vince la modifica piu' recente),
+      "local", "remote" oppure "keep_both" (vince la copia remota, quella
+      locale viene rinominata con conflict_name e caricata a sua volta).
+
+    I file modificati piu' grandi di DELTA_MIN_SIZE vengono trasferiti in
+    delta (vedi delta_sync), salvo "delta_transfers": false.
+    """
+
+    def __init__(self, engine, sftp_client):
+        settings = engine.settings
+        self.engine = engine
+        self.sftp_client = sftp_client
+        self.conflicts = settings.get("mirror_conflicts") or "newer"
+        if self.conflicts not in CONFLICT_POLICIES:
+            raise ValueError(f"unknown mirror_conflicts {self.conflicts!r}, expected one of {', '.join(CONFLICT_POLICIES)}")
+        self.deletes = settings.get("mirror_deletes") or "propagate"
+        if self.deletes not in DELETE_POLICIES:
+            raise ValueError(f"unknown mirror_deletes {self.deletes!r}, expected one of {', '.join(DELETE_POLICIES)}")
+        self.use_delta = bool(settings.get("delta_transfers", True))
+        self.verify = bool(settings.get("verify_transfers", False))
+        self.store = get_snapshot_store()
+        self.profile = engine.profile
+        scope = f"{os.path.abspath(engine.local_dir)}|{engine.remote_dir}"
+        self.local_scope = "mirror-local:" + scope
+        self.remote_scope = "mirror-remote:" + scope
+        self.signature_scope = "mirror:" + scope
+        self.base_local = {}
+        self.base_remote = {}
+        self.local_updates = {}
+        self.remote_updates = {}
+        self.removed = set()
+        self.counts = dict.fromkeys((UPLOAD, DOWNLOAD, DELETE_LOCAL, DELETE_REMOTE, "conflicts"), 0)
+        self.saved_bytes = 0
+        self.report = SubtreeReport(settings.get("subtree_depth") or 1)
+        self._local_dirs = set()
+
+    def run(self):
+        """Esegue un ciclo e ritorna i nomi dei file copiati in una delle due direzioni."""
+        self.base_local = self.store.load(self.profile, self.local_scope)
+        self.base_remote = self.store.load(self.profile, self.remote_scope)
+        local, local_complete = self.list_local()
+        remote, remote_complete = self.list_remote()
+        actions = self.plan(local, remote, local_complete, remote_complete)
+        try:
+            transferred = self.apply(actions, local, remote)
+        finally:
+            self.store.write(self.profile, self.local_scope, self.local_updates, self.removed)
+            self.store.write(self.profile, self.remote_scope, self.remote_updates, self.removed)
+
+        summary = (f"Mirror: {self.counts[UPLOAD]} uploaded, {self.counts[DOWNLOAD]} downloaded, "
+                   f"{self.counts[DELETE_REMOTE]} deleted remotely, {self.counts[DELETE_LOCAL]} deleted locally, "
+                   f"{self.counts['conflicts']} conflict(s)")
+        if self.saved_bytes:
+            summary += f"; delta transfers saved {self.saved_bytes / (1024 * 1024):.1f} MB"
+        self.log(summary)
+        if self.engine.recursive:
+            self.report.log(self.log)
+        return transferred
+
+    def list_local(self):
+        """Ritorna ({nome: os.stat_result}, elenco completo)."""
+        if self.engine.recursive:
+            walker = LocalWalker(self.engine.local_dir, log_callback=self.log)
+            files = {name: st for name, _, st in walker.walk() if not name.endswith(PART_SUFFIX)}
+            return files, walker.complete
+        files = {}
+        with os.scandir(self.engine.local_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+                    files[entry.name] = entry.stat()
+        return files, True
+
+    def list_remote(self):
+        """Ritorna ({nome: SFTPAttributes}, elenco completo)."""
+        if self.engine.recursive:
+            walker = RemoteWalker(self.sftp_client, self.engine.remote_dir, log_callback=self.log)
+            files = {attr.filename: attr for attr in walker.walk() if not attr.filename.endswith(PART_SUFFIX)}
+            return files, walker.complete
+        files = {attr.filename: attr for attr in self.sftp_client.iter_files(self.engine.remote_dir)
+                 if not attr.filename.endswith(PART_SUFFIX)}
+        return files, True
+
+    def plan(self, local, remote, local_complete=True, remote_complete=True):
+        """Confronta i due lati con lo stato salvato e ritorna le azioni `(azione, nome)`."""
+        # Un lato vuoto che prima non lo era e' piu' probabilmente un disco non montato che una cancellazione di massa
+        local_reliable = local_complete and bool(local or not self.base_local)
+        remote_reliable = remote_complete and bool(remote or not self.base_remote)
+        if not local_reliable:
+            self.log(f"Listing of {self.engine.local_dir} is incomplete or unexpectedly empty, "
+                     f"files missing locally are left alone this cycle")
+        if not remote_reliable:
+            self.log(f"Listing of {self.engine.remote_dir} is incomplete or unexpectedly empty, "
+                     f"files missing remotely are left alone this cycle")
+
+        # Copie remote lasciate a meta' da un upload delta sul posto interrotto
+        interrupted = get_ledger().partial_destinations("delta")
+        actions = []
+        for name in sorted(set(local) | set(remote) | set(self.base_local) | set(self.base_remote)):
+            st = local.get(name)
+            attr = remote.get(name)
+            local_fp = (st.st_size, st.st_mtime_ns) if st is not None else None
+            remote_fp = RemoteSnapshot.fingerprint(attr)[:2] if attr is not None else None
+            local_changed = local_fp != (tuple(self.base_local[name][:2]) if name in self.base_local else None)
+            remote_changed = remote_fp != (tuple(self.base_remote[name][:2]) if name in self.base_remote else None)
+            if remote_path(self.engine.remote_dir, name) in interrupted:
+                # La modifica remota e' nostra e incompleta: non e' un conflitto, la copia locale va rimandata intera
+                remote_changed = False
+                if local_fp is not None:
+                    self.log(f"Delta upload of {name} was interrupted, sending the whole file again")
+                    actions.append((UPLOAD, name))
+                    continue
+            if not local_changed and not remote_changed:
+                continue
+
+            if local_fp is None and remote_fp is None:
+                action = FORGET
+            elif local_fp is None:
+                if not local_reliable:
+                    continue
+                propagate = local_changed and not remote_changed and self.deletes == "propagate"
+                action = DELETE_REMOTE if propagate else DOWNLOAD
+            elif remote_fp is None:
+                if not remote_reliable:
+                    continue
+                propagate = remote_changed and not local_changed and self.deletes == "propagate"
+                action = DELETE_LOCAL if propagate else UPLOAD
+            elif local_changed and remote_changed:
+                if (name not in self.base_local and name not in self.base_remote and st.st_size == attr.st_size
+                        and abs(st.st_mtime - (attr.st_mtime or 0)) <= MTIME_TOLERANCE):
+                    # Es. prima sincronizzazione di cartelle gia' copiate preservando le date
+                    action = ADOPT
+                else:
+                    action = self.resolve(name, st, attr)
+            else:
+                action = UPLOAD if local_changed else DOWNLOAD
+            actions.append((action, name))
+        return actions
+
+    def resolve(self, name, st, attr):
+        """Azione per un file cambiato da entrambi i lati, secondo "mirror_conflicts"."""
+        self.counts["conflicts"] += 1
+        get_metrics().inc("mirror_conflicts_total", profile=self.profile, policy=self.conflicts)
+        if self.conflicts == "keep_both":
+            self.log(f"Conflict on {name}: changed on both sides, keeping the remote version "
+                     f"and the local one as {conflict_name(name)}")
+            return KEEP_BOTH
+        if self.conflicts == "newer":
+            winner = "local" if st.st_mtime >= (attr.st_mtime or 0) else "remote"
+        else:
+            winner = self.conflicts
+        self.log(f"Conflict on {name}: changed on both sides, keeping the {winner} version")
+        return UPLOAD if winner == "local" else DOWNLOAD
+
+    def apply(self, actions, local, remote):
+        uploads = []
+        downloads = []
+        for action, name in actions:
+            try:
+                if action == FORGET:
+                    self._forget(name)
+                elif action == ADOPT:
+                    self._synced(name, None, local[name], remote_attr=remote[name])
+                elif action == DELETE_REMOTE:
+                    self.sftp_client.remove_file(remote_path(self.engine.remote_dir, name))
+                    self.log(f"Deleted remote file {name}, removed locally")
+                    self.counts[DELETE_REMOTE] += 1
+                    self._forget(name)
+                elif action == DELETE_LOCAL:
+                    os.remove(local_path(self.engine.local_dir, name))
+                    self.log(f"Deleted local file {name}, removed remotely")
+                    self.counts[DELETE_LOCAL] += 1
+                    self._forget(name)
+                elif action == KEEP_BOTH:
+                    copy = conflict_name(name)
+                    copy_path = local_path(self.engine.local_dir, copy)
+                    os.rename(local_path(self.engine.local_dir, name), copy_path)
+                    local[copy] = os.stat(copy_path)
+                    del local[name]
+                    uploads.append(copy)
+                    downloads.append(name)
+                elif action == UPLOAD:
+                    uploads.append(name)
+                else:
+                    downloads.append(name)
+            except Exception as e:
+                self.log(f"Failed to {action.replace('_', ' ')} {name}: {e}")
+        return self.upload(uploads, local, remote) + self.download(downloads, local, remote)
+
+    def upload(self, names, local, remote):
+        if not names:
+            return []
+        if self.engine.recursive:
+            get_remote_dirs(self.sftp_client.host, self.sftp_client.port, self.sftp_client.username).ensure(
+                self.sftp_client, self.engine.remote_dir, {posixpath.dirname(name) for name in names},
+                log_callback=self.log)
+        done = []
+        jobs = []
+        for name in names:
+            source = local_path(self.engine.local_dir, name)
+            destination = remote_path(self.engine.remote_dir, name)
+            if self._can_delta_upload(name, local[name], remote.get(name), destination):
+                try:
+                    self._delta_upload(name, source, destination, remote[name].st_size)
+                    self._synced(name, "to_remote", local[name])
+                    done.append(name)
+                    continue
+                except Exception as e:
+                    self.log(f"Delta upload of {name} failed ({e}), sending the whole file")
+            jobs.append((name, source, destination))
+
+        for result in self.engine.transfer_files(self.sftp_client, jobs, "to_remote"):
+            self.report.add(result.name, result.ok)
+            if not result.ok:
+                self.log(f"Failed to upload {result.name}: {result.error}")
+                continue
+            try:
+                # Il file intero sostituisce un eventuale upload delta interrotto
+                get_ledger().clear_partial("delta", result.destination)
+                self._synced(result.name, "to_remote", local[result.name], result.digest)
+                done.append(result.name)
+                self.log(f"Uploaded file: {result.source} to {result.destination}")
+            except Exception as e:
+                self.log(f"Failed to upload {result.name}: {e}")
+        self.counts[UPLOAD] += len(done)
+        return done
+
+    def download(self, names, local, remote):
+        if not names:
+            return []
+        done = []
+        jobs = []
+        for name in names:
+            source = remote_path(self.engine.remote_dir, name)
+            destination = local_path(self.engine.local_dir, name)
+            try:
+                self._make_local_parent(destination)
+                if (self.use_delta and name in local and local[name].st_size
+                        and (remote[name].st_size or 0) >= DELTA_MIN_SIZE):
+                    start = time.monotonic()
+                    fetched = self.sftp_client.download_delta(source, destination, BLOCK_SIZE, verify=self.verify)
+                    if fetched is not None:
+                        self._record_delta("to_local", name, remote[name].st_size or 0, fetched, start)
+                        self._synced(name, "to_local", None, remote_attr=remote[name])
+                        done.append(name)
+                        continue
+            except Exception as e:
+                self.log(f"Delta download of {name} failed ({e}), fetching the whole file")
+            jobs.append((name, source, destination))
+
+        for result in self.engine.transfer_files(self.sftp_client, jobs, "to_local"):
+            self.report.add(result.name, result.ok)
+            if not result.ok:
+                self.log(f"Failed to download {result.name}: {result.error}")
+                continue
+            try:
+                self._synced(result.name, "to_local", None, result.digest, remote_attr=remote[result.name])
+                done.append(result.name)
+                self.log(f"Downloaded file: {result.source} to {result.destination}")
+            except Exception as e:
+                self.log(f"Failed to download {result.name}: {e}")
+        self.counts[DOWNLOAD] += len(done)
+        return done
+
+    def _can_delta_upload(self, name, st, attr, destination):
+        # La firma salvata descrive la copia remota solo se questa non e' cambiata dall'ultima sincronizzazione
+        return (self.use_delta and attr is not None and st.st_size >= DELTA_MIN_SIZE
+                and name in self.base_remote
+                and tuple(self.base_remote[name][:2]) == RemoteSnapshot.fingerprint(attr)[:2]
+                and get_ledger().partial("delta", destination) is None
+                and self.store.signature(self.profile, self.signature_scope, name) is not None)
+
+    def _delta_upload(self, name, source, destination, remote_size):
+        block_size, data = self.store.signature(self.profile, self.signature_scope, name)
+        start = time.monotonic()
+        delta = match_blocks(source, data, remote_size, block_size)
+        sent = self.sftp_client.upload_delta(source, destination, delta, journal=get_ledger(), verify=self.verify)
+        self._record_delta("to_remote", name, delta.size, sent, start)
+
+    def _record_delta(self, direction, name, size, sent, start):
+        saved = max(0, size - sent)
+        self.saved_bytes += saved
+        self.report.add(name, True)
+        metrics = get_metrics()
+        metrics.record_transfer(direction, name, sent, time.monotonic() - start, None)
+        metrics.inc("delta_saved_bytes_total", saved, direction=direction)
+        self.log(f"{'Uploaded' if direction == 'to_remote' else 'Downloaded'} changes of {name}: "
+                 f"{sent} of {size} bytes transferred")
+
+    def _synced(self, name, direction, local_st, digest=None, remote_attr=None):
+        """Registra come sincronizzato lo stato attuale dei due lati di `name`.
+
+        Per un upload `local_st` e' lo stat letto prima del trasferimento, per
+        un download `remote_attr` e' la voce dell'elenco remoto: se il file
+        cambia durante il trasferimento il ciclo successivo se ne accorge.
+        """
+        path = local_path(self.engine.local_dir, name)
+        if local_st is None:
+            local_st = os.stat(path)
+        if remote_attr is None:
+            remote_attr = self.sftp_client.sftp.stat(remote_path(self.engine.remote_dir, name))
+        self.local_updates[name] = (local_st.st_size, local_st.st_mtime_ns, local_st.st_ino, None)
+        self.remote_updates[name] = RemoteSnapshot.fingerprint(remote_attr)
+        self.removed.discard(name)
+        if direction is not None:
+            get_ledger().record(self.profile, direction, name, digest)
+
+        if self.use_delta and local_st.st_size >= DELTA_MIN_SIZE:
+            data = signature(path)
+            st = os.stat(path)
+            # La firma vale solo se il file non e' cambiato dal trasferimento a qui
+            if (st.st_size, st.st_mtime_ns) == (local_st.st_size, local_st.st_mtime_ns):
+                self.store.save_signature(self.profile, self.signature_scope, name, BLOCK_SIZE, data)
+                return
+        self.store.forget_signature(self.profile, self.signature_scope, name)
+
+    def _forget(self, name):
+        self.local_updates.pop(name, None)
+        self.remote_updates.pop(name, None)
+        self.removed.add(name)
+        self.store.forget_signature(self.profile, self.signature_scope, name)
+
+    def _make_local_parent(self, path):
+        parent = os.path.dirname(path)
+        if parent not in self._local_dirs:
+            os.makedirs(parent, exist_ok=True)
+            self._local_dirs.add(parent)
+
+    def log(self, message):
+        self.engine.log(message)
@@ -0,0 +1,227 @@
+import time
+import atexit
+import logging
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+DEBOUNCE = 5  # secondi di attesa per raccogliere altre notifiche nello stesso digest
+MAX_DELAY = 60  # un digest parte comunque entro questo tempo dalla prima notifica
+MAX_ATTEMPTS = 5  # tentativi di invio prima di scartare un digest
+RETRY_BASE = 10  # secondi di attesa dopo il primo errore, poi raddoppia
+SESSION_IDLE = 120  # secondi dopo i quali una sessione SMTP inutilizzata viene chiusa
+SMTP_TIMEOUT = 30
+
+
+def build_message(email_settings, subject, body):
+    # Converti il corpo in stringa se è una lista
+    if isinstance(body, list):
+        body = "\n".join(body)
+    msg = MIMEMultipart()
+    msg['From'] = email_settings.get('username')
+    msg['To'] = email_settings.get('recipient')
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+
+class _Batch:
+    def __init__(self, email_settings, now):
+        self.email_settings = email_settings
+        self.messages = []  # (subject, body, log_callback)
+        self.first = now
+        self.deadline = now
+        self.attempts = 0
+
+
+class Notifier:
+    """Coda di notifiche email svuotata da un thread in background.
+
+    `notify` non blocca mai: le notifiche verso lo stesso server e
+    destinatario arrivate a pochi secondi l'una dall'altra vengono unite in
+    un unico digest, la sessione SMTP autenticata viene riusata fra un invio
+    e l'altro e gli errori vengono ritentati con attesa crescente.
+    """
+
+    def __init__(self, debounce=DEBOUNCE, max_delay=MAX_DELAY, max_attempts=MAX_ATTEMPTS):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._batches = {}
+        self._sending = 0
+        self._sessions = {}
+        self._thread = None
+
+    def notify(self, email_settings, subject, body, log_callback=None):
+        if not email_settings:
+            self._log(log_callback, "Email not configured.")
+            return
+        key = self._key(email_settings)
+        now = time.monotonic()
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _Batch(dict(email_settings), now)
+            batch.messages.append((subject, body, log_callback))
+            if batch.attempts == 0:
+                batch.deadline = min(now + self.debounce, batch.first + self.max_delay)
+            self._start()
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Invia subito i digest in attesa e aspetta che la coda sia vuota."""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            for batch in self._batches.values():
+                if batch.attempts == 0:
+                    batch.deadline = 0
+            self._cond.notify()
+            while self._batches or self._sending:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        self.flush(timeout=SMTP_TIMEOUT)
+        with self._cond:
+            for key in list(self._sessions):
+                self._close_session(key)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="email-notifier", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, batch = self._next_ready()
+                while batch is None:
+                    self._cond.wait(self._wait_time())
+                    self._close_idle_sessions()
+                    key, batch = self._next_ready()
+                del self._batches[key]
+                self._sending += 1
+            try:
+                self._deliver(key, batch)
+            finally:
+                with self._cond:
+                    self._sending -= 1
+                    self._cond.notify_all()
+
+    def _next_ready(self):
+        now = time.monotonic()
+        for key, batch in self._batches.items():
+            if batch.deadline <= now:
+                return key, batch
+        return None, None
+
+    def _wait_time(self):
+        if not self._batches:
+            return SESSION_IDLE
+        return max(0.1, min(batch.deadline for batch in self._batches.values()) - time.monotonic())
+
+    def _deliver(self, key, batch):
+        subject, body = self._compose(batch.messages)
+        msg = build_message(batch.email_settings, subject, body)
+        try:
+            session = self._session(key, batch.email_settings)
+            session.sendmail(msg['From'], msg['To'], msg.as_string())
+            for _, _, log_callback in batch.messages:
+                self._log(log_callback, "Email sent successfully.")
+        except Exception as e:
+            with self._cond:
+                self._close_session(key)
+                batch.attempts += 1
+                if batch.attempts >= self.max_attempts:
+                    for _, _, log_callback in batch.messages:
+                        self._log(log_callback, f"Failed to send email after {batch.attempts} attempts: {e}")
+                    return
+                delay = RETRY_BASE * 2 ** (batch.attempts - 1)
+                self._log(batch.messages[0][2], f"Failed to send email: {e}, retrying in {delay} s")
+                batch.deadline = time.monotonic() + delay
+                # Le notifiche arrivate nel frattempo viaggiano nello stesso digest
+                pending = self._batches.get(key)
+                if pending is not None:
+                    batch.messages.extend(pending.messages)
+                self._batches[key] = batch
+                self._cond.notify()
+
+    def _compose(self, messages):
+        if len(messages) == 1:
+            return messages[0][0], messages[0][1]
+        sections = []
+        for subject, body, _ in messages:
+            if isinstance(body, list):
+                body = "\n".join(body)
+            sections.append(f"=== {subject} ===\n{body}")
+        return f"Digest: {len(messages)} notifications", "\n\n".join(sections)
+
+    def _session(self, key, email_settings):
+        entry = self._sessions.get(key)
+        if entry is not None:
+            session = entry[0]
+            try:
+                if session.noop()[0] == 250:
+                    self._sessions[key] = (session, time.monotonic())
+                    return session
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close_session(key)
+
+        session = smtplib.SMTP(email_settings.get('server'), int(email_settings.get('port')), timeout=SMTP_TIMEOUT)
+        session.starttls()
+        session.login(email_settings.get('username'), email_settings.get('password'))
+        self._sessions[key] = (session, time.monotonic())
+        return session
+
+    def _close_idle_sessions(self):
+        now = time.monotonic()
+        for key, (_, last_used) in list(self._sessions.items()):
+            if now - last_used > SESSION_IDLE:
+                self._close_session(key)
+
+    def _close_session(self, key):
+        entry = self._sessions.pop(key, None)
+        if entry is None:
+            return
+        try:
+            entry[0].quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _key(email_settings):
+        return (
+            email_settings.get('server'),
+            str(email_settings.get('port')),
+            email_settings.get('username'),
+            email_settings.get('recipient'),
+        )
+
+    @staticmethod
+    def _log(log_callback, message):
+        if log_callback:
+            log_callback(message)
+        else:
+            logging.info(message)
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """Ritorna la coda di notifiche condivisa dal processo."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier()
+            atexit.register(_notifier.close)
+        return _notifier
@@ -0,0 +1,170 @@
+import os
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from metrics import get_metrics
+from connection_pool import get_pool
+
+
+class TransferResult:
+    """Esito del trasferimento di un singolo file."""
+
+    def __init__(self, name, source, destination):
+        self.name = name
+        self.source = source
+        self.destination = destination
+        self.ok = False
+        self.error = None
+        self.duration = 0.0
+        self.digest = None  # sha256 verificato, solo con verify
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"<TransferResult {self.name} {status}>"
+
+
+class ParallelTransfer:
+    """Trasferisce piu' file in parallelo su N canali SFTP.
+
+    I canali vengono aperti sul transport del client passato; con
+    `transports > 1` vengono prese dal pool connessioni aggiuntive (con il
+    loro circuit breaker) e i canali distribuiti in round-robin fra di esse. Con `workers <= 1` i file
+    vengono trasferiti in sequenza sul client originale. Con un
+    `resume_journal` i trasferimenti passano da un file `.part` e riprendono
+    dall'ultimo offset dopo un'interruzione. Con `verify` ogni file viene
+    hashato durante il trasferimento e confrontato con la copia remota.
+    Con un `byte_budget` (ByteBudget) un job `(name, source, destination,
+    size)` parte solo quando i byte in volo lo permettono.
+    """
+
+    def __init__(self, sftp_client, workers=1, transports=1, log_callback=None, resume_journal=None, verify=False,
+                 byte_budget=None):
+        self.sftp_client = sftp_client
+        self.resume_journal = resume_journal
+        self.verify = verify
+        self.byte_budget = byte_budget
+        self.workers = max(1, int(workers))
+        self.transports = max(1, min(int(transports), self.workers))
+        self.log_callback = log_callback
+
+    def run(self, jobs, direction):
+        """Esegue i job `(name, source, destination[, size])` e ritorna i risultati appena pronti.
+
+        `jobs` puo' essere un iteratore (es. un elenco remoto in streaming): i
+        job vengono avviati man mano che arrivano, senza attendere la fine
+        dell'elenco.
+        """
+        if self.workers == 1:
+            for job in jobs:
+                yield self._transfer(self.sftp_client, job, direction)
+            return
+
+        jobs = iter(jobs)
+        first = next(jobs, None)
+        if first is None:
+            return
+
+        metrics = get_metrics()
+        extra_clients, channels = self._open_channels(self.workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sftp-transfer") as executor:
+                pending = {self._submit(executor, channels, first, direction)}
+                for job in jobs:
+                    pending.add(self._submit(executor, channels, job, direction))
+                    # Non accumula piu' di qualche job per canale mentre l'elenco e' ancora in corso
+                    if len(pending) >= self.workers * 4:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    else:
+                        done = {future for future in pending if future.done()}
+                        pending -= done
+                    metrics.set("transfer_queue_depth", len(pending), direction=direction)
+                    for future in done:
+                        yield future.result()
+                for future in as_completed(pending):
+                    yield future.result()
+        finally:
+            metrics.set("transfer_queue_depth", 0, direction=direction)
+            while not channels.empty():
+                channels.get_nowait().close()
+            for client in extra_clients:
+                get_pool().release(client)
+
+    def _submit(self, executor, channels, job, direction):
+        size = job[3] if len(job) > 3 else 0
+        if self.byte_budget is None or not size:
+            return executor.submit(self._transfer_on_pool, channels, job, direction)
+        self.byte_budget.acquire(size)
+        future = executor.submit(self._transfer_on_pool, channels, job, direction)
+        future.add_done_callback(lambda _: self.byte_budget.release(size))
+        return future
+
+    def _open_channels(self, workers):
+        source = self.sftp_client
+        clients = [source]
+        extra_clients = []
+        for slot in range(1, self.transports):
+            try:
+                client = get_pool().acquire(source.host, source.port, source.username, source.password,
+                                            source.log_callback, source.tuning, slot=slot)
+            except Exception as e:
+                # Un host in pausa o irraggiungibile non viene ritentato per ogni connessione
+                self.log(f"Unable to open an extra connection to {source.host}:{source.port}, "
+                         f"using {len(clients)}: {e}")
+                break
+            client.throttle = source.throttle
+            client.transforms = source.transforms
+            clients.append(client)
+            extra_clients.append(client)
+
+        channels = queue.Queue()
+        try:
+            for index in range(workers):
+                channels.put(clients[index % len(clients)].open_channel())
+        except Exception:
+            while not channels.empty():
+                channels.get_nowait().close()
+            for client in extra_clients:
+                get_pool().release(client)
+            raise
+        self.log(f"Opened {workers} SFTP channels on {len(clients)} connection(s)")
+        return extra_clients, channels
+
+    def _transfer_on_pool(self, channels, job, direction):
+        channel = channels.get()
+        try:
+            return self._transfer(channel, job, direction)
+        finally:
+            channels.put(channel)
+
+    def _transfer(self, client, job, direction):
+        name, source, destination = job[:3]
+        result = TransferResult(name, source, destination)
+        start = time.monotonic()
+        try:
+            if direction == "to_remote":
+                result.digest = client.upload_file(source, destination, resume_journal=self.resume_journal,
+                                                   verify=self.verify)
+            else:
+                result.digest = client.download_file(source, destination, resume_journal=self.resume_journal,
+                                                     verify=self.verify)
+            result.ok = True
+        except Exception as e:
+            result.error = e
+        result.duration = time.monotonic() - start
+        self._record(result, direction)
+        return result
+
+    def _record(self, result, direction):
+        size = 0
+        if result.ok:
+            local_path = result.source if direction == "to_remote" else result.destination
+            try:
+                size = os.path.getsize(local_path)
+            except OSError:
+                pass
+        get_metrics().record_transfer(direction, result.name, size, result.duration, result.error)
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+
+CHECKS = ("stable", "writers", "marker")
+STABLE_CHECKS = 2  # default di "stable_checks"
+STABLE_SECONDS = 5  # default di "stable_seconds"
+MARKER_SUFFIX = ".ready"  # default di "ready_marker_suffix"
+FORGET_AFTER = 3600  # secondi dopo i quali un file non piu' osservato esce dalla memoria
+
+
+class ReadinessGate:
+    """Decide quali file nuovi o modificati sono completi e possono partire ("readiness_checks").
+
+    - "stable": dimensione e mtime invariati per `stable_checks` osservazioni
+      distanti almeno `stable_seconds` fra la prima e l'ultima. Le
+      osservazioni restano in memoria fra un ciclo e l'altro, quindi e' il
+      tick stesso a fare da attesa, senza sleep per file; un file con mtime
+      piu' vecchio di `stable_seconds` e' gia' fermo e passa subito.
+    - "writers": nessun processo lo tiene aperto in scrittura, secondo
+      /proc/<pid>/fd e fdinfo (solo Linux e solo i processi visibili
+      all'utente). /proc viene letto una volta per ciclo e solo se ci sono
+      file da controllare.
+    - "marker": esiste il file `<nome><marker_suffix>` (es.
+      "fattura.xml.ready") scritto dal produttore alla fine; i marker non
+      vengono trasferiti.
+
+    I file non pronti non vengono segnati come fatti, quindi il
+    LocalScanner li ripropone al ciclo successivo; quelli ancora in
+    scrittura vanno ricontrollati dopo `recheck_delay` secondi, quelli
+    senza marker ripartono quando il marker viene scritto.
+    """
+
+    def __init__(self, checks, stable_checks=STABLE_CHECKS, stable_seconds=STABLE_SECONDS,
+                 marker_suffix=MARKER_SUFFIX, log_callback=None):
+        self.observed = {}  # nome -> (dimensione, mtime_ns, osservazioni, prima osservazione, ultima osservazione)
+        self._proc_warned = False
+        self._lock = threading.Lock()
+        self.configure(checks, stable_checks, stable_seconds, marker_suffix, log_callback)
+
+    def configure(self, checks, stable_checks=STABLE_CHECKS, stable_seconds=STABLE_SECONDS,
+                  marker_suffix=MARKER_SUFFIX, log_callback=None):
+        """Aggiorna la configurazione mantenendo le osservazioni gia' fatte."""
+        unknown = set(checks) - set(CHECKS)
+        if unknown:
+            raise ValueError(f"unknown readiness check {sorted(unknown)[0]!r}, expected one of {', '.join(CHECKS)}")
+        self.checks = set(checks)
+        self.stable_checks = max(1, int(stable_checks))
+        self.stable_seconds = float(stable_seconds)
+        self.marker_suffix = marker_suffix
+        self.log_callback = log_callback
+
+    @property
+    def recheck_delay(self):
+        """Secondi dopo i quali un file ancora in scrittura puo' superare il controllo."""
+        return max(1.0, self.stable_seconds)
+
+    def is_marker(self, name):
+        return "marker" in self.checks and name.endswith(self.marker_suffix)
+
+    def marked_name(self, name):
+        """Nome del file a cui si riferisce il marker `name`."""
+        return name[:-len(self.marker_suffix)]
+
+    def remove_marker(self, path):
+        """Cancella il marker di `path`, es. dopo aver cancellato il file trasferito."""
+        if "marker" not in self.checks:
+            return
+        try:
+            os.remove(path + self.marker_suffix)
+        except FileNotFoundError:
+            pass
+
+    def ready(self, changed_files):
+        """Ritorna (ChangedFile pronti, nomi dei file rimandati perche' ancora in scrittura).
+
+        I file rimandati solo perche' manca il marker non sono fra i nomi.
+        """
+        now = time.time()
+        ready = []
+        writing = []
+        with self._lock:
+            for changed_file in changed_files:
+                if "stable" in self.checks and not self._stable(changed_file, now):
+                    writing.append(changed_file.name)
+                    continue
+                if "marker" in self.checks and not os.path.exists(changed_file.path + self.marker_suffix):
+                    continue
+                ready.append(changed_file)
+            self.observed = {name: entry for name, entry in self.observed.items() if now - entry[4] < FORGET_AFTER}
+        if "writers" in self.checks and ready:
+            busy = self._open_for_writing(ready)
+            ready = [changed_file for changed_file in ready if changed_file.name not in busy]
+            writing.extend(sorted(busy))
+        return ready, writing
+
+    def _stable(self, changed_file, now):
+        size, mtime_ns = changed_file.fingerprint[:2]
+        if now - mtime_ns / 1e9 >= self.stable_seconds:
+            self.observed.pop(changed_file.name, None)
+            return True
+        previous = self.observed.get(changed_file.name)
+        if previous is None or previous[:2] != (size, mtime_ns):
+            self.observed[changed_file.name] = (size, mtime_ns, 1, now, now)
+            return self.stable_checks == 1 and self.stable_seconds <= 0
+        count = previous[2] + 1
+        self.observed[changed_file.name] = (size, mtime_ns, count, previous[3], now)
+        if count >= self.stable_checks and now - previous[3] >= self.stable_seconds:
+            del self.observed[changed_file.name]
+            return True
+        return False
+
+    def _open_for_writing(self, changed_files):
+        """Nomi dei file di `changed_files` aperti in scrittura da qualche processo visibile."""
+        if not os.path.isdir("/proc/self/fd"):
+            if not self._proc_warned:
+                self._proc_warned = True
+                self.log("Open-writer check needs /proc (Linux), files are not checked for writers")
+            return set()
+        wanted = {}
+        for changed_file in changed_files:
+            try:
+                st = os.stat(changed_file.path)
+            except OSError:
+                continue
+            wanted[(st.st_dev, st.st_ino)] = changed_file.name
+        busy = set()
+        for pid in os.listdir("/proc"):
+            if not pid.isdigit():
+                continue
+            fd_dir = f"/proc/{pid}/fd"
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                continue
+            for fd in fds:
+                try:
+                    st = os.stat(f"{fd_dir}/{fd}")
+                except OSError:
+                    continue
+                name = wanted.get((st.st_dev, st.st_ino))
+                if name is not None and name not in busy and self._writable(pid, fd):
+                    busy.add(name)
+        return busy
+
+    @staticmethod
+    def _writable(pid, fd):
+        try:
+            with open(f"/proc/{pid}/fdinfo/{fd}") as info:
+                for line in info:
+                    if line.startswith("flags:"):
+                        return bool(int(line.split()[1], 8) & (os.O_WRONLY | os.O_RDWR))
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def gate_for(settings, profile, log_callback=None):
+    """Controllo del profilo configurato da "readiness_checks"; None se non ce ne sono.
+
+    Il controllo e' condiviso dal processo per profilo, cosi' le
+    osservazioni di "stable" sopravvivono fra un ciclo e l'altro.
+    """
+    checks = settings.get("readiness_checks") or []
+    if isinstance(checks, str):
+        checks = [check.strip() for check in checks.split(",") if check.strip()]
+    if not checks:
+        return None
+    options = (
+        checks,
+        settings.get("stable_checks") or STABLE_CHECKS,
+        STABLE_SECONDS if settings.get("stable_seconds") is None else settings["stable_seconds"],
+        settings.get("ready_marker_suffix") or MARKER_SUFFIX,
+        log_callback,
+    )
+    with _gates_lock:
+        gate = _gates.get(profile)
+        if gate is None:
+            gate = _gates[profile] = ReadinessGate(*options)
+        else:
+            gate.configure(*options)
+        return gate
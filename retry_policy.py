@@ -0,0 +1,175 @@
+import time
+import errno
+import random
+import socket
+import threading
+
+import paramiko
+
+from metrics import get_metrics
+
+# Tipi di errore
+AUTH = "auth"  # credenziali rifiutate: ritentare subito rischia il blocco dell'account
+NETWORK = "network"  # host irraggiungibile, connessione caduta, timeout
+PERMANENT = "permanent"  # file sparito, permessi: ritentare non serve
+TRANSIENT = "transient"  # tutto il resto (es. checksum diverso): vale la pena ritentare
+
+_PERMANENT_ERRNOS = {errno.ENOENT, errno.EACCES, errno.EPERM, errno.EISDIR, errno.ENOTDIR, errno.ENOSPC, errno.EROFS}
+
+
+def classify(error):
+    """Ritorna il tipo di errore (AUTH, NETWORK, PERMANENT, TRANSIENT)."""
+    if isinstance(error, paramiko.AuthenticationException):
+        return AUTH
+    if isinstance(error, (socket.timeout, ConnectionError, EOFError, paramiko.SSHException, socket.gaierror)):
+        return NETWORK
+    if isinstance(error, OSError) and error.errno in _PERMANENT_ERRNOS:
+        return PERMANENT
+    if isinstance(error, OSError) and error.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ETIMEDOUT):
+        return NETWORK
+    if isinstance(error, OSError) and error.errno is None and str(error) == "Socket is closed":
+        return NETWORK  # paramiko, canale chiuso sotto un trasferimento in corso
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """Backoff esponenziale con jitter ("full jitter") per gli errori ritentabili."""
+
+    def __init__(self, max_attempts=3, base_delay=2.0, max_delay=60.0, retry_on=(NETWORK, TRANSIENT)):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+
+    def should_retry(self, error, attempt):
+        """`attempt` e' il numero del tentativo appena fallito, da 1."""
+        return attempt < self.max_attempts and classify(error) in self.retry_on
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, function, log_callback=None, description="operation"):
+        """Esegue `function()` ritentando gli errori ritentabili; rilancia l'ultimo errore."""
+        attempt = 1
+        while True:
+            try:
+                return function()
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                delay = self.delay(attempt)
+                if log_callback:
+                    log_callback(f"{description} failed ({classify(e)}: {e}), "
+                                 f"retrying in {delay:.1f} s ({attempt + 1}/{self.max_attempts})")
+                time.sleep(delay)
+                attempt += 1
+
+
+class HostUnavailable(Exception):
+    """Il circuit breaker dell'host e' aperto: nessun tentativo fino alla scadenza della pausa."""
+
+
+class CircuitBreaker:
+    """Sospende i tentativi verso un host dopo errori ripetuti e li riprende da solo.
+
+    Dopo `failure_threshold` connessioni fallite di fila il circuito si apre
+    per `reset_timeout` secondi. Alla scadenza passa un solo tentativo di
+    prova: se riesce il circuito si chiude, altrimenti la pausa raddoppia
+    fino a `max_timeout`.
+
+    Un errore di autenticazione riguarda le credenziali, non l'host: sospende
+    subito, per `auth_timeout` secondi (poi il doppio a ogni nuovo rifiuto),
+    solo l'utente che lo ha ricevuto, mentre gli altri utenti dello stesso
+    server continuano a connettersi.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60, max_timeout=900, auth_timeout=600):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.auth_timeout = auth_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self.last_error = None
+        self._timeout = reset_timeout
+        self._auth = {}  # utente -> (sospeso fino a, pausa, errore)
+        self._lock = threading.Lock()
+
+    def check(self, username=None):
+        """Solleva HostUnavailable se il circuito, o l'utente, e' sospeso; altrimenti autorizza un tentativo."""
+        with self._lock:
+            now = time.monotonic()
+            if username in self._auth and now < self._auth[username][0]:
+                until, _, error = self._auth[username]
+                raise HostUnavailable(f"{username}@{self.name} paused for {until - now:.0f} s "
+                                      f"after its credentials were rejected ({error})")
+            if self.state == self.OPEN:
+                if now < self.opened_until:
+                    raise HostUnavailable(f"{self.name} paused for {self.opened_until - now:.0f} s "
+                                          f"after repeated failures ({self.last_error})")
+                self.state = self.HALF_OPEN
+                return
+            if self.state == self.HALF_OPEN:
+                # Un tentativo di prova e' gia' in corso
+                raise HostUnavailable(f"{self.name} is being probed after repeated failures ({self.last_error})")
+
+    def record_success(self, username=None):
+        with self._lock:
+            self._close()
+            rejected = self._auth.pop(username, None) is not None
+        get_metrics().set("sftp_circuit_open", 0, host=self.name)
+        if rejected:
+            get_metrics().set("sftp_circuit_open", 0, host=f"{username}@{self.name}")
+
+    def record_failure(self, error, username=None):
+        """Registra una connessione fallita; ritorna i secondi di pausa se la fallita apre il circuito, altrimenti 0."""
+        kind = classify(error)
+        if kind == AUTH:
+            return self._record_auth_failure(error, username)
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{kind}: {error}"
+            if self.state == self.HALF_OPEN:
+                self._timeout = min(self.max_timeout, self._timeout * 2)
+            elif self.failures < self.failure_threshold:
+                return 0
+            timeout = self._timeout
+            self.state = self.OPEN
+            self.opened_until = time.monotonic() + timeout
+        get_metrics().set("sftp_circuit_open", 1, host=self.name)
+        return timeout
+
+    def _record_auth_failure(self, error, username):
+        with self._lock:
+            # Il server ha risposto: l'host e' raggiungibile, anche se era in prova
+            self._close()
+            previous = self._auth.get(username)
+            timeout = self.auth_timeout if previous is None else min(max(self.max_timeout, self.auth_timeout),
+                                                                      previous[1] * 2)
+            self._auth[username] = (time.monotonic() + timeout, timeout, f"{AUTH}: {error}")
+        get_metrics().set("sftp_circuit_open", 0, host=self.name)
+        get_metrics().set("sftp_circuit_open", 1, host=f"{username}@{self.name}")
+        return timeout
+
+    def _close(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._timeout = self.reset_timeout
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host, port):
+    """Ritorna il circuit breaker condiviso dal processo per host e porta (con le sospensioni per utente)."""
+    key = f"{host}:{port}"
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key)
+        return breaker
@@ -0,0 +1,231 @@
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from sync_engine import SyncEngine
+from notifications import get_notifier
+from metrics import get_metrics
+import folder_watcher
+import log_store
+
+DEFAULT_INTERVAL = 30  # secondi, come il timer di default della GUI
+MAX_WORKERS = 4  # profili sincronizzati contemporaneamente
+MAX_PER_HOST = 2  # cicli contemporanei verso lo stesso server SFTP
+
+
+class ProfileState:
+    """Stato di esecuzione di un profilo all'interno dello Scheduler."""
+
+    def __init__(self, name, settings, default_interval=DEFAULT_INTERVAL):
+        self.name = name
+        self.settings = settings
+        self.interval = int(settings.get("sync_interval") or default_interval)
+        self.jitter = float(settings.get("schedule_jitter") or 0)
+        self.next_run = 0.0  # prossima scansione completa programmata
+        self.running = False
+        self.full_scan = False  # scansione completa richiesta dal watcher (overflow)
+        self.pending_names = set()  # file segnalati dal watcher in attesa di upload
+        self.deferred_names = set()  # file ancora in scrittura, da ricontrollare a recheck_at
+        self.recheck_at = None
+        self.last_deferred = ([], 0.0)  # (nomi, secondi) rimandati dall'ultimo ciclo
+        self.watcher = None
+        self.runs = 0
+        self.last_duration = None
+        self.last_error = None
+        self.last_transferred = 0
+
+    @property
+    def host(self):
+        """Server remoto usato dal profilo, None per i trasferimenti locale su locale."""
+        if self.settings.get("direction") == "local_to_local":
+            return None
+        return (self.settings.get("sftp_host", ""), int(self.settings.get("sftp_port") or 22))
+
+    def schedule_next(self, now):
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+    def recheck_due(self, now):
+        return self.recheck_at is not None and self.recheck_at <= now
+
+    def is_due(self, now):
+        return self.next_run <= now or self.full_scan or bool(self.pending_names) or self.recheck_due(now)
+
+
+class Scheduler:
+    """Esegue molti profili in un solo processo su un pool di worker condiviso.
+
+    Ogni profilo ha un proprio intervallo (`sync_interval`) e un ritardo
+    casuale (`schedule_jitter`, in secondi) che distribuisce le partenze. Un
+    profilo non viene mai eseguito due volte in parallelo: un ciclo lento
+    fa slittare il successivo. Al massimo `max_per_host` cicli alla volta
+    usano lo stesso server.
+    """
+
+    def __init__(self, profiles, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+                 default_interval=DEFAULT_INTERVAL, log_callback=None, stats_file=None):
+        self.states = {name: ProfileState(name, settings, default_interval) for name, settings in profiles.items()}
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(1, int(max_per_host))
+        self.log_callback = log_callback
+        self.stats_file = stats_file  # statistiche JSON riscritte a fine ciclo
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._active = 0
+        self._per_host = {}
+        self._next_report = None
+
+    def run_forever(self, once=False):
+        """Esegue i profili finche' non viene chiamato stop(); con `once` esegue ogni profilo una volta."""
+        now = time.monotonic()
+        for state in self.states.values():
+            state.next_run = now + random.uniform(0, state.jitter)
+            if not once:
+                self._start_watcher(state)
+        if not once:
+            self._next_report = log_store.next_report_time()
+        self.log(f"Scheduler started with {len(self.states)} profile(s), {self.max_workers} worker(s)")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sync-profile") as executor:
+            try:
+                while not self._stop.is_set():
+                    self._dispatch(executor, once)
+                    self._maybe_send_reports()
+                    if once and self._active == 0 and all(state.runs for state in self.states.values()):
+                        break
+                    self._handle_event(self._next_timeout())
+            finally:
+                self._stop.set()
+                for state in self.states.values():
+                    if state.watcher is not None:
+                        state.watcher.stop()
+                        state.watcher = None
+        self.log("Scheduler stopped")
+
+    def stop(self, *args):
+        self._stop.set()
+        self._events.put(None)
+
+    def _dispatch(self, executor, once):
+        now = time.monotonic()
+        for state in sorted(self.states.values(), key=lambda state: state.next_run):
+            if self._active >= self.max_workers:
+                return
+            if state.running or not state.is_due(now) or (once and state.runs):
+                continue
+            host = state.host
+            if host is not None and self._per_host.get(host, 0) >= self.max_per_host:
+                continue
+
+            # Una scansione completa copre anche i file segnalati dal watcher
+            full = state.next_run <= now or state.full_scan
+            recheck = full or state.recheck_due(now)
+            names = None if full else sorted(state.pending_names | (state.deferred_names if recheck else set()))
+            if recheck:
+                state.deferred_names.clear()
+                state.recheck_at = None
+            state.full_scan = False
+            state.pending_names.clear()
+            state.running = True
+            self._active += 1
+            if host is not None:
+                self._per_host[host] = self._per_host.get(host, 0) + 1
+            executor.submit(self._run_profile, state, names)
+
+    def _maybe_send_reports(self):
+        """Alle 7:30 e alle 15:00 invia a ogni profilo con email il log delle sue ultime 24 ore."""
+        if self._next_report is None or datetime.now() < self._next_report:
+            return
+        self._next_report = log_store.next_report_time()
+        records = list(log_store.LogStore().last_hours(24))
+        for state in self.states.values():
+            email_settings = state.settings.get("email_settings")
+            if not email_settings:
+                continue
+            prefix = f"[{state.name}] "
+            lines = [log_store.format_record(record) for record in records if record["message"].startswith(prefix)]
+            body = "Here are the logs for the last 24 hours:\n\n" + "\n".join(lines)
+            get_notifier().notify(email_settings, f"Daily Log Report - {state.name}", body, self.log)
+
+    def _run_profile(self, state, names):
+        """Esegue un ciclo del profilo; `names` None indica una scansione completa."""
+        start = time.monotonic()
+        try:
+            engine = SyncEngine(state.settings, log_callback=lambda message: self.log(f"[{state.name}] {message}"))
+            state.last_transferred = len(engine.run(names))
+            state.last_deferred = (engine.deferred, engine.recheck_after)
+            state.last_error = None
+        except Exception as e:
+            state.last_error = e
+            self.log(f"[{state.name}] Error during synchronization: {e}")
+        finally:
+            state.last_duration = time.monotonic() - start
+            self._events.put(("done", state.name, names))
+
+    def _handle_event(self, timeout):
+        try:
+            event = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return
+        if event is None:
+            return
+        kind, name, names = event
+        state = self.states[name]
+        now = time.monotonic()
+        if kind == "done":
+            state.running = False
+            state.runs += 1
+            self._active -= 1
+            host = state.host
+            if host is not None:
+                self._per_host[host] -= 1
+            if names is None:
+                state.schedule_next(now)
+            deferred, delay = state.last_deferred
+            state.last_deferred = ([], 0.0)
+            if deferred:
+                # I file ancora in scrittura vengono ricontrollati da soli, senza aspettare la scansione completa
+                state.deferred_names.update(deferred)
+                if state.recheck_at is None:
+                    state.recheck_at = now + delay
+            if self.stats_file:
+                get_metrics().write_stats(self.stats_file)
+        elif kind == "watch":
+            # Gli eventi arrivati durante un ciclo vengono eseguiti subito dopo
+            if names is None:
+                state.full_scan = True
+            else:
+                state.pending_names.update(names)
+
+    def _next_timeout(self):
+        waiting = [state.next_run for state in self.states.values() if not state.running]
+        waiting += [state.recheck_at for state in self.states.values()
+                    if not state.running and state.recheck_at is not None]
+        if not waiting:
+            return 1.0
+        # I profili pronti ma in attesa di uno slot ripartono con l'evento "done" che lo libera
+        return max(0.05, min(1.0, min(waiting) - time.monotonic()))
+
+    def _start_watcher(self, state):
+        local_dir = state.settings.get("local_dir", "")
+        if not state.settings.get("watch_folder") or not os.path.isdir(local_dir):
+            return
+        if not folder_watcher.is_supported():
+            self.log(f"[{state.name}] Folder watching is not supported on this platform, using the timer only")
+            return
+        state.watcher = folder_watcher.FolderWatcher(
+            local_dir,
+            lambda names: self._events.put(("watch", state.name, names)),
+            log_callback=lambda message: self.log(f"[{state.name}] {message}"),
+        )
+        state.watcher.start()
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
@@ -1,9 +1,57 @@
 import os
+import time
+import hashlib
+import shutil
+import binascii
 import paramiko
 import stat
+from paramiko.sftp import CMD_EXTENDED, int64
+
+from metrics import get_metrics
+
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 1024 * 1024
+CHECKPOINT_EVERY = 16 * CHUNK_SIZE  # ogni quanti byte viene registrato l'offset confermato
+VERIFY_HASH = "sha256"  # algoritmo dei trasferimenti verificati, locale e via estensione check-file
+BLOCK_HASHES_PER_REQUEST = 1024  # blocchi per richiesta check-file, per non superare la dimensione massima dei pacchetti
+CHECK_FILE_ALGORITHMS = {16: "md5", 20: "sha1", 28: "sha224", 32: "sha256", 48: "sha384", 64: "sha512"}
+
+# Parametri di rete per profilo ("sftp_tuning" nella configurazione).
+# None lascia il default di paramiko.
+TUNING_DEFAULTS = {
+    "window_size": None,  # finestra SSH per canale, in byte
+    "max_packet_size": None,  # dimensione massima di un pacchetto SSH
+    "chunk_size": CHUNK_SIZE,  # byte letti/scritti per chiamata durante la copia
+    "pipelined": True,  # scritture senza attendere l'ack di ogni blocco
+    "prefetch": True,  # letture anticipate durante i download
+    "prefetch_requests": None,  # massimo di richieste di prefetch in volo
+    "ciphers": None,  # es. ["aes128-gcm@openssh.com", "aes128-ctr"]
+    "compression": False,  # compressione zlib del trasporto SSH
+}
+
+
+def _is_unsupported(error):
+    """True se il server ha risposto che l'estensione o l'algoritmo richiesto non e' supportato.
+
+    paramiko trasforma gli stati SFTP in IOError senza errno con il testo del
+    server: "Operation unsupported" per OP_UNSUPPORTED, oppure messaggi come
+    "No supported hash types found" per gli algoritmi di check-file.
+    """
+    text = str(error).lower()
+    return error.errno is None and ("unsupported" in text or "not supported" in text or "no supported" in text)
+
+
+def normalize_tuning(tuning):
+    """Completa un dizionario di tuning con i default e normalizza i cifrari."""
+    merged = dict(TUNING_DEFAULTS)
+    merged.update({key: value for key, value in (tuning or {}).items() if key in TUNING_DEFAULTS})
+    if isinstance(merged["ciphers"], str):
+        merged["ciphers"] = [cipher.strip() for cipher in merged["ciphers"].split(",") if cipher.strip()]
+    return merged
+
 
 class SftpClient:
-    def __init__(self, host, port, username, password, log_callback=None):
+    def __init__(self, host, port, username, password, log_callback=None, tuning=None):
         self.host = host
         self.port = port
         self.username = username
@@ -11,21 +59,46 @@ class SftpClient:
         self.transport = None
         self.sftp = None
         self.log_callback = log_callback
+        self.tuning = normalize_tuning(tuning)
+        self.owns_transport = True
+        self.check_file_supported = None  # estensione check-file del server, None finche' non provata
+        self.block_hashes_supported = None  # check-file con hash per blocco (md5/sha1 bastano), per i download delta
+        self.copy_data_supported = None  # estensione copy-data (OpenSSH 9.0+), per gli upload delta
+        self.throttle = None  # BandwidthLimiter condiviso dai canali del profilo, None = senza limiti
+        self.transforms = None  # TransformPipeline applicata ai file in transito, None = file copiati cosi' come sono
 
     def connect(self):
+        metrics = get_metrics()
         try:
             self.log("Attempting to establish SFTP connection...")
-            self.transport = paramiko.Transport((self.host, self.port))
-            self.transport.connect(username=self.username, password=self.password)
-            self.sftp = paramiko.SFTPClient.from_transport(self.transport)
+            start = time.monotonic()
+            transport_options = {}
+            if self.tuning["window_size"]:
+                transport_options["default_window_size"] = int(self.tuning["window_size"])
+            if self.tuning["max_packet_size"]:
+                transport_options["default_max_packet_size"] = int(self.tuning["max_packet_size"])
+            self.transport = paramiko.Transport((self.host, self.port), **transport_options)
+            if self.tuning["ciphers"]:
+                self.transport.get_security_options().ciphers = tuple(self.tuning["ciphers"])
+            self.transport.use_compression(bool(self.tuning["compression"]))
+            # Equivale a transport.connect(), diviso per misurare handshake e autenticazione
+            self.transport.start_client()
+            handshake_done = time.monotonic()
+            metrics.observe("sftp_connect_seconds", handshake_done - start, host=self.host)
+            self.transport.auth_password(self.username, self.password)
+            metrics.observe("sftp_auth_seconds", time.monotonic() - handshake_done, host=self.host)
+            self.sftp = self._open_sftp()
             self.log("SFTP connection established")
-        except paramiko.AuthenticationException:
+        except paramiko.AuthenticationException as e:
+            metrics.inc("sftp_connect_failures_total", host=self.host, error=type(e).__name__)
             self.log("Authentication failed, please verify your credentials")
             raise
         except paramiko.SSHException as sshException:
+            metrics.inc("sftp_connect_failures_total", host=self.host, error=type(sshException).__name__)
             self.log(f"Unable to establish SSH connection: {sshException}")
             raise
         except Exception as e:
+            metrics.inc("sftp_connect_failures_total", host=self.host, error=type(e).__name__)
             self.log(f"Exception in connecting to the server: {e}")
             raise
 
@@ -81,36 +154,544 @@ class SftpClient:
 
     def list_files(self, remote_directory):
         """List only files in the specified remote directory."""
-        files = []
+        return list(self.iter_files(remote_directory))
+
+    def iter_files(self, remote_directory, read_aheads=50):
+        """Yield the files of a remote directory as the server returns them.
+
+        `listdir_iter` keeps `read_aheads` READDIR requests in flight, so the
+        caller can start working on the first entries while the rest of a
+        large directory is still being listed.
+        """
+        count = 0
+        elapsed = 0.0  # solo il tempo passato ad attendere il server, non quello del chiamante
         try:
-            for entry in self.sftp.listdir_attr(remote_directory):
-                self.log(f"Entry: {entry.filename}, Mode: {entry.st_mode}")
+            entries = self.sftp.listdir_iter(remote_directory, read_aheads=read_aheads)
+            while True:
+                start = time.monotonic()
+                entry = next(entries, None)
+                elapsed += time.monotonic() - start
+                if entry is None:
+                    break
                 if not stat.S_ISDIR(entry.st_mode):  # Include only files
-                    files.append(entry)
+                    count += 1
+                    yield entry
         except Exception as e:
             self.log(f"Error listing files in {remote_directory}: {e}")
             raise
-        return files
+        metrics = get_metrics()
+        metrics.observe("sftp_listing_seconds", elapsed, host=self.host)
+        metrics.set("sftp_listing_entries", count, host=self.host)
+        self.log(f"Listed {count} files in {remote_directory}")
 
-    def download_file(self, remote_path, local_path):
+    def download_file(self, remote_path, local_path, resume_journal=None, verify=False):
+        """Scarica un file; con `verify` ritorna lo sha256 calcolato durante il trasferimento."""
         self.log(f"Downloading {remote_path} to {local_path}")
+        digest = hashlib.new(VERIFY_HASH) if verify else None
         try:
-            self.sftp.get(remote_path, local_path)
+            if self.transforms is not None and self.transforms.original_name(remote_path) is not None:
+                self._get_transformed(remote_path, local_path, digest)
+            elif resume_journal is not None:
+                self._download_resumable(remote_path, local_path, resume_journal, digest)
+            else:
+                self._get(remote_path, local_path, digest)
             self.log(f"Downloaded file: {remote_path} to {local_path}")
         except Exception as e:
             self.log(f"Failed to download file {remote_path}: {e}")
             raise e
+        return digest.hexdigest() if digest is not None else None
 
 
 
-    def upload_file(self, local_file, remote_file):
+    def upload_file(self, local_file, remote_file, resume_journal=None, verify=False):
+        """Carica un file; con `verify` ritorna lo sha256 confrontato con la copia remota."""
+        digest = hashlib.new(VERIFY_HASH) if verify else None
         try:
             self.log(f"Uploading {local_file} to {remote_file}")
-            self.sftp.put(local_file, remote_file)
+            if self.transforms is not None:
+                self._put_transformed(local_file, remote_file, digest)
+            elif resume_journal is not None:
+                self._upload_resumable(local_file, remote_file, resume_journal, digest)
+            else:
+                self._put(local_file, remote_file, digest)
             self.log(f"Uploaded file: {local_file} to {remote_file}")
         except Exception as e:
             self.log(f"Failed to upload file {local_file}: {e}")
             raise
+        return digest.hexdigest() if digest is not None else None
+
+    def _put(self, local_file, remote_file, digest=None):
+        """Come sftp.put, ma con blocchi e pipelining presi dal tuning del profilo."""
+        size = os.path.getsize(local_file)
+        with open(local_file, "rb") as src, self.sftp.open(remote_file, "wb") as dst:
+            dst.set_pipelined(bool(self.tuning["pipelined"]))
+            self._copy_chunks(src, dst, 0, digest=digest)
+        remote_size = self.sftp.stat(remote_file).st_size
+        if remote_size != size:
+            raise IOError(f"size mismatch in put! {remote_size} != {size}")
+        if digest is not None:
+            self._verify_remote(remote_file, digest, reread=True)
+
+    def _get(self, remote_path, local_path, digest=None):
+        """Come sftp.get, ma con blocchi e prefetch presi dal tuning del profilo."""
+        with self.sftp.open(remote_path, "rb") as src:
+            size = src.stat().st_size
+            self._prefetch(src, size)
+            with open(local_path, "wb") as dst:
+                written = self._copy_chunks(src, dst, 0, digest=digest)
+        if written != size:
+            raise IOError(f"size mismatch in get! {written} != {size}")
+        if digest is not None:
+            self._verify_remote(remote_path, digest, reread=False)
+
+    def _put_transformed(self, local_file, remote_file, digest=None):
+        """Carica `local_file` passando i dati per le trasformazioni del profilo, senza file intermedi.
+
+        I dati trasformati non si ricostruiscono da un offset, quindi questi
+        upload ripartono sempre da zero. Con `digest` il file remoto viene
+        riletto e ritrasformato all'indietro per confrontarne lo sha256.
+        """
+        with open(local_file, "rb") as src:
+            read = self._chunk_reader(src, digest, throttled=False)
+            self.upload_stream(remote_file, lambda dst: self.transforms.encode(read, dst.write))
+        if digest is not None:
+            check = hashlib.new(VERIFY_HASH)
+            with self.sftp.open(remote_file, "rb") as remote:
+                self._prefetch(remote, remote.stat().st_size)
+                self.transforms.decode(self._chunk_reader(remote), check.update)
+            if check.hexdigest() != digest.hexdigest():
+                raise IOError(f"checksum mismatch for {remote_file}: remote {check.hexdigest()} != local {digest.hexdigest()}")
+
+    def _get_transformed(self, remote_path, local_path, digest=None):
+        """Scarica `remote_path` applicando le trasformazioni inverse; il file locale passa da `.part`.
+
+        Con `digest` vengono hashati sia i dati ricevuti, confrontati con la
+        copia remota come nei download normali, sia quelli ritrasformati, che
+        sono lo sha256 del file locale ritornato al chiamante.
+        """
+        temp_file = local_path + PART_SUFFIX
+        received = hashlib.new(VERIFY_HASH) if digest is not None else None
+        try:
+            with self.sftp.open(remote_path, "rb") as src, open(temp_file, "wb") as dst:
+                size = src.stat().st_size
+                self._prefetch(src, size)
+
+                def write(data):
+                    if digest is not None:
+                        digest.update(data)
+                    dst.write(data)
+
+                self.transforms.decode(self._chunk_reader(src, received), write)
+                read = src.tell()
+            if read != size:
+                raise IOError(f"size mismatch in get! {read} != {size}")
+            if received is not None:
+                self._verify_remote(remote_path, received, reread=False)
+            os.replace(temp_file, local_path)
+        except BaseException:
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            raise
+
+    def _chunk_reader(self, file_obj, digest=None, throttled=True):
+        """Funzione che legge il blocco successivo di `file_obj`, b"" alla fine."""
+        chunk_size = int(self.tuning["chunk_size"] or CHUNK_SIZE)
+
+        def read():
+            data = file_obj.read(chunk_size)
+            if digest is not None:
+                digest.update(data)
+            if throttled and self.throttle is not None:
+                self.throttle.consume(len(data))
+            return data
+        return read
+
+    def _verify_remote(self, remote_path, digest, reread):
+        """Confronta lo sha256 calcolato in streaming con quello della copia remota.
+
+        Il server calcola l'hash con l'estensione check-file, se la supporta.
+        Altrimenti, per gli upload (`reread`), il file remoto viene riletto e
+        hashato; per i download i dati hashati sono gia' quelli letti dal
+        server e basta il controllo della dimensione fatto dal chiamante.
+        """
+        expected = digest.hexdigest()
+        remote = self._remote_checksum(remote_path)
+        if remote is None and reread:
+            remote = self._read_checksum(remote_path)
+        if remote is not None and remote != expected:
+            raise IOError(f"checksum mismatch for {remote_path}: remote {remote} != local {expected}")
+
+    def _remote_checksum(self, remote_path):
+        if self.check_file_supported is False:
+            return None
+        try:
+            with self.sftp.open(remote_path, "rb") as remote_file:
+                data = remote_file.check(VERIFY_HASH, 0, 0, 0)
+        except IOError as e:
+            # Gli altri errori (file sparito, permessi, connessione caduta) non dicono nulla sull'estensione
+            if self.check_file_supported or not _is_unsupported(e):
+                raise
+            self.check_file_supported = False
+            self.log(f"Server does not support check-file, verifying {VERIFY_HASH} by reading files back")
+            return None
+        self.check_file_supported = True
+        return binascii.hexlify(data).decode("ascii")
+
+    def _read_checksum(self, remote_path):
+        digest = hashlib.new(VERIFY_HASH)
+        chunk_size = int(self.tuning["chunk_size"] or CHUNK_SIZE)
+        with self.sftp.open(remote_path, "rb") as remote_file:
+            self._prefetch(remote_file, remote_file.stat().st_size)
+            while True:
+                data = remote_file.read(chunk_size)
+                if not data:
+                    break
+                if self.throttle is not None:
+                    self.throttle.consume(len(data))
+                digest.update(data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _local_digest(path):
+        digest = hashlib.new(VERIFY_HASH)
+        with open(path, "rb") as file:
+            for data in iter(lambda: file.read(CHUNK_SIZE), b""):
+                digest.update(data)
+        return digest
+
+    @staticmethod
+    def _hash_prefix(file_obj, offset, digest):
+        """Aggiunge al digest i primi `offset` byte gia' trasferiti da un tentativo precedente."""
+        file_obj.seek(0)
+        remaining = offset
+        while remaining > 0:
+            data = file_obj.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise IOError("file shorter than the resume offset")
+            digest.update(data)
+            remaining -= len(data)
+
+    def _prefetch(self, remote_file, size):
+        if not self.tuning["prefetch"]:
+            return
+        if self.tuning["prefetch_requests"]:
+            remote_file.prefetch(size, int(self.tuning["prefetch_requests"]))
+        else:
+            remote_file.prefetch(size)
+
+    def _upload_resumable(self, local_file, remote_file, journal, digest=None):
+        """Carica su `<remote_file>.part` riprendendo dall'ultimo offset e rinomina alla fine.
+
+        Il journal conserva dimensione e mtime dell'origine: se il file locale
+        e' cambiato dall'ultimo tentativo il parziale viene ignorato.
+        """
+        temp_file = remote_file + PART_SUFFIX
+        st = os.stat(local_file)
+        source = (st.st_size, st.st_mtime_ns)
+        offset = 0
+        if journal.partial("to_remote", remote_file) == source:
+            try:
+                offset = self.sftp.stat(temp_file).st_size
+            except IOError:
+                offset = 0
+            if offset > st.st_size:
+                offset = 0
+            if offset:
+                self.log(f"Resuming upload of {local_file} at byte {offset}")
+        journal.save_partial("to_remote", remote_file, source, offset)
+
+        with open(local_file, "rb") as src, self.sftp.open(temp_file, "r+b" if offset else "wb") as dst:
+            if digest is not None and offset:
+                self._hash_prefix(src, offset, digest)
+            src.seek(offset)
+            dst.seek(offset)
+            dst.set_pipelined(bool(self.tuning["pipelined"]))
+            self._copy_chunks(src, dst, offset, lambda done: journal.save_partial("to_remote", remote_file, source, done),
+                              digest=digest)
+
+        remote_size = self.sftp.stat(temp_file).st_size
+        if remote_size != st.st_size:
+            raise IOError(f"size mismatch after upload of {local_file}: {remote_size} != {st.st_size}")
+        if digest is not None:
+            # Verificato prima del rename: un file corrotto non compare mai col nome finale
+            try:
+                self._verify_remote(temp_file, digest, reread=True)
+            except IOError:
+                journal.clear_partial("to_remote", remote_file)
+                raise
+        self._rename_remote(temp_file, remote_file)
+        journal.clear_partial("to_remote", remote_file)
+
+    def _download_resumable(self, remote_path, local_path, journal, digest=None):
+        """Scarica su `<local_path>.part` riprendendo dall'ultimo offset e rinomina alla fine."""
+        temp_file = local_path + PART_SUFFIX
+        attr = self.sftp.stat(remote_path)
+        source = (attr.st_size, int(attr.st_mtime or 0))
+        offset = 0
+        if journal.partial("to_local", local_path) == source and os.path.exists(temp_file):
+            offset = os.path.getsize(temp_file)
+            if offset > attr.st_size:
+                offset = 0
+            if offset:
+                self.log(f"Resuming download of {remote_path} at byte {offset}")
+        journal.save_partial("to_local", local_path, source, offset)
+
+        with self.sftp.open(remote_path, "rb") as src, open(temp_file, "r+b" if offset else "wb") as dst:
+            if digest is not None and offset:
+                self._hash_prefix(dst, offset, digest)
+            src.seek(offset)
+            dst.seek(offset)
+            self._prefetch(src, attr.st_size)
+            self._copy_chunks(src, dst, offset, lambda done: journal.save_partial("to_local", local_path, source, done),
+                              digest=digest)
+            dst.truncate()
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        if os.path.getsize(temp_file) != attr.st_size:
+            raise IOError(f"size mismatch after download of {remote_path}")
+        if digest is not None:
+            try:
+                self._verify_remote(remote_path, digest, reread=False)
+            except IOError:
+                journal.clear_partial("to_local", local_path)
+                raise
+        os.replace(temp_file, local_path)
+        journal.clear_partial("to_local", local_path)
+
+    def _copy_chunks(self, src, dst, offset, checkpoint=None, digest=None, length=None):
+        """Copia a blocchi da `src` a `dst`, registrando l'offset ogni CHECKPOINT_EVERY byte.
+
+        Con `digest` i dati vengono hashati mentre passano, senza rileggerli.
+        Con `length` si ferma dopo `length` byte invece che alla fine di `src`.
+        """
+        chunk_size = int(self.tuning["chunk_size"] or CHUNK_SIZE)
+        next_checkpoint = offset + CHECKPOINT_EVERY
+        end = offset + length if length is not None else None
+        while end is None or offset < end:
+            data = src.read(chunk_size if end is None else min(chunk_size, end - offset))
+            if not data:
+                break
+            if digest is not None:
+                digest.update(data)
+            if self.throttle is not None:
+                self.throttle.consume(len(data))
+            dst.write(data)
+            offset += len(data)
+            if checkpoint is not None and offset >= next_checkpoint:
+                dst.flush()
+                checkpoint(offset)
+                next_checkpoint = offset + CHECKPOINT_EVERY
+        return offset
+
+    def upload_stream(self, remote_file, produce):
+        """Carica in `remote_file` i dati che `produce(file)` scrive sul file ricevuto.
+
+        I dati vanno al server man mano che vengono prodotti (es. un archivio
+        tar costruito al volo), senza file temporanei locali; il file remoto
+        passa da `.part` e viene rinominato alla fine. Ritorna i byte inviati.
+        """
+        temp_file = remote_file + PART_SUFFIX
+        try:
+            with self.sftp.open(temp_file, "wb") as dst:
+                dst.set_pipelined(bool(self.tuning["pipelined"]))
+                writer = _StreamWriter(dst, self.throttle)
+                produce(writer)
+            remote_size = self.sftp.stat(temp_file).st_size
+            if remote_size != writer.written:
+                raise IOError(f"size mismatch after upload of {remote_file}: {remote_size} != {writer.written}")
+        except BaseException:
+            try:
+                self.sftp.remove(temp_file)
+            except Exception:
+                pass
+            raise
+        self._rename_remote(temp_file, remote_file)
+        return writer.written
+
+    def exec_command(self, command, timeout=None):
+        """Esegue un comando sul server via SSH, se l'account lo consente; ritorna (exit status, stderr)."""
+        channel = self.transport.open_session()
+        try:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            stderr = channel.makefile_stderr("rb").read().decode("utf-8", "replace")
+            return channel.recv_exit_status(), stderr.strip()
+        finally:
+            channel.close()
+
+    def upload_delta(self, local_file, remote_file, delta, journal=None, verify=False):
+        """Porta `remote_file` alla versione di `local_file` inviando solo i byte nuovi di `delta`.
+
+        `delta` (delta_sync.Delta) descrive il file locale rispetto alla
+        versione remota attuale. Con l'estensione copy-data il file viene
+        ricostruito in `.part` copiando sul server i blocchi riusati, anche se
+        spostati, e poi rinominato. Senza, il file remoto viene aggiornato sul
+        posto e i blocchi spostati vengono reinviati; durante la scrittura il
+        `journal` lo segna come incompleto. Con `verify` lo sha256 del file
+        locale viene confrontato con quello remoto. Ritorna i byte inviati.
+        """
+        self.log(f"Uploading changes of {local_file} to {remote_file}")
+        sent = None
+        if self.copy_data_supported is not False:
+            try:
+                sent = self._upload_rebuild(local_file, remote_file, delta)
+            except _CopyDataUnsupported:
+                pass
+        if sent is None:
+            sent = self._upload_in_place(local_file, remote_file, delta, journal)
+        if verify:
+            self._verify_remote(remote_file, self._local_digest(local_file), reread=True)
+        return sent
+
+    def _upload_rebuild(self, local_file, remote_file, delta):
+        temp_file = remote_file + PART_SUFFIX
+        sent = 0
+        try:
+            with open(local_file, "rb") as src, self.sftp.open(remote_file, "rb") as old, \
+                    self.sftp.open(temp_file, "wb") as dst:
+                dst.set_pipelined(bool(self.tuning["pipelined"]))
+                for offset, length, old_offset in delta.ops:
+                    dst.seek(offset)
+                    if old_offset is None:
+                        src.seek(offset)
+                        sent += self._copy_chunks(src, dst, offset, length=length) - offset
+                    else:
+                        self._copy_data(old, old_offset, length, dst, offset)
+        except _CopyDataUnsupported:
+            try:
+                self.sftp.remove(temp_file)
+            except IOError:
+                pass
+            raise
+        remote_size = self.sftp.stat(temp_file).st_size
+        if remote_size != delta.size:
+            raise IOError(f"size mismatch after delta upload of {local_file}: {remote_size} != {delta.size}")
+        self._rename_remote(temp_file, remote_file)
+        return sent
+
+    def _upload_in_place(self, local_file, remote_file, delta, journal=None):
+        st = os.stat(local_file)
+        if journal is not None:
+            journal.save_partial("delta", remote_file, (st.st_size, st.st_mtime_ns), 0)
+        sent = 0
+        with open(local_file, "rb") as src, self.sftp.open(remote_file, "r+b") as dst:
+            dst.set_pipelined(bool(self.tuning["pipelined"]))
+            for offset, length, old_offset in delta.ops:
+                if old_offset == offset:
+                    continue  # blocco rimasto al suo posto: gia' presente sul server
+                src.seek(offset)
+                dst.seek(offset)
+                sent += self._copy_chunks(src, dst, offset, length=length) - offset
+            dst.flush()
+            dst.truncate(delta.size)
+        remote_size = self.sftp.stat(remote_file).st_size
+        if remote_size != delta.size:
+            raise IOError(f"size mismatch after delta upload of {local_file}: {remote_size} != {delta.size}")
+        if journal is not None:
+            journal.clear_partial("delta", remote_file)
+        return sent
+
+    def _copy_data(self, src, src_offset, length, dst, dst_offset):
+        """Copia `length` byte fra due file aperti senza passare dal client (estensione copy-data)."""
+        try:
+            self.sftp._request(CMD_EXTENDED, "copy-data", src.handle, int64(src_offset), int64(length),
+                               dst.handle, int64(dst_offset))
+        except IOError:
+            if self.copy_data_supported:
+                raise
+            self.copy_data_supported = False
+            self.log("Server does not support copy-data, delta uploads update files in place")
+            raise _CopyDataUnsupported()
+        self.copy_data_supported = True
+
+    def download_delta(self, remote_path, local_path, block_size, verify=False):
+        """Porta `local_path` alla versione di `remote_path` scaricando solo i blocchi diversi.
+
+        Il server calcola gli hash dei blocchi con l'estensione check-file;
+        se non la supporta ritorna None e il chiamante scarica il file intero.
+        La nuova versione viene composta in `.part` a partire da quella
+        locale e rinominata alla fine; con `verify` il suo sha256 viene
+        confrontato con quello remoto prima del rename. Ritorna i byte scaricati.
+        """
+        with self.sftp.open(remote_path, "rb") as src:
+            size = src.stat().st_size
+            hashes = self._block_hashes(src, size, block_size)
+            if hashes is None:
+                return None
+            algorithm, digests = hashes
+            self.log(f"Downloading changes of {remote_path} to {local_path}")
+            temp_file = local_path + PART_SUFFIX
+            fetched = 0
+            try:
+                shutil.copyfile(local_path, temp_file)
+                with open(temp_file, "r+b") as dst:
+                    changed = []
+                    for number, expected in enumerate(digests):
+                        offset = number * block_size
+                        length = min(block_size, size - offset)
+                        dst.seek(offset)
+                        current = dst.read(length)
+                        if len(current) != length or hashlib.new(algorithm, current).digest() != expected:
+                            changed.append((offset, length))
+                    for (offset, length), data in zip(changed, src.readv(changed)):
+                        if self.throttle is not None:
+                            self.throttle.consume(len(data))
+                        dst.seek(offset)
+                        dst.write(data)
+                        fetched += len(data)
+                    dst.truncate(size)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                if verify:
+                    self._verify_remote(remote_path, self._local_digest(temp_file), reread=False)
+                os.replace(temp_file, local_path)
+            except BaseException:
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+                raise
+        return fetched
+
+    def _block_hashes(self, remote_file, size, block_size):
+        """Ritorna (algoritmo, hash di ogni blocco) calcolati dal server, o None senza check-file."""
+        if self.block_hashes_supported is False:
+            return None
+        algorithm = None
+        digests = []
+        step = block_size * BLOCK_HASHES_PER_REQUEST
+        for offset in range(0, size, step):
+            length = min(step, size - offset)
+            try:
+                data = remote_file.check("sha256,sha1,md5", offset, length, block_size)
+            except IOError:
+                if self.block_hashes_supported:
+                    raise
+                self.block_hashes_supported = False
+                self.log("Server does not support check-file block hashes, changed files are downloaded in full")
+                return None
+            self.block_hashes_supported = True
+            blocks = -(-length // block_size)
+            digest_size = len(data) // blocks
+            algorithm = CHECK_FILE_ALGORITHMS.get(digest_size)
+            if algorithm is None or digest_size * blocks != len(data):
+                raise IOError(f"unexpected check-file reply for {blocks} blocks: {len(data)} bytes")
+            digests.extend(data[index:index + digest_size] for index in range(0, len(data), digest_size))
+        return algorithm, digests
+
+    def _rename_remote(self, source, destination):
+        """Rinomina atomicamente; senza l'estensione posix-rename sostituisce il file esistente."""
+        try:
+            self.sftp.posix_rename(source, destination)
+        except IOError:
+            try:
+                self.sftp.remove(destination)
+            except IOError:
+                pass
+            self.sftp.rename(source, destination)
 
     def remove_file(self, remote_file):
         try:
@@ -121,9 +702,40 @@ class SftpClient:
             self.log(f"Failed to delete remote file {remote_file}: {e}")
             raise
 
+    def clone(self):
+        """Ritorna un nuovo client, non connesso, con le stesse credenziali."""
+        client = SftpClient(self.host, self.port, self.username, self.password, self.log_callback, self.tuning)
+        client.throttle = self.throttle
+        client.transforms = self.transforms
+        return client
+
+    def open_channel(self):
+        """Apre un canale SFTP aggiuntivo sullo stesso transport.
+
+        Il client ritornato condivide la connessione: la sua close() chiude
+        solo il canale, non il transport.
+        """
+        channel = self.clone()
+        channel.transport = self.transport
+        channel.sftp = self._open_sftp()
+        channel.owns_transport = False
+        channel.check_file_supported = self.check_file_supported
+        channel.block_hashes_supported = self.block_hashes_supported
+        channel.copy_data_supported = self.copy_data_supported
+        return channel
+
+    def _open_sftp(self):
+        return paramiko.SFTPClient.from_transport(
+            self.transport,
+            window_size=self.tuning["window_size"],
+            max_packet_size=self.tuning["max_packet_size"],
+        )
+
     def close(self):
         if self.sftp:
             self.sftp.close()
+        if not self.owns_transport:
+            return
         if self.transport:
             self.transport.close()
         self.log("SFTP connection closed")
@@ -131,3 +743,26 @@ class SftpClient:
     def log(self, message):
         if self.log_callback:
             self.log_callback(message)
+
+
+class _StreamWriter:
+    """File in sola scrittura passato da upload_stream: conta i byte e applica il limite di banda."""
+
+    def __init__(self, remote_file, throttle=None):
+        self.remote_file = remote_file
+        self.throttle = throttle
+        self.written = 0
+
+    def write(self, data):
+        if self.throttle is not None:
+            self.throttle.consume(len(data))
+        self.remote_file.write(data)
+        self.written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class _CopyDataUnsupported(Exception):
+    """Il server ha rifiutato copy-data: l'upload delta ripiega sull'aggiornamento sul posto."""
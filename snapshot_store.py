@@ -0,0 +1,169 @@
+import time
+import sqlite3
+import threading
+
+SNAPSHOT_FILE = "snapshots.db"
+
+
+class SnapshotStore:
+    """Ultimo stato noto (nome, dimensione, mtime, ...) delle cartelle sincronizzate.
+
+    Ogni cartella e' identificata da profilo e `scope` (es. "remote:/in").
+    Al ciclo successivo lo stato viene caricato in un dict e confrontato con
+    il nuovo elenco; vengono riscritte solo le voci cambiate.
+    """
+
+    def __init__(self, path=SNAPSHOT_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " profile TEXT NOT NULL,"
+            " scope TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " size INTEGER,"
+            " mtime INTEGER,"
+            " inode INTEGER,"
+            " digest TEXT,"
+            " PRIMARY KEY (profile, scope, name)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scopes ("
+            " profile TEXT NOT NULL,"
+            " scope TEXT NOT NULL,"
+            " scanned_at REAL NOT NULL,"
+            " PRIMARY KEY (profile, scope)"
+            ")"
+        )
+        # Firme a blocchi (delta_sync.signature) dei file in modalita' mirror
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            " profile TEXT NOT NULL,"
+            " scope TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " block_size INTEGER NOT NULL,"
+            " data BLOB NOT NULL,"
+            " PRIMARY KEY (profile, scope, name)"
+            ") WITHOUT ROWID"
+        )
+
+    def load(self, profile, scope):
+        """Ritorna {nome: (size, mtime, inode, digest)} per la cartella indicata."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, size, mtime, inode, digest FROM entries WHERE profile = ? AND scope = ?",
+                (profile, scope),
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def write(self, profile, scope, updates, removed=()):
+        """Salva le voci cambiate (`updates`: {nome: fingerprint}) ed elimina quelle sparite."""
+        if not updates and not removed:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (profile, scope, name, size, mtime, inode, digest)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(profile, scope, name) + tuple(fingerprint) for name, fingerprint in updates.items()],
+                )
+                self._conn.executemany(
+                    "DELETE FROM entries WHERE profile = ? AND scope = ? AND name = ?",
+                    [(profile, scope, name) for name in removed],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def was_scanned(self, profile, scope):
+        """True se la cartella e' gia' stata elencata per intero almeno una volta."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM scopes WHERE profile = ? AND scope = ?", (profile, scope)
+            ).fetchone()
+        return row is not None
+
+    def mark_scanned(self, profile, scope):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scopes (profile, scope, scanned_at) VALUES (?, ?, ?)",
+                (profile, scope, time.time()),
+            )
+
+    def signature(self, profile, scope, name):
+        """Ritorna (block_size, firma) salvati per il file, oppure None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT block_size, data FROM signatures WHERE profile = ? AND scope = ? AND name = ?",
+                (profile, scope, name),
+            ).fetchone()
+        return (row[0], bytes(row[1])) if row is not None else None
+
+    def save_signature(self, profile, scope, name, block_size, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO signatures (profile, scope, name, block_size, data) VALUES (?, ?, ?, ?, ?)",
+                (profile, scope, name, block_size, data),
+            )
+
+    def forget_signature(self, profile, scope, name):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM signatures WHERE profile = ? AND scope = ? AND name = ?", (profile, scope, name)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RemoteSnapshot:
+    """Confronta un elenco remoto in streaming con quello del ciclo precedente.
+
+    Una voce viene considerata gestita solo quando il chiamante invoca
+    `mark_done`, cosi' un download fallito viene ritentato al ciclo dopo
+    anche se il file remoto non e' cambiato.
+    """
+
+    def __init__(self, store, profile, remote_dir):
+        self.store = store
+        self.profile = profile
+        self.scope = "remote:" + remote_dir
+        self.previous = store.load(profile, self.scope)
+        self.seen = set()
+        self.updates = {}
+
+    @staticmethod
+    def fingerprint(entry):
+        return (entry.st_size, int(entry.st_mtime or 0), None, None)
+
+    def is_changed(self, entry):
+        self.seen.add(entry.filename)
+        return self.previous.get(entry.filename) != self.fingerprint(entry)
+
+    def mark_done(self, entry):
+        self.updates[entry.filename] = self.fingerprint(entry)
+
+    def save(self, complete=True):
+        """Salva lo snapshot; con un elenco incompleto non elimina le voci non viste."""
+        removed = set(self.previous) - self.seen if complete else ()
+        self.store.write(self.profile, self.scope, self.updates, removed)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store():
+    """Ritorna lo store degli snapshot condiviso dal processo."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore()
+        return _store
@@ -0,0 +1,490 @@
+import os
+import time
+import logging
+import posixpath
+
+from connection_pool import get_pool
+from transfer_ledger import get_ledger, profile_key
+from snapshot_store import RemoteSnapshot, get_snapshot_store
+from local_scanner import LocalScanner, ChangedFile
+from notifications import get_notifier
+from metrics import get_metrics
+import log_store
+from sftp_client import PART_SUFFIX
+from parallel_transfer import ParallelTransfer
+from local_copy import LocalTransfer
+from mirror_sync import MirrorSync
+from batch_transfer import BatchUploader, is_archive, unpack_archive
+from retry_policy import RetryPolicy, HostUnavailable, NETWORK, classify
+from transfer_queue import TransferQueue, ByteBudget
+from bandwidth import limiter_for
+from transform_pipeline import TransformPipeline
+from readiness import gate_for
+from tree_walker import LocalWalker, RemoteWalker, SubtreeReport, get_remote_dirs, local_path, remote_path
+
+TRANSFER_RETRIES = 2  # nuovi tentativi per file nello stesso ciclo, default di "transfer_retries"
+
+
+class SyncEngine:
+    """Esegue un ciclo di sincronizzazione senza dipendere dalla GUI.
+
+    `settings` ha lo stesso formato del file scritto da `save_configuration`,
+    quindi puo' essere letto dai widget nel thread della GUI e passato al
+    worker senza che il worker tocchi mai un QWidget.
+    """
+
+    def __init__(self, settings, log_callback=None, progress_callback=None):
+        self.settings = settings
+        self.log_callback = log_callback
+        self.progress_callback = progress_callback
+        self.deferred = []  # file ancora in scrittura nell'ultimo ciclo, da ricontrollare con run(names)
+        self.recheck_after = 0.0  # secondi dopo i quali ricontrollare `deferred`
+
+    @property
+    def direction(self):
+        return self.settings.get("direction", "to_remote")
+
+    @property
+    def local_dir(self):
+        return self.settings.get("local_dir", "")
+
+    @property
+    def remote_dir(self):
+        return self.settings.get("remote_dir", "")
+
+    @property
+    def profile(self):
+        return profile_key(self.settings)
+
+    @property
+    def recursive(self):
+        """Con "recursive" vengono sincronizzate anche le sottocartelle, con nomi relativi ("a/b/file")."""
+        return bool(self.settings.get("recursive", False))
+
+    @property
+    def delete_after_transfer(self):
+        return bool(self.settings.get("delete_after_transfer", False))
+
+    def connection(self):
+        """Canale SFTP preso dal pool condiviso: la connessione sopravvive al ciclo."""
+        return get_pool().connection(
+            self.settings.get("sftp_host", ""),
+            int(self.settings.get("sftp_port") or 22),
+            self.settings.get("sftp_username", ""),
+            self.settings.get("sftp_password", ""),
+            self.log,
+            self.settings.get("sftp_tuning"),
+        )
+
+    def run(self, names=None):
+        """Esegue un ciclo e ritorna la lista dei file trasferiti.
+
+        Con `names` (es. file segnalati dal watcher) la direzione "to_remote"
+        controlla solo quei file invece di scansionare tutta la cartella.
+        """
+        direction = self.direction
+        if names is not None and direction == "to_remote":
+            self.log(f"Starting synchronization of {len(names)} watched file(s)...")
+        else:
+            names = None
+            self.log("Starting synchronization...")
+        files_transferred = []
+        self.deferred = []
+        start = time.monotonic()
+        result = "ok"
+
+        try:
+            if direction == "local_to_local":
+                files_transferred = self.local_to_local_transfer()
+            else:
+                ledger = get_ledger()
+                limiter = limiter_for(self.settings, self.profile, self.log)
+                waited = limiter.waited if limiter is not None else 0.0
+                with self.connection() as sftp_client:
+                    sftp_client.throttle = limiter
+                    # Il mirror confronta i file per nome fra i due lati: niente trasformazioni
+                    sftp_client.transforms = TransformPipeline.from_settings(self.settings) if direction != "mirror" else None
+                    if direction == "to_remote":
+                        files_transferred = self.upload_new_files(sftp_client, ledger, names)
+                    elif direction == "mirror":
+                        files_transferred = MirrorSync(self, sftp_client).run()
+                    else:
+                        files_transferred = self.download_new_files(sftp_client, ledger)
+                if limiter is not None and limiter.waited - waited >= 1:
+                    self.log(f"Transfers waited {limiter.waited - waited:.1f} s in total for the bandwidth limit")
+
+                # Invia email con i file trasferiti
+                if files_transferred:
+                    self.send_email_with_logs(files_transferred, direction)
+                else:
+                    self.log("No new files were transferred.")
+        except HostUnavailable as e:
+            result = "paused"
+            self.log(f"Skipping synchronization: {e}")
+        except Exception as e:
+            result = "error"
+            self.log(f"Error during synchronization: {e}")
+
+        metrics = get_metrics()
+        metrics.observe("sync_cycle_seconds", time.monotonic() - start, profile=self.profile, direction=direction)
+        metrics.inc("sync_cycles_total", profile=self.profile, direction=direction, result=result)
+        return files_transferred
+
+    def upload_new_files(self, sftp_client, ledger, names=None):
+        scanner = self.local_scanner()
+        # Alla prima scansione il registro evita di ritrasferire lo storico;
+        # dopo, nuovi file con un nome gia' visto vengono trasferiti di nuovo.
+        already_transferred = ledger.names(self.profile, "to_remote") if scanner.first_scan else set()
+        gate = self.readiness_gate()
+        if names is not None and gate is not None:
+            # Il marker scritto dal produttore fa ripartire il file a cui si riferisce
+            names = sorted({gate.marked_name(name) if gate.is_marker(name) else name for name in names})
+        candidates = []
+        for changed_file in (scanner.scan() if names is None else scanner.check(names)):
+            file_name = changed_file.name
+            if file_name.endswith(PART_SUFFIX) or (gate is not None and gate.is_marker(file_name)):
+                continue
+            if changed_file.created and file_name in already_transferred:
+                self.log(f"File already transferred: {file_name}")
+                scanner.mark_done(changed_file)
+                continue
+            candidates.append(changed_file)
+        if gate is not None:
+            # I file ancora in scrittura restano "cambiati": chi esegue il ciclo li ricontrolla dopo recheck_after
+            candidates, self.deferred = self.ready_files(gate, candidates)
+            self.recheck_after = gate.recheck_delay
+
+        changed = {}
+        entries = []
+        for changed_file in candidates:
+            file_name = changed_file.name
+            if not changed_file.created:
+                self.log(f"File modified since last scan: {file_name}")
+            changed[file_name] = changed_file
+            size, mtime_ns = changed_file.fingerprint[:2]
+            destination = remote_path(self.remote_dir, file_name)
+            if sftp_client.transforms is not None:
+                destination += sftp_client.transforms.suffix
+            entries.append(((file_name, changed_file.path, destination), size, mtime_ns / 1e9))
+
+        jobs = list(self.transfer_queue().arrange(self.defer_large_files(entries, sftp_client.throttle), self.log))
+        # Con "batch_small_files" i file piccoli partono raggruppati in archivi tar
+        batcher = BatchUploader.from_settings(self.settings, sftp_client, self.remote_dir, self.log)
+        batches = []
+        if batcher is not None:
+            jobs, batches = batcher.split(jobs)
+        remote_dirs = None
+        if self.recursive:
+            remote_dirs = get_remote_dirs(sftp_client.host, sftp_client.port, sftp_client.username)
+            remote_dirs.ensure(sftp_client, self.remote_dir, {posixpath.dirname(job[0]) for job in jobs},
+                               log_callback=self.log)
+        report = SubtreeReport(self.settings.get("subtree_depth") or 1)
+        files_transferred = []
+        try:
+            for batch in (batcher.run(batches) if batches else ()):
+                files_transferred.extend(self._record_batch(batch, scanner, changed, ledger, report, gate))
+            for result in self.transfer_files(sftp_client, jobs, "to_remote"):
+                report.add(result.name, result.ok)
+                if not result.ok:
+                    self.log(f"Failed to upload {result.name}: {result.error}")
+                    if remote_dirs is not None and isinstance(result.error, FileNotFoundError):
+                        # La cartella remota puo' essere stata cancellata: al prossimo ciclo viene ricreata
+                        remote_dirs.forget(posixpath.dirname(result.destination))
+                    continue
+                try:
+                    ledger.record(self.profile, "to_remote", result.name, result.digest)
+                    scanner.mark_done(changed[result.name])
+                    files_transferred.append(result.name)
+                    self.log(f"Uploaded file: {result.source} to {result.destination}")
+                    if result.digest:
+                        self.log(f"Verified sha256 of {result.name}: {result.digest}")
+
+                    if self.delete_after_transfer:
+                        os.remove(result.source)
+                        if gate is not None:
+                            gate.remove_marker(result.source)
+                        self.log(f"Deleted file {result.source} after upload.")
+                except Exception as e:
+                    self.log(f"Failed to upload {result.name}: {e}")
+        finally:
+            scanner.save()
+        if self.recursive:
+            report.log(self.log)
+        return files_transferred
+
+    def _record_batch(self, batch, scanner, changed, ledger, report, gate=None):
+        """Registra i file di un archivio caricato da BatchUploader e ritorna i loro nomi."""
+        if not batch.ok:
+            for job in batch.members or []:
+                report.add(job[0], False)
+            self.log(f"Failed to upload batch archive {batch.archive}: {batch.error}")
+            return []
+        names = [job[0] for job in batch.members]
+        ledger.record_many(self.profile, "to_remote", names)
+        for name in names:
+            scanner.mark_done(changed[name])
+            report.add(name, True)
+        self.log(f"Uploaded {len(names)} small files in {batch.archive} ({batch.size} bytes"
+                 f"{', unpacked on the server' if batch.unpacked else ''})")
+        if self.delete_after_transfer:
+            deleted = 0
+            for job in batch.members:
+                try:
+                    os.remove(job[1])
+                    if gate is not None:
+                        gate.remove_marker(job[1])
+                    deleted += 1
+                except OSError as e:
+                    self.log(f"Failed to delete {job[1]} after upload: {e}")
+            self.log(f"Deleted {deleted} archived files after upload.")
+        return names
+
+    def readiness_gate(self):
+        return gate_for(self.settings, self.profile, self.log)
+
+    def ready_files(self, gate, changed_files):
+        """Ritorna (ChangedFile completi secondo `gate`, nomi dei file ancora in scrittura)."""
+        ready, writing = gate.ready(changed_files)
+        deferred = len(changed_files) - len(ready)
+        if deferred:
+            self.log(f"Deferred {deferred} file(s) not ready yet (still being written or without marker)")
+        return ready, writing
+
+    def transfer_queue(self):
+        return TransferQueue.from_settings(self.settings)
+
+    def defer_large_files(self, entries, limiter):
+        """Scarta le voci `(job, size, mtime)` troppo grandi per la fascia oraria attiva.
+
+        Non vengono segnate come trasferite, quindi ripartono in un ciclo
+        fuori fascia.
+        """
+        deferred = 0
+        for entry in entries:
+            if limiter is None or limiter.allows(entry[1]):
+                yield entry
+            else:
+                deferred += 1
+        if deferred:
+            self.log(f"Deferred {deferred} file(s) larger than the current transfer window allows")
+
+    def local_scanner(self):
+        return LocalScanner(get_snapshot_store(), self.profile, self.local_dir,
+                            use_hash=bool(self.settings.get("hash_changes", False)),
+                            recursive=self.recursive, log_callback=self.log)
+
+    def download_new_files(self, sftp_client, ledger):
+        snapshot = RemoteSnapshot(get_snapshot_store(), self.profile, self.remote_dir)
+        pending = {}
+        listing_complete = False
+        # Con "recursive" le sottocartelle vengono elencate in parallelo su piu' canali
+        walker = RemoteWalker(sftp_client, self.remote_dir, log_callback=self.log) if self.recursive else None
+        # listdir_iter tiene READDIR in volo fra un elemento e l'altro: un'altra richiesta sullo stesso
+        # canale (download, cancellazione) ne consumerebbe le risposte, quindi l'elenco ha un canale suo
+        lister = sftp_client.open_channel() if walker is None else None
+        local_dirs = set()
+
+        def entries():
+            nonlocal listing_complete
+            # L'elenco arriva in streaming: i download partono mentre il listing e' in corso
+            for file_attr in (walker.walk() if walker is not None else lister.iter_files(self.remote_dir)):
+                file_name = file_attr.filename
+                if file_name.endswith(PART_SUFFIX) or not snapshot.is_changed(file_attr):
+                    continue
+                # Solo i file cambiati rispetto allo snapshot arrivano qui: una ricerca per chiave ciascuno
+                if ledger.contains(self.profile, "to_local", file_name):
+                    self.log(f"File already transferred: {file_name}")
+                    snapshot.mark_done(file_attr)
+                    continue
+                pending[file_name] = file_attr
+                # I file con le estensioni di "transfer_transforms" vengono salvati con il nome originale
+                original = sftp_client.transforms.original_name(file_name) if sftp_client.transforms is not None else None
+                destination = local_path(self.local_dir, original or file_name)
+                parent = os.path.dirname(destination)
+                if walker is not None and parent not in local_dirs:
+                    os.makedirs(parent, exist_ok=True)
+                    local_dirs.add(parent)
+                yield (
+                    (file_name, remote_path(self.remote_dir, file_name), destination),
+                    file_attr.st_size or 0,
+                    file_attr.st_mtime or 0,
+                )
+            listing_complete = walker is None or walker.complete
+
+        # Con l'ordine "fifo" i download partono durante il listing; le altre politiche attendono l'elenco completo
+        jobs = self.transfer_queue().arrange(self.defer_large_files(entries(), sftp_client.throttle), self.log)
+        unpack = bool(self.settings.get("batch_small_files"))
+        report = SubtreeReport(self.settings.get("subtree_depth") or 1)
+        files_transferred = []
+        try:
+            for result in self.transfer_files(sftp_client, jobs, "to_local"):
+                report.add(result.name, result.ok)
+                if not result.ok:
+                    self.log(f"Failed to download {result.name}: {result.error}")
+                    continue
+                try:
+                    if unpack and is_archive(os.path.basename(result.destination)):
+                        # Archivio di file piccoli: si registrano i file estratti, l'archivio sparisce
+                        members = [remote_path(posixpath.dirname(result.name), member) for member in
+                                   unpack_archive(result.destination, os.path.dirname(result.destination))]
+                        os.remove(result.destination)
+                        ledger.record_many(self.profile, "to_local", members + [result.name])
+                        files_transferred.extend(members)
+                        self.log(f"Unpacked {len(members)} files from {result.source}")
+                    else:
+                        ledger.record(self.profile, "to_local", result.name, result.digest)
+                        files_transferred.append(result.name)
+                        self.log(f"Downloaded file: {result.source} to {result.destination}")
+                    snapshot.mark_done(pending.pop(result.name))
+                    if result.digest:
+                        self.log(f"Verified sha256 of {result.name}: {result.digest}")
+
+                    if self.delete_after_transfer:
+                        sftp_client.remove_file(result.source)
+                        self.log(f"Deleted remote file {result.source} after download.")
+                except Exception as e:
+                    self.log(f"Failed to download {result.name}: {e}")
+        finally:
+            if lister is not None:
+                lister.close()
+            snapshot.save(complete=listing_complete)
+        if walker is not None:
+            report.log(self.log)
+        return files_transferred
+
+    def transfer_files(self, sftp_client, jobs, direction):
+        """Trasferisce i job `(name, source, destination)` e ritorna un TransferResult per file.
+
+        Il numero di canali paralleli arriva da `parallel_transfers` (default 1,
+        cioe' sequenziale) e `parallel_transports`. I risultati vengono
+        prodotti nel thread chiamante, quindi registro e cancellazioni restano
+        serializzati anche con piu' worker.
+
+        I file falliti per errori ritentabili vengono ritrasferiti a fine
+        passata, con backoff, fino a `transfer_retries` volte, senza
+        riscansionare la cartella; solo l'ultimo esito viene ritornato.
+        """
+        transfer = ParallelTransfer(
+            sftp_client,
+            workers=self.settings.get("parallel_transfers") or 1,
+            transports=self.settings.get("parallel_transports") or 1,
+            log_callback=self.log,
+            resume_journal=get_ledger() if self.settings.get("resumable_transfers") else None,
+            verify=bool(self.settings.get("verify_transfers", False)),
+            byte_budget=ByteBudget(int(float(self.settings["max_inflight_mb"]) * 1024 * 1024))
+            if self.settings.get("max_inflight_mb") else None,
+        )
+        policy = RetryPolicy(max_attempts=int(self.settings.get("transfer_retries", TRANSFER_RETRIES)) + 1)
+        total = len(jobs) if hasattr(jobs, "__len__") else 0
+        failed = []
+        for index, result in enumerate(transfer.run(jobs, direction), 1):
+            self.progress(result.name, index, total)
+            if not result.ok and self._should_retry(sftp_client, policy, result.error, 1):
+                failed.append(result)
+                continue
+            yield result
+
+        attempt = 1
+        while failed:
+            delay = policy.delay(attempt)
+            attempt += 1
+            self.log(f"Retrying {len(failed)} failed file(s) in {delay:.1f} s (attempt {attempt}/{policy.max_attempts})")
+            get_metrics().inc("transfer_retries_total", len(failed), direction=direction)
+            time.sleep(delay)
+            retry_jobs = [(result.name, result.source, result.destination) for result in failed]
+            failed = []
+            for result in transfer.run(retry_jobs, direction):
+                if not result.ok and self._should_retry(sftp_client, policy, result.error, attempt):
+                    failed.append(result)
+                    continue
+                yield result
+
+    @staticmethod
+    def _should_retry(sftp_client, policy, error, attempt):
+        if not policy.should_retry(error, attempt):
+            return False
+        # Con la connessione caduta i tentativi fallirebbero tutti: li fara' il prossimo ciclo
+        transport = sftp_client.transport
+        return classify(error) != NETWORK or (transport is not None and transport.is_active())
+
+    def local_to_local_transfer(self):
+        src_dir = self.local_dir
+        dest_dir = self.remote_dir
+        files_transferred = []  # Lista per tenere traccia dei file trasferiti
+
+        # Verifica che le directory di origine e destinazione siano valide
+        if not os.path.isdir(src_dir) or not os.path.isdir(dest_dir):
+            self.log("Errore: directory di origine o destinazione non valida.")
+            return files_transferred
+
+        transfer = LocalTransfer(src_dir, dest_dir, workers=self.settings.get("parallel_transfers") or 1,
+                                 move=self.delete_after_transfer)
+        mode = "Moving (rename)" if transfer.rename else ("Moving" if transfer.move else "Transferring")
+        self.log(f"{mode} files from {src_dir} to {dest_dir}...")
+        report = SubtreeReport(self.settings.get("subtree_depth") or 1)
+        try:
+            # Solo i file vengono trasferiti; i .part sono copie in corso
+            if self.recursive:
+                local_files = [(name, path, st) for name, path, st in LocalWalker(src_dir, log_callback=self.log).walk()
+                               if not name.endswith(PART_SUFFIX)]
+            else:
+                local_files = [(entry.name, entry.path, entry.stat()) for entry in os.scandir(src_dir)
+                               if entry.is_file() and not entry.name.endswith(PART_SUFFIX)]
+            gate = self.readiness_gate()
+            if gate is None:
+                local_files = [name for name, _, _ in local_files]
+            else:
+                ready, _ = self.ready_files(gate, [ChangedFile(name, path, (st.st_size, st.st_mtime_ns, st.st_ino, None), True)
+                                                for name, path, st in local_files if not gate.is_marker(name)])
+                local_files = [changed_file.name for changed_file in ready]
+            total = len(local_files)
+            for index, result in enumerate(transfer.run(local_files), 1):
+                self.progress(result.name, index, total)
+                report.add(result.name, result.ok)
+                if not result.ok:
+                    self.log(f"Failed to transfer {result.name}: {result.error}")
+                    continue
+                files_transferred.append(result.name)
+                if transfer.move:
+                    # L'origine viene rimossa file per file, solo dopo che la copia e' al suo posto
+                    if gate is not None:
+                        gate.remove_marker(local_path(src_dir, result.name))
+                    self.log(f"Deleted file {result.name} from {src_dir}")
+
+            self.log(f"Files transferred: {', '.join(files_transferred)}")
+            if self.recursive:
+                report.log(self.log)
+        except Exception as e:
+            self.log(f"Error during local to local transfer: {e}")
+
+        self.log("Local to local transfer complete.")
+        return files_transferred
+
+    def send_email_with_logs(self, files_transferred, direction):
+        if direction == "mirror":
+            subject = "File Mirror Notification"
+            body = "The following files have been synchronized successfully:\n\n" + "\n".join(files_transferred)
+        else:
+            subject = "File Transfer Notification" if direction == "to_remote" else "File Download Notification"
+            body = f"The following files have been {'uploaded' if direction == 'to_remote' else 'downloaded'} successfully:\n\n" + "\n".join(files_transferred)
+
+        # Aggiungi log recenti alla email
+        recent_logs = log_store.recent_logs(20)
+        if recent_logs:
+            body += "\n\nRecent Logs:\n" + recent_logs
+
+        self._send_email(subject, body)
+
+    def _send_email(self, subject, body):
+        # Accodata: il ciclo non attende mai il server di posta
+        get_notifier().notify(self.settings.get("email_settings") or {}, subject, body, self.log)
+
+    def progress(self, file_name, index, total):
+        if self.progress_callback:
+            self.progress_callback(file_name, index, total)
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli del progetto stanno nella cartella principale, non in un package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
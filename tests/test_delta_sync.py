@@ -0,0 +1,101 @@
+import os
+import random
+
+import pytest
+
+from delta_sync import Delta, match_blocks, roll, signature, weak_checksum
+
+BLOCK = 1024
+
+
+def make_data(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def delta_for(tmp_path, old, new, block_size=BLOCK):
+    old_path = tmp_path / "old.bin"
+    new_path = tmp_path / "new.bin"
+    old_path.write_bytes(old)
+    new_path.write_bytes(new)
+    return match_blocks(str(new_path), signature(str(old_path), block_size), len(old), block_size)
+
+
+def rebuild(old, new, delta):
+    """Ricostruisce il file nuovo come farebbe l'altro lato: blocchi vecchi dove possibile, byte nuovi altrove."""
+    out = bytearray()
+    for offset, length, old_offset in delta.ops:
+        assert offset == len(out)  # le operazioni coprono il file senza buchi ne' sovrapposizioni
+        if old_offset is None:
+            out += new[offset:offset + length]
+        else:
+            assert old_offset + length <= len(old)
+            out += old[old_offset:old_offset + length]
+    return bytes(out)
+
+
+def test_roll_matches_checksum_of_shifted_window():
+    data = make_data(4 * BLOCK)
+    weak = weak_checksum(data[:BLOCK])
+    for start in range(1, 2 * BLOCK):
+        weak = roll(weak, data[start - 1], data[start - 1 + BLOCK], BLOCK)
+        assert weak == weak_checksum(data[start:start + BLOCK])
+
+
+def test_unchanged_file_sends_nothing(tmp_path):
+    old = make_data(10 * BLOCK + 300)
+    delta = delta_for(tmp_path, old, old)
+    assert delta.literal_bytes == 0
+    assert delta.moved_bytes == 0
+    assert delta.ops == [(0, len(old), 0)]
+
+
+@pytest.mark.parametrize("position", [0, 1, BLOCK - 1, BLOCK, 5 * BLOCK + 17, 10 * BLOCK])
+def test_inserted_bytes_are_the_only_literal_data(tmp_path, position):
+    old = make_data(10 * BLOCK)
+    inserted = make_data(100, seed=2)
+    new = old[:position] + inserted + old[position:]
+    delta = delta_for(tmp_path, old, new)
+    assert rebuild(old, new, delta) == new
+    # Il blocco in cui cade l'inserimento non coincide piu': al massimo quello piu' i byte nuovi
+    assert len(inserted) <= delta.literal_bytes <= len(inserted) + BLOCK
+
+
+@pytest.mark.parametrize("position", [0, 3 * BLOCK, 3 * BLOCK + 1, 9 * BLOCK])
+def test_removed_bytes_reuse_the_rest(tmp_path, position):
+    old = make_data(10 * BLOCK)
+    new = old[:position] + old[position + 200:]
+    delta = delta_for(tmp_path, old, new)
+    assert rebuild(old, new, delta) == new
+    assert delta.literal_bytes < 2 * BLOCK
+
+
+def test_changed_byte_sends_one_block(tmp_path):
+    old = make_data(10 * BLOCK)
+    new = bytearray(old)
+    new[4 * BLOCK + 10] ^= 0xFF
+    new = bytes(new)
+    delta = delta_for(tmp_path, old, new)
+    assert rebuild(old, new, delta) == new
+    assert delta.literal_bytes == BLOCK
+    assert (4 * BLOCK, BLOCK, None) in delta.ops
+
+
+def test_short_tail_block_is_reused_only_when_unchanged(tmp_path):
+    old = make_data(10 * BLOCK + 300)
+    assert delta_for(tmp_path, old, old[:-1] + bytes([old[-1] ^ 0xFF])).literal_bytes == 300
+    assert delta_for(tmp_path, old, old + b"x").literal_bytes == 301
+
+
+def test_rewritten_file_is_all_literal(tmp_path):
+    old = make_data(10 * BLOCK)
+    new = make_data(10 * BLOCK, seed=3)
+    delta = delta_for(tmp_path, old, new)
+    assert delta.literal_bytes == len(new)
+    assert rebuild(old, new, delta) == new
+
+
+def test_empty_new_file(tmp_path):
+    delta = delta_for(tmp_path, make_data(BLOCK), b"")
+    assert isinstance(delta, Delta)
+    assert delta.size == 0
+    assert delta.ops == []
@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+
+import pytest
+
+import mirror_sync
+from mirror_sync import (MirrorSync, UPLOAD, DOWNLOAD, DELETE_LOCAL, DELETE_REMOTE, FORGET, ADOPT, KEEP_BOTH)
+
+SECOND = 1_000_000_000
+
+
+class FakeLedger:
+    def __init__(self, interrupted=()):
+        self.interrupted = set(interrupted)
+
+    def partial_destinations(self, direction):
+        return self.interrupted
+
+
+def make_mirror(monkeypatch, interrupted=(), **settings):
+    monkeypatch.setattr(mirror_sync, "get_snapshot_store", lambda: None)
+    monkeypatch.setattr(mirror_sync, "get_ledger", lambda: FakeLedger(interrupted))
+    engine = SimpleNamespace(settings=settings, profile="test", local_dir="/local", remote_dir="/remote",
+                             recursive=False, log=lambda message: None)
+    return MirrorSync(engine, sftp_client=None)
+
+
+def local_file(size, mtime):
+    return SimpleNamespace(st_size=size, st_mtime=mtime, st_mtime_ns=mtime * SECOND)
+
+
+def remote_file(size, mtime):
+    return SimpleNamespace(st_size=size, st_mtime=mtime)
+
+
+def synced(mirror, name, size=10, mtime=1000):
+    """Registra `name` come sincronizzato all'ultimo ciclo e ritorna le voci correnti dei due lati."""
+    mirror.base_local[name] = (size, mtime * SECOND, None, None)
+    mirror.base_remote[name] = (size, mtime, None, None)
+    return local_file(size, mtime), remote_file(size, mtime)
+
+
+def test_new_files_go_to_the_other_side(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    actions = mirror.plan({"a.txt": local_file(10, 1000)}, {"b.txt": remote_file(20, 1000)})
+    assert actions == [(UPLOAD, "a.txt"), (DOWNLOAD, "b.txt")]
+
+
+def test_unchanged_files_are_left_alone(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    st, attr = synced(mirror, "a.txt")
+    assert mirror.plan({"a.txt": st}, {"a.txt": attr}) == []
+
+
+def test_change_on_one_side_is_copied(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    st_a, attr_a = synced(mirror, "a.txt")
+    st_b, attr_b = synced(mirror, "b.txt")
+    actions = mirror.plan({"a.txt": local_file(11, 2000), "b.txt": st_b},
+                          {"a.txt": attr_a, "b.txt": remote_file(12, 2000)})
+    assert actions == [(UPLOAD, "a.txt"), (DOWNLOAD, "b.txt")]
+
+
+def test_deletions_are_propagated(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    st_a, attr_a = synced(mirror, "gone-locally.txt")
+    st_b, attr_b = synced(mirror, "gone-remotely.txt")
+    synced(mirror, "keep.txt")
+    actions = mirror.plan({"gone-remotely.txt": st_b, "keep.txt": local_file(10, 1000)},
+                          {"gone-locally.txt": attr_a, "keep.txt": remote_file(10, 1000)})
+    assert actions == [(DELETE_REMOTE, "gone-locally.txt"), (DELETE_LOCAL, "gone-remotely.txt")]
+
+
+def test_deletions_are_restored_with_restore_policy(monkeypatch):
+    mirror = make_mirror(monkeypatch, mirror_deletes="restore")
+    st_a, attr_a = synced(mirror, "gone-locally.txt")
+    st_b, attr_b = synced(mirror, "gone-remotely.txt")
+    actions = mirror.plan({"gone-remotely.txt": st_b}, {"gone-locally.txt": attr_a})
+    assert actions == [(DOWNLOAD, "gone-locally.txt"), (UPLOAD, "gone-remotely.txt")]
+
+
+def test_modification_wins_over_deletion(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    synced(mirror, "a.txt")
+    synced(mirror, "b.txt")
+    actions = mirror.plan({"b.txt": local_file(11, 2000)}, {"a.txt": remote_file(12, 2000)})
+    assert actions == [(DOWNLOAD, "a.txt"), (UPLOAD, "b.txt")]
+
+
+def test_deleted_on_both_sides_is_forgotten(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    synced(mirror, "a.txt")
+    synced(mirror, "b.txt")
+    st_b, attr_b = local_file(10, 1000), remote_file(10, 1000)
+    assert mirror.plan({"b.txt": st_b}, {"b.txt": attr_b}) == [(FORGET, "a.txt")]
+
+
+@pytest.mark.parametrize("complete", [False, True])
+def test_unreliable_listing_deletes_nothing(monkeypatch, complete):
+    mirror = make_mirror(monkeypatch)
+    st, attr = synced(mirror, "a.txt")
+    synced(mirror, "b.txt")
+    # Elenco locale incompleto, oppure vuoto quando prima non lo era (es. disco non montato)
+    local = {"a.txt": st} if not complete else {}
+    remote = {"a.txt": attr, "b.txt": remote_file(10, 1000)}
+    assert mirror.plan(local, remote, local_complete=complete) == []
+
+
+@pytest.mark.parametrize("policy, local_mtime, expected", [
+    ("newer", 3000, UPLOAD),
+    ("newer", 2000, DOWNLOAD),
+    ("local", 2000, UPLOAD),
+    ("remote", 3000, DOWNLOAD),
+    ("keep_both", 3000, KEEP_BOTH),
+])
+def test_conflicts_follow_the_policy(monkeypatch, policy, local_mtime, expected):
+    mirror = make_mirror(monkeypatch, mirror_conflicts=policy)
+    synced(mirror, "a.txt")
+    actions = mirror.plan({"a.txt": local_file(11, local_mtime)}, {"a.txt": remote_file(12, 2500)})
+    assert actions == [(expected, "a.txt")]
+    assert mirror.counts["conflicts"] == 1
+
+
+def test_identical_new_files_are_adopted(monkeypatch):
+    mirror = make_mirror(monkeypatch)
+    actions = mirror.plan({"a.txt": local_file(10, 1000)}, {"a.txt": remote_file(10, 1001)})
+    assert actions == [(ADOPT, "a.txt")]
+
+
+def test_interrupted_delta_upload_sends_the_whole_file(monkeypatch):
+    mirror = make_mirror(monkeypatch, interrupted={"/remote/a.db"})
+    st, attr = synced(mirror, "a.db", size=4096)
+    # Il server ha una copia scritta a meta' e piu' recente: non deve vincere come modifica remota
+    actions = mirror.plan({"a.db": local_file(4096, 2000)}, {"a.db": remote_file(4096, 3000)})
+    assert actions == [(UPLOAD, "a.db")]
+    assert mirror.counts["conflicts"] == 0
@@ -0,0 +1,167 @@
+import io
+import os
+import random
+import struct
+
+import pytest
+
+import transform_pipeline
+from transform_pipeline import (TransformPipeline, GzipTransform, ZstdTransform, EncryptTransform,
+                                ENCRYPTION_MAGIC, NONCE_PREFIX_SIZE, RECORD_SIZE)
+
+KEY = bytes(range(32))
+
+needs_zstd = pytest.mark.skipif(transform_pipeline.zstandard is None, reason="zstandard is not installed")
+needs_crypto = pytest.mark.skipif(transform_pipeline.AESGCM is None, reason="cryptography is not installed")
+
+
+def sample(size=3 * RECORD_SIZE + 123):
+    """Dati in parte comprimibili e in parte casuali, su piu' record cifrati."""
+    text = b"fattura;cliente;importo\n" * (size // 48)
+    return (text + random.Random(7).randbytes(size))[:size]
+
+
+def reader(data, chunk_size=10000):
+    stream = io.BytesIO(data)
+    return lambda: stream.read(chunk_size)
+
+
+def encode(pipeline, data):
+    out = bytearray()
+    pipeline.encode(reader(data), out.extend)
+    return bytes(out)
+
+
+def decode(pipeline, data):
+    out = bytearray()
+    pipeline.decode(reader(data), out.extend)
+    return bytes(out)
+
+
+PIPELINES = {
+    "gzip": lambda: [GzipTransform()],
+    "zstd": pytest.param(lambda: [ZstdTransform()], marks=needs_zstd),
+    "encrypt": pytest.param(lambda: [EncryptTransform(KEY)], marks=needs_crypto),
+    "gzip+encrypt": pytest.param(lambda: [GzipTransform(), EncryptTransform(KEY)], marks=needs_crypto),
+    "zstd+encrypt": pytest.param(lambda: [ZstdTransform(), EncryptTransform(KEY)], marks=[needs_zstd, needs_crypto]),
+}
+
+
+def pipelines():
+    return pytest.mark.parametrize("transforms", list(PIPELINES.values()), ids=list(PIPELINES))
+
+
+@pipelines()
+@pytest.mark.parametrize("data", [b"", b"x", sample()], ids=["empty", "one-byte", "multi-record"])
+def test_round_trip(transforms, data):
+    pipeline = TransformPipeline(transforms())
+    encoded = encode(pipeline, data)
+    assert decode(pipeline, encoded) == data
+
+
+@pipelines()
+def test_encoding_writer_matches_encode(transforms):
+    pipeline = TransformPipeline(transforms())
+    data = sample()
+    out = bytearray()
+    writer = pipeline.encoding_writer(out.extend)
+    for offset in range(0, len(data), 777):
+        writer.write(data[offset:offset + 777])
+    writer.close()
+    assert decode(pipeline, bytes(out)) == data
+
+
+@pipelines()
+@pytest.mark.parametrize("cut", [1, 100, RECORD_SIZE])
+def test_truncated_stream_raises(transforms, cut):
+    pipeline = TransformPipeline(transforms())
+    encoded = encode(pipeline, sample())
+    with pytest.raises(ValueError):
+        decode(pipeline, encoded[:-cut])
+
+
+@needs_crypto
+def test_tampered_record_raises():
+    from cryptography.exceptions import InvalidTag
+    pipeline = TransformPipeline([EncryptTransform(KEY)])
+    encoded = bytearray(encode(pipeline, sample()))
+    encoded[len(encoded) // 2] ^= 0x01
+    with pytest.raises(InvalidTag):
+        decode(pipeline, bytes(encoded))
+
+
+@needs_crypto
+def test_wrong_key_raises():
+    from cryptography.exceptions import InvalidTag
+    encoded = encode(TransformPipeline([EncryptTransform(KEY)]), sample())
+    with pytest.raises(InvalidTag):
+        decode(TransformPipeline([EncryptTransform(bytes(32))]), encoded)
+
+
+@needs_crypto
+def test_reordered_records_raise():
+    from cryptography.exceptions import InvalidTag
+    pipeline = TransformPipeline([EncryptTransform(KEY)])
+    encoded = encode(pipeline, sample())
+    start = len(ENCRYPTION_MAGIC) + NONCE_PREFIX_SIZE
+    records = []
+    offset = start
+    while offset < len(encoded):
+        (value,) = struct.unpack_from(">I", encoded, offset)
+        end = offset + 4 + (value & 0x7FFFFFFF)
+        records.append(encoded[offset:end])
+        offset = end
+    assert len(records) > 2
+    swapped = encoded[:start] + records[1] + records[0] + b"".join(records[2:])
+    with pytest.raises(InvalidTag):
+        decode(pipeline, swapped)
+
+
+@needs_crypto
+def test_data_after_last_record_raises():
+    pipeline = TransformPipeline([EncryptTransform(KEY)])
+    encoded = encode(pipeline, b"short file")
+    with pytest.raises(ValueError):
+        decode(pipeline, encoded + encoded[len(ENCRYPTION_MAGIC) + NONCE_PREFIX_SIZE:])
+
+
+@needs_crypto
+def test_plain_file_is_not_decrypted():
+    with pytest.raises(ValueError):
+        decode(TransformPipeline([EncryptTransform(KEY)]), b"just a plain text file, not encrypted")
+
+
+def test_gzip_output_is_readable_by_gzip():
+    import gzip
+    data = sample()
+    assert gzip.decompress(encode(TransformPipeline([GzipTransform()]), data)) == data
+
+
+@needs_crypto
+def test_suffix_and_original_name(tmp_path):
+    key_file = tmp_path / "key"
+    key_file.write_bytes(KEY)
+    pipeline = TransformPipeline.from_settings({"transfer_transforms": "gzip, encrypt",
+                                                "encryption_key_file": str(key_file)})
+    assert pipeline.suffix == ".gz.enc"
+    assert pipeline.original_name("report.csv.gz.enc") == "report.csv"
+    assert pipeline.original_name("report.csv") is None
+    assert pipeline.original_name(".gz.enc") is None
+
+
+def test_from_settings_rejects_bad_configuration():
+    assert TransformPipeline.from_settings({}) is None
+    with pytest.raises(ValueError):
+        TransformPipeline.from_settings({"transfer_transforms": ["rot13"]})
+    with pytest.raises(ValueError):
+        TransformPipeline.from_settings({"transfer_transforms": ["encrypt"]})
+
+
+@needs_crypto
+def test_key_file_accepts_base64(tmp_path):
+    import base64
+    key_file = tmp_path / "key"
+    key_file.write_bytes(base64.b64encode(KEY) + b"\n")
+    assert EncryptTransform.from_file(str(key_file)).key == KEY
+    with pytest.raises(ValueError):
+        EncryptTransform(os.urandom(10))
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+LEDGER_FILE = "transfer_ledger.db"
+LEGACY_TRANSFER_LOG_FILE = "transfer_log.json"
+LEGACY_PROFILE = "*"  # voci migrate da transfer_log.json, valide per ogni profilo
+COMPACT_EVERY = 7 * 86400  # secondi fra una compattazione automatica e l'altra
+
+
+def profile_key(settings):
+    """Identifica un profilo di trasferimento a partire dalla sua configurazione."""
+    if settings.get("profile_name"):
+        return settings["profile_name"]
+    return "{user}@{host}:{port}|{local}|{remote}".format(
+        user=settings.get("sftp_username", ""),
+        host=settings.get("sftp_host", ""),
+        port=settings.get("sftp_port", ""),
+        local=settings.get("local_dir", ""),
+        remote=settings.get("remote_dir", ""),
+    )
+
+
+class TransferLedger:
+    """Registro dei file gia' trasferiti, per profilo e direzione.
+
+    I dati stanno in un database SQLite in modalita' WAL: ogni file
+    trasferito e' un singolo INSERT (nessuna riscrittura del registro) e la
+    ricerca usa la chiave primaria. Piu' finestre o processi possono
+    condividere lo stesso file senza sovrascriversi a vicenda.
+    """
+
+    def __init__(self, path=LEDGER_FILE, legacy_path=LEGACY_TRANSFER_LOG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transfers ("
+            " profile TEXT NOT NULL,"
+            " direction TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " transferred_at REAL NOT NULL,"
+            " PRIMARY KEY (profile, direction, name)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS partial_transfers ("
+            " direction TEXT NOT NULL,"
+            " destination TEXT NOT NULL,"
+            " source_size INTEGER NOT NULL,"
+            " source_mtime INTEGER NOT NULL,"
+            " confirmed_offset INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (direction, destination)"
+            ")"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(transfers)")}
+        if "digest" not in columns:
+            # Registri creati prima della verifica dei trasferimenti
+            self._conn.execute("ALTER TABLE transfers ADD COLUMN digest TEXT")
+        if legacy_path:
+            self.migrate_json(legacy_path)
+        self.maybe_compact()
+
+    def contains(self, profile, direction, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM transfers WHERE profile IN (?, ?) AND direction = ? AND name = ? LIMIT 1",
+                (profile, LEGACY_PROFILE, direction, name),
+            ).fetchone()
+        return row is not None
+
+    def names(self, profile, direction):
+        """Ritorna l'insieme dei nomi gia' trasferiti, per confronti O(1) durante un ciclo."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM transfers WHERE profile IN (?, ?) AND direction = ?",
+                (profile, LEGACY_PROFILE, direction),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record(self, profile, direction, name, digest=None):
+        """Registra un file trasferito; `digest` e' lo sha256 verificato, se disponibile."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transfers (profile, direction, name, transferred_at, digest)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (profile, direction, name, time.time(), digest),
+            )
+
+    def record_many(self, profile, direction, names):
+        """Registra in una sola transazione piu' file trasferiti insieme (es. i membri di un archivio)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO transfers (profile, direction, name, transferred_at, digest)"
+                    " VALUES (?, ?, ?, ?, NULL)",
+                    [(profile, direction, name, now) for name in names],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def digest(self, profile, direction, name):
+        """Ritorna lo sha256 registrato per il file, o None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM transfers WHERE profile IN (?, ?) AND direction = ? AND name = ?"
+                " ORDER BY profile = ? DESC LIMIT 1",
+                (profile, LEGACY_PROFILE, direction, name, profile),
+            ).fetchone()
+        return row[0] if row else None
+
+    def forget(self, profile, direction, name):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM transfers WHERE profile IN (?, ?) AND direction = ? AND name = ?",
+                (profile, LEGACY_PROFILE, direction, name),
+            )
+
+    def partial(self, direction, destination):
+        """Ritorna (size, mtime) dell'origine di un trasferimento interrotto, o None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_size, source_mtime FROM partial_transfers WHERE direction = ? AND destination = ?",
+                (direction, destination),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def save_partial(self, direction, destination, source, offset):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO partial_transfers"
+                " (direction, destination, source_size, source_mtime, confirmed_offset, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (direction, destination, source[0], source[1], offset, time.time()),
+            )
+
+    def partial_destinations(self, direction):
+        """Destinazioni con un trasferimento interrotto nella direzione indicata."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT destination FROM partial_transfers WHERE direction = ?", (direction,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def clear_partial(self, direction, destination):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM partial_transfers WHERE direction = ? AND destination = ?", (direction, destination)
+            )
+
+    def migrate_json(self, legacy_path):
+        """Importa una volta sola il vecchio transfer_log.json e lo rinomina in .migrated."""
+        if not os.path.exists(legacy_path) or self._get_meta("migrated_json"):
+            return 0
+        with open(legacy_path, "r") as file:
+            legacy = json.load(file)
+
+        now = time.time()
+        rows = [
+            (LEGACY_PROFILE, direction, name, now)
+            for direction, names in legacy.items()
+            for name in names
+        ]
+        with self._lock:
+            # Tutto o niente: un file legacy non valido non lascia il registro importato a meta'
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO transfers (profile, direction, name, transferred_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)", (str(now),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        os.replace(legacy_path, legacy_path + ".migrated")
+        return len(rows)
+
+    def compact(self, max_age_days=None):
+        """Elimina facoltativamente le voci piu' vecchie di `max_age_days` e compatta il database.
+
+        Le voci servono a non ritrasferire i file rimasti nell'origine, per cui
+        di default non viene eliminato nulla.
+        """
+        with self._lock:
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                self._conn.execute("DELETE FROM transfers WHERE transferred_at < ?", (cutoff,))
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_compaction', ?)", (str(time.time()),)
+            )
+
+    def maybe_compact(self):
+        last = self._get_meta("last_compaction")
+        if last is None:
+            self._set_meta("last_compaction", str(time.time()))
+        elif time.time() - float(last) > COMPACT_EVERY:
+            self.compact()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Ritorna il registro dei trasferimenti condiviso dal processo."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = TransferLedger()
+        return _ledger
@@ -0,0 +1,94 @@
+import time
+import fnmatch
+import threading
+
+ORDERS = ("fifo", "smallest_first", "oldest_first")
+
+
+class ByteBudget:
+    """Limita i byte in trasferimento contemporaneamente.
+
+    Un file piu' grande del limite parte comunque, ma solo quando non c'e'
+    nient'altro in volo.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self.in_flight and self.in_flight + size > self.limit:
+                self._cond.wait()
+            self.in_flight += size
+
+    def release(self, size):
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+
+class TransferQueue:
+    """Ordina i file da trasferire secondo la politica del profilo.
+
+    L'ordine e', nell'ordine:
+
+    1. priorita' per nome (`priority_patterns`, es. {"INV_*.xml": 10}), la piu' alta prima;
+    2. file oltre la scadenza (`transfer_deadline` secondi dalla modifica), il piu' in ritardo prima;
+    3. `transfer_order`: "smallest_first", "oldest_first" oppure "fifo" (ordine dell'elenco).
+
+    Con "fifo" e senza priorita' o scadenza i job passano in streaming,
+    senza attendere la fine dell'elenco.
+    """
+
+    def __init__(self, order="fifo", patterns=None, deadline=None):
+        if order not in ORDERS:
+            raise ValueError(f"unknown transfer order {order!r}, expected one of {', '.join(ORDERS)}")
+        self.order = order
+        if isinstance(patterns, dict):
+            patterns = patterns.items()
+        self.patterns = [(pattern, int(priority)) for pattern, priority in (patterns or [])]
+        self.deadline = float(deadline) if deadline else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            order=settings.get("transfer_order") or "fifo",
+            patterns=settings.get("priority_patterns"),
+            deadline=settings.get("transfer_deadline"),
+        )
+
+    @property
+    def streaming(self):
+        return self.order == "fifo" and not self.patterns and self.deadline is None
+
+    def priority(self, name):
+        return max((priority for pattern, priority in self.patterns if fnmatch.fnmatch(name, pattern)), default=0)
+
+    def arrange(self, entries, log_callback=None):
+        """`entries` sono tuple `(job, size, mtime)`; ritorna i job `(name, source, destination, size)` in ordine."""
+        if self.streaming:
+            return ((job[0], job[1], job[2], size) for job, size, mtime in entries)
+
+        now = time.time()
+        keyed = []
+        overdue = 0
+        for position, (job, size, mtime) in enumerate(entries):
+            late = 0.0
+            if self.deadline is not None and mtime:
+                late = now - mtime - self.deadline
+                if late > 0:
+                    overdue += 1
+            if self.order == "smallest_first":
+                policy_key = size
+            elif self.order == "oldest_first":
+                policy_key = mtime or 0
+            else:
+                policy_key = position
+            key = (-self.priority(job[0]), 0 if late > 0 else 1, -late if late > 0 else 0, policy_key, position)
+            keyed.append((key, (job[0], job[1], job[2], size)))
+        keyed.sort(key=lambda item: item[0])
+        if overdue and log_callback:
+            log_callback(f"{overdue} file(s) past the {self.deadline:.0f} s transfer deadline are sent first")
+        return [job for _, job in keyed]
@@ -0,0 +1,376 @@
+"""Trasformazioni in streaming dei file trasferiti: compressione e cifratura al volo.
+
+Con "transfer_transforms" (es. ["zstd", "encrypt"]) ogni upload legge il
+file a blocchi, lo passa alle trasformazioni nell'ordine indicato e scrive
+il risultato direttamente sul file remoto, senza copie temporanee; il nome
+remoto prende le estensioni delle trasformazioni ("report.csv.zst.enc").
+I download dei file con quelle estensioni applicano le trasformazioni
+inverse in ordine opposto e salvano il file con il nome originale.
+
+Ogni stadio gira in un thread del pool, collegato agli altri da code
+limitate: lettura, compressione e cifratura (zlib, zstd e AES-GCM
+rilasciano il GIL) si sovrappongono all'invio in rete.
+"""
+import os
+import zlib
+import queue
+import base64
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # facoltativo, serve solo per la trasformazione "zstd"
+    zstandard = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # facoltativo, serve solo per la trasformazione "encrypt"
+    AESGCM = None
+
+QUEUE_DEPTH = 4  # blocchi in attesa fra uno stadio e il successivo
+RECORD_SIZE = 64 * 1024  # byte in chiaro per record cifrato
+ENCRYPTION_MAGIC = b"FTPENC1\n"
+NONCE_PREFIX_SIZE = 8  # il resto del nonce di 12 byte e' il numero del record
+TAG_SIZE = 16
+FINAL_RECORD = 0x80000000  # bit alto della lunghezza: ultimo record del file
+
+_RECORD_HEADER = struct.Struct(">I")
+_END = object()
+
+
+class GzipTransform:
+    name = "gzip"
+    suffix = ".gz"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def encoder(self):
+        return _ZlibEncoder(self.level)
+
+    def decoder(self):
+        return _ZlibDecoder()
+
+
+class ZstdTransform:
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise RuntimeError("the zstandard package is required for the zstd transfer transform")
+        self.level = level
+
+    def encoder(self):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        return _Coder(compressor.compress, compressor.flush)
+
+    def decoder(self):
+        return _ZstdDecoder()
+
+
+class EncryptTransform:
+    """AES-GCM a record: ogni RECORD_SIZE byte in chiaro diventano un record autenticato.
+
+    Il file inizia con ENCRYPTION_MAGIC e un prefisso casuale del nonce; ogni
+    record e' `lunghezza (4 byte) + testo cifrato con tag`, con la
+    lunghezza come dato autenticato e il bit FINAL_RECORD sull'ultimo,
+    quindi un file troncato, riordinato o modificato non si decifra.
+    """
+
+    name = "encrypt"
+    suffix = ".enc"
+
+    def __init__(self, key):
+        if AESGCM is None:
+            raise RuntimeError("the cryptography package is required for the encrypt transfer transform")
+        if len(key) not in (16, 24, 32):
+            raise ValueError("encryption key must be 16, 24 or 32 bytes")
+        self.key = key
+
+    @classmethod
+    def from_file(cls, path):
+        """Chiave letta da file: byte grezzi oppure testo base64."""
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) not in (16, 24, 32):
+            data = base64.b64decode(data.strip())
+        return cls(data)
+
+    def encoder(self):
+        return _Encryptor(self.key)
+
+    def decoder(self):
+        return _Decryptor(self.key)
+
+
+TRANSFORMS = {"gzip": GzipTransform, "zstd": ZstdTransform, "encrypt": EncryptTransform}
+
+
+class _Coder:
+    """Stadio della pipeline: `update(dati) -> byte prodotti`, `finish() -> byte finali`."""
+
+    def __init__(self, update, finish):
+        self.update = update
+        self.finish = finish
+
+
+class _ZlibEncoder(_Coder):
+    def __init__(self, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: formato gzip, leggibile con gunzip
+        super().__init__(compressor.compress, compressor.flush)
+
+
+class _ZlibDecoder:
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(31)
+
+    def update(self, data):
+        return self.decompressor.decompress(data)
+
+    def finish(self):
+        data = self.decompressor.flush()
+        if not self.decompressor.eof:
+            raise ValueError("gzip stream is truncated")
+        return data
+
+
+class _ZstdDecoder:
+    def __init__(self):
+        self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def update(self, data):
+        return self.decompressor.decompress(data)
+
+    def finish(self):
+        if not self.decompressor.eof:
+            raise ValueError("zstd stream is truncated")
+        return b""
+
+
+class _Encryptor:
+    def __init__(self, key):
+        self.aead = AESGCM(key)
+        self.prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.counter = 0
+        self.buffer = bytearray()
+        self.started = False
+
+    def update(self, data):
+        self.buffer += data
+        out = [self._start()]
+        while len(self.buffer) > RECORD_SIZE:
+            out.append(self._record(bytes(self.buffer[:RECORD_SIZE]), False))
+            del self.buffer[:RECORD_SIZE]
+        return b"".join(out)
+
+    def finish(self):
+        return self._start() + self._record(bytes(self.buffer), True)
+
+    def _start(self):
+        if self.started:
+            return b""
+        self.started = True
+        return ENCRYPTION_MAGIC + self.prefix
+
+    def _record(self, plain, final):
+        header = _RECORD_HEADER.pack((len(plain) + TAG_SIZE) | (FINAL_RECORD if final else 0))
+        nonce = self.prefix + struct.pack(">I", self.counter)
+        self.counter += 1
+        return header + self.aead.encrypt(nonce, plain, header)
+
+
+class _Decryptor:
+    def __init__(self, key):
+        self.aead = AESGCM(key)
+        self.prefix = None
+        self.counter = 0
+        self.buffer = bytearray()
+        self.done = False
+
+    def update(self, data):
+        self.buffer += data
+        if self.prefix is None:
+            start = len(ENCRYPTION_MAGIC) + NONCE_PREFIX_SIZE
+            if len(self.buffer) < start:
+                return b""
+            if self.buffer[:len(ENCRYPTION_MAGIC)] != ENCRYPTION_MAGIC:
+                raise ValueError("not an encrypted transfer file")
+            self.prefix = bytes(self.buffer[len(ENCRYPTION_MAGIC):start])
+            del self.buffer[:start]
+        out = []
+        while len(self.buffer) >= _RECORD_HEADER.size:
+            if self.done:
+                raise ValueError("data after the last encrypted record")
+            (value,) = _RECORD_HEADER.unpack_from(self.buffer)
+            length = value & ~FINAL_RECORD
+            if length > RECORD_SIZE + TAG_SIZE:
+                raise ValueError("corrupted encrypted record")
+            end = _RECORD_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            header = bytes(self.buffer[:_RECORD_HEADER.size])
+            nonce = self.prefix + struct.pack(">I", self.counter)
+            self.counter += 1
+            out.append(self.aead.decrypt(nonce, bytes(self.buffer[_RECORD_HEADER.size:end]), header))
+            del self.buffer[:end]
+            self.done = bool(value & FINAL_RECORD)
+        return b"".join(out)
+
+    def finish(self):
+        if not self.done or self.buffer:
+            raise ValueError("encrypted transfer file is truncated")
+        return b""
+
+
+class _EncodingWriter:
+    def __init__(self, coders, write):
+        self.coders = coders
+        self.target = write
+
+    def write(self, data):
+        size = len(data)
+        for coder in self.coders:
+            data = coder.update(data)
+            if not data:
+                return size
+        self.target(data)
+        return size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        data = b""
+        for coder in self.coders:
+            data = (coder.update(data) if data else b"") + coder.finish()
+        if data:
+            self.target(data)
+
+
+class _Stopped(Exception):
+    """Un altro stadio e' fallito: questo si ferma senza aggiungere errori."""
+
+
+def _put(target, item, stop):
+    while True:
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            if stop.is_set():
+                raise _Stopped()
+
+
+def _get(source, stop):
+    while True:
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                raise _Stopped()
+
+
+class TransformPipeline:
+    def __init__(self, transforms):
+        self.transforms = list(transforms)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Pipeline di "transfer_transforms"; None se non ce ne sono.
+
+        "encrypt" legge la chiave da "encryption_key_file".
+        """
+        names = settings.get("transfer_transforms") or []
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(",") if name.strip()]
+        if not names:
+            return None
+        transforms = []
+        for name in names:
+            if name not in TRANSFORMS:
+                raise ValueError(f"unknown transfer transform {name!r}, expected one of {', '.join(TRANSFORMS)}")
+            if name == "encrypt":
+                if not settings.get("encryption_key_file"):
+                    raise ValueError("the encrypt transfer transform requires encryption_key_file")
+                transforms.append(EncryptTransform.from_file(settings["encryption_key_file"]))
+            else:
+                transforms.append(TRANSFORMS[name]())
+        return cls(transforms)
+
+    @property
+    def suffix(self):
+        """Estensioni aggiunte al nome remoto, es. ".zst.enc"."""
+        return "".join(transform.suffix for transform in self.transforms)
+
+    def original_name(self, name):
+        """Nome senza le estensioni della pipeline, None se `name` non le ha."""
+        suffix = self.suffix
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+        return None
+
+    def encode(self, read, write):
+        """Chiama `read()` fino a b"", trasforma i dati e li passa a `write(dati)`."""
+        self._run([transform.encoder() for transform in self.transforms], read, write)
+
+    def decode(self, read, write):
+        self._run([transform.decoder() for transform in reversed(self.transforms)], read, write)
+
+    def encoding_writer(self, write):
+        """File su cui scrivere dati in chiaro: vengono trasformati e passati a `write` nel thread chiamante.
+
+        Serve a chi produce i dati a spinta (es. tarfile); `close()` chiude gli
+        stadi e va chiamato solo se la scrittura e' andata a buon fine.
+        """
+        return _EncodingWriter([transform.encoder() for transform in self.transforms], write)
+
+    @staticmethod
+    def _run(coders, read, write):
+        """Lettura e stadi girano nel pool; `write` nel thread chiamante, che di solito scrive in rete."""
+        stop = threading.Event()
+        chain = [queue.Queue(QUEUE_DEPTH) for _ in range(len(coders) + 1)]
+
+        def produce():
+            for data in iter(read, b""):
+                _put(chain[0], data, stop)
+            _put(chain[0], _END, stop)
+
+        def stage(coder, source, target):
+            while True:
+                data = _get(source, stop)
+                if data is _END:
+                    # Niente blocchi vuoti: un decoder zstd gia' alla fine del frame li rifiuta
+                    data = coder.finish()
+                    if data:
+                        _put(target, data, stop)
+                    _put(target, _END, stop)
+                    return
+                data = coder.update(data)
+                if data:
+                    _put(target, data, stop)
+
+        with ThreadPoolExecutor(max_workers=len(coders) + 1, thread_name_prefix="transform") as executor:
+            futures = [executor.submit(produce)]
+            futures += [executor.submit(stage, coder, chain[index], chain[index + 1])
+                        for index, coder in enumerate(coders)]
+            for future in futures:
+                future.add_done_callback(lambda future: stop.set() if future.exception() else None)
+            try:
+                while True:
+                    data = _get(chain[-1], stop)
+                    if data is _END:
+                        break
+                    if data:
+                        write(data)
+            except _Stopped:
+                pass
+            except BaseException:
+                stop.set()
+                raise
+        for future in futures:
+            error = future.exception()
+            if error is not None and not isinstance(error, _Stopped):
+                raise error
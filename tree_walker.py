@@ -0,0 +1,283 @@
+import os
+import abc
+import stat
+import time
+import queue
+import logging
+import posixpath
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import get_metrics
+
+WALK_WORKERS = 4  # cartelle elencate (o create) in parallelo
+
+
+def local_path(root, name):
+    """Percorso locale del nome relativo `name` ("cliente/2024/file.xml")."""
+    return os.path.join(root, *name.split("/"))
+
+
+def remote_path(root, name):
+    return posixpath.join(root, name)
+
+
+def _join(parent, name):
+    return f"{parent}/{name}" if parent else name
+
+
+@contextmanager
+def _channels(sftp_client, count):
+    """Coda di `count` canali SFTP aperti sul transport di `sftp_client`, chiusi all'uscita."""
+    channels = queue.Queue()
+    opened = []
+    try:
+        for _ in range(count):
+            channel = sftp_client.open_channel()
+            opened.append(channel)
+            channels.put(channel)
+        yield channels
+    finally:
+        for channel in opened:
+            channel.close()
+
+
+class TreeWalker(abc.ABC):
+    """Elenca ricorsivamente un albero di cartelle con `workers` thread.
+
+    Ogni cartella viene elencata da un thread del pool e le sottocartelle
+    trovate vengono accodate subito, quindi rami diversi dell'albero sono
+    elencati in parallelo. I file vengono prodotti appena la loro cartella
+    e' stata elencata, con il nome relativo alla radice ("a/b/file").
+
+    Un errore sulla radice viene rilanciato; un errore su una sottocartella
+    viene registrato e la cartella saltata, e `complete` resta False.
+    """
+
+    def __init__(self, root, workers=WALK_WORKERS, log_callback=None):
+        self.root = root
+        self.workers = max(1, int(workers))
+        self.log_callback = log_callback
+        self.directories = 0
+        self.files = 0
+        self.errors = 0
+        self.complete = False
+
+    def walk(self):
+        start = time.monotonic()
+        with self._listers() as list_dir:
+            executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tree-walk")
+            try:
+                pending = {executor.submit(self._list, list_dir, "")}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, subdirs = future.result()
+                        for subdir in subdirs:
+                            pending.add(executor.submit(self._list, list_dir, subdir))
+                        self.directories += 1
+                        self.files += len(files)
+                        yield from files
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        self.complete = not self.errors
+        self._record(time.monotonic() - start)
+        self.log(f"Listed {self.files} files in {self.directories} directories under {self.root}")
+
+    def _list(self, list_dir, relative):
+        try:
+            return list_dir(relative)
+        except Exception as e:
+            if not relative:
+                raise
+            self.errors += 1
+            self.log(f"Error listing {relative} in {self.root}: {e}")
+            return [], []
+
+    @abc.abstractmethod
+    def _listers(self):
+        """Context manager che fornisce la funzione `list_dir(relativa) -> (file, sottocartelle)` usata dai thread."""
+
+    def _record(self, elapsed):
+        pass
+
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+        else:
+            logging.info(message)
+
+
+class LocalWalker(TreeWalker):
+    """Albero locale; produce tuple `(nome relativo, percorso, os.stat_result)` dei soli file regolari."""
+
+    @contextmanager
+    def _listers(self):
+        yield self._list_dir
+
+    def _list_dir(self, relative):
+        files = []
+        subdirs = []
+        with os.scandir(local_path(self.root, relative) if relative else self.root) as entries:
+            for entry in entries:
+                name = _join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(name)
+                elif entry.is_file():
+                    files.append((name, entry.path, entry.stat()))
+        return files, subdirs
+
+
+class RemoteWalker(TreeWalker):
+    """Albero remoto; produce SFTPAttributes con `filename` relativo alla radice.
+
+    Ogni thread lavora su un proprio canale SFTP aperto sul transport di
+    `sftp_client`, quindi le READDIR di cartelle diverse sono in volo
+    contemporaneamente.
+    """
+
+    def __init__(self, sftp_client, root, workers=WALK_WORKERS, log_callback=None):
+        super().__init__(root, workers, log_callback)
+        self.sftp_client = sftp_client
+
+    @contextmanager
+    def _listers(self):
+        with _channels(self.sftp_client, self.workers) as channels:
+            def list_dir(relative):
+                channel = channels.get()
+                try:
+                    return self._list_dir(channel, relative)
+                finally:
+                    channels.put(channel)
+            yield list_dir
+
+    def _list_dir(self, channel, relative):
+        files = []
+        subdirs = []
+        for entry in channel.sftp.listdir_iter(remote_path(self.root, relative) if relative else self.root):
+            entry.filename = _join(relative, entry.filename)
+            if stat.S_ISDIR(entry.st_mode or 0):
+                subdirs.append(entry.filename)
+            else:
+                files.append(entry)
+        return files, subdirs
+
+    def _record(self, elapsed):
+        metrics = get_metrics()
+        metrics.observe("sftp_listing_seconds", elapsed, host=self.sftp_client.host)
+        metrics.set("sftp_listing_entries", self.files, host=self.sftp_client.host)
+
+
+class RemoteDirs:
+    """Cartelle remote gia' create o trovate, ricordate fra un ciclo e l'altro.
+
+    `ensure` crea le cartelle mancanti un livello di profondita' alla volta,
+    con tutte quelle dello stesso livello create in parallelo; quelle gia'
+    note non vengono piu' ne' create ne' controllate con stat.
+    """
+
+    def __init__(self):
+        self.known = set()
+        self._lock = threading.Lock()
+
+    def ensure(self, sftp_client, root, directories, workers=WALK_WORKERS, log_callback=None):
+        """Crea sotto `root` le cartelle relative `directories` (e i loro genitori); ritorna quante ne ha create."""
+        missing = set()
+        with self._lock:
+            for directory in directories:
+                while directory and remote_path(root, directory) not in self.known and directory not in missing:
+                    missing.add(directory)
+                    directory = posixpath.dirname(directory)
+        if not missing:
+            return 0
+
+        levels = {}
+        for directory in missing:
+            levels.setdefault(directory.count("/"), []).append(remote_path(root, directory))
+        created = 0
+        with _channels(sftp_client, min(workers, max(len(level) for level in levels.values()))) as channels, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="remote-mkdir") as executor:
+            def make(path):
+                channel = channels.get()
+                try:
+                    return self._make(channel, path)
+                finally:
+                    channels.put(channel)
+
+            for depth in sorted(levels):
+                for path, result in zip(levels[depth], executor.map(make, levels[depth])):
+                    if isinstance(result, Exception):
+                        # I file sotto questa cartella falliranno e verranno ritentati al prossimo ciclo
+                        if log_callback:
+                            log_callback(f"Failed to create remote directory {path}: {result}")
+                        continue
+                    created += result
+                    with self._lock:
+                        self.known.add(path)
+        if created and log_callback:
+            log_callback(f"Created {created} remote director{'y' if created == 1 else 'ies'} under {root}")
+        return created
+
+    @staticmethod
+    def _make(channel, path):
+        """1 se la cartella e' stata creata, 0 se esisteva gia', l'eccezione se non esiste e non e' creabile."""
+        try:
+            channel.sftp.mkdir(path)
+            return 1
+        except IOError as e:
+            try:
+                if stat.S_ISDIR(channel.sftp.stat(path).st_mode or 0):
+                    return 0
+            except IOError:
+                pass
+            return e
+
+    def forget(self, path):
+        """Dimentica `path`, i suoi genitori e le sue sottocartelle, es. dopo un upload fallito perche' la cartella e' sparita.
+
+        Non si sa quale livello sia stato cancellato: al giro dopo `ensure` li
+        ricontrolla tutti.
+        """
+        with self._lock:
+            self.known = {known for known in self.known
+                          if not known.startswith(path + "/") and not (path + "/").startswith(known + "/")}
+
+
+_remote_dirs = {}
+_remote_dirs_lock = threading.Lock()
+
+
+def get_remote_dirs(host, port, username):
+    """Ritorna la cache delle cartelle remote condivisa dal processo per host, porta e utente.
+
+    Utenti diversi sullo stesso server possono avere chroot o home diverse,
+    quindi le stesse cartelle relative non sono le stesse cartelle.
+    """
+    key = f"{username}@{host}:{port}"
+    with _remote_dirs_lock:
+        dirs = _remote_dirs.get(key)
+        if dirs is None:
+            dirs = _remote_dirs[key] = RemoteDirs()
+        return dirs
+
+
+class SubtreeReport:
+    """Conta file trasferiti e falliti per sottoalbero (le prime `depth` cartelle del nome)."""
+
+    def __init__(self, depth=1):
+        self.depth = max(1, int(depth))
+        self.counts = {}
+
+    def add(self, name, ok):
+        subtree = "/".join(name.split("/")[:-1][:self.depth]) or "."
+        counts = self.counts.setdefault(subtree, [0, 0])
+        counts[0 if ok else 1] += 1
+
+    def lines(self):
+        return [f"{subtree}: {ok} transferred, {failed} failed"
+                for subtree, (ok, failed) in sorted(self.counts.items())]
+
+    def log(self, log_callback):
+        for line in self.lines():
+            log_callback(f"Subtree {line}")